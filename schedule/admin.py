@@ -1,9 +1,21 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.db.models import Count, Q
+from django.http import Http404
+from django.shortcuts import get_object_or_404, redirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.html import format_html
 
 from convention import get_convention_model
 from convention.admin import ConventionListFilter
 
-from .models import Panel, PanelSchedule, Attendee, Room, RoomSchedule, Track
+from . import events
+from .cache import bump_schedule_version
+from .forms import BulkScheduleFormSet
+from .models import Panel, PanelSchedule, Room, RoomSchedule, ScheduleSnapshot, Track
+from .signals import panelschedule_data
 
 Convention = get_convention_model()
 
@@ -13,27 +25,126 @@ class PanelScheduleInline(admin.TabularInline):
     exclude = ['start_timestamp', 'end_timestamp']
 
 
-class PanelAttendeesInline(admin.TabularInline):
-    model = Attendee
-    can_delete = False
-    extra = 0
-    max_num = 0
-    fields = ['attended', 'feedback']
-    readonly_fields = ['attended', 'feedback']
-
-    def get_queryset(self, request):
-        queryset = super().get_queryset(request)
-        return queryset.exclude(feedback=None)
-
-
 class PanelAdmin(admin.ModelAdmin):
-    list_display = ('title', 'track', 'room')
+    change_list_template = 'admin/schedule/panel/change_list.html'
+    list_display = ('title', 'track', 'room', 'star_count', 'hide_count', 'attended_count')
     list_filter = (ConventionListFilter, 'track', 'room', 'schedule__day')
     search_fields = ['title', 'hosts', 'description', 'notes']
-    inlines = [PanelScheduleInline, PanelAttendeesInline]
+    inlines = [PanelScheduleInline]
+    # Feedback is summarized with a link to the export, rather than
+    # loading every Attendee row into the form
+    readonly_fields = ['feedback_summary']
 
     filter_convention = None
 
+    def feedback_summary(self, obj):
+        if not obj or not obj.pk:
+            return '-'
+        counts = obj.attendee_set.aggregate(
+            attended=Count('id', filter=Q(attended=True)),
+            feedback=Count('id', filter=Q(feedback__isnull=False) & ~Q(feedback='')),
+        )
+        return format_html(
+            '{} attended, {} left feedback. <a href="{}?panel={}">Download feedback</a>',
+            counts['attended'], counts['feedback'], reverse('schedule_feedback_export'), obj.pk)
+    feedback_summary.short_description = 'feedback'
+
+    def get_urls(self):
+        return [
+            path('bulk-schedule/', self.admin_site.admin_view(self.bulk_schedule_view),
+                 name='schedule_panel_bulk_schedule'),
+        ] + super().get_urls()
+
+    def bulk_schedule_view(self, request):
+        '''
+        Edit the room, day and times of every panel showing for a
+        convention in one table. The whole table is validated together,
+        then the changes are saved with bulk_update in one transaction.
+        '''
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        if 'convention' in request.GET:
+            try:
+                convention = get_object_or_404(Convention, pk=request.GET['convention'])
+            except ValueError:
+                raise Http404()
+        else:
+            convention = Convention.objects.current()
+            if convention is None:
+                raise Http404()
+
+        panelschedules = list(PanelSchedule.objects.select_related(
+            'panel', 'panel__track', 'panel__room'
+        ).filter(panel__convention=convention).order_by('day', 'start_time', 'panel__room__sort_order'))
+        rooms = list(Room.objects.filter(convention=convention))
+        initial = [{
+            'id': panelschedule.id,
+            'room': panelschedule.panel.room_id,
+            'day': panelschedule.day,
+            'start_time': panelschedule.start_time,
+            'end_time': panelschedule.end_time,
+            # Shown alongside, not edited
+            'panel_id': panelschedule.panel_id,
+            'title': panelschedule.panel.title,
+            'track': panelschedule.panel.track.name,
+            'hidden': panelschedule.panel.hidden,
+        } for panelschedule in panelschedules]
+
+        if request.method == 'POST':
+            formset = BulkScheduleFormSet(request.POST, initial=initial, rooms=rooms)
+            if formset.is_valid():
+                changed = self.save_bulk_schedule(convention, panelschedules, formset)
+                messages.success(request, '{} panel times updated.'.format(len(changed)))
+                return redirect(request.get_full_path())
+        else:
+            formset = BulkScheduleFormSet(initial=initial, rooms=rooms)
+
+        return TemplateResponse(request, 'admin/schedule/panel/bulk_schedule.html', {
+            **self.admin_site.each_context(request),
+            'title': 'Edit schedule for {}'.format(convention.name),
+            'opts': self.model._meta,
+            'convention': convention,
+            'formset': formset,
+        })
+
+    def save_bulk_schedule(self, convention, panelschedules, formset):
+        '''
+        Save the changed rows from a valid bulk schedule formset, returning
+        the changed PanelSchedules. bulk_update() skips the model signals,
+        so the schedule version and live events are handled here.
+        '''
+        by_id = {panelschedule.id: panelschedule for panelschedule in panelschedules}
+        changed_schedules = []
+        changed_panels = {}
+        for form in formset.forms:
+            if not form.has_changed():
+                continue
+            data = form.cleaned_data
+            panelschedule = by_id[data['id']]
+            panel = panelschedule.panel
+            if panel.room_id != data['room']:
+                panel.room_id = data['room']
+                changed_panels[panel.id] = panel
+            panelschedule.day = data['day']
+            panelschedule.start_time = data['start_time']
+            panelschedule.end_time = data['end_time']
+            changed_schedules.append(panelschedule)
+
+        with transaction.atomic():
+            Panel.objects.bulk_update(changed_panels.values(), ['room'])
+            PanelSchedule.objects.bulk_update(changed_schedules, ['day', 'start_time', 'end_time'])
+
+        if changed_schedules:
+            bump_schedule_version(convention.pk)
+            # The rooms changed, so panel.room needs loading again
+            rooms = {room.id: room for room in Room.objects.filter(convention=convention)}
+            for panelschedule in changed_schedules:
+                panel = panelschedule.panel
+                panel.room = rooms[panel.room_id]
+                if not panel.hidden:
+                    events.publish(convention.pk, 'panel_moved', panelschedule_data(panelschedule, panel))
+        return changed_schedules
+
     def get_form(self, request, obj=None, **kwargs):
         if obj:
             self.filter_convention = obj.convention
@@ -95,3 +206,16 @@ class TrackAdmin(admin.ModelAdmin):
 
 
 admin.site.register(Track, TrackAdmin)
+
+
+class ScheduleSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('convention', 'year', 'created')
+    fields = ['convention', 'year', 'created']
+    readonly_fields = ['convention', 'year', 'created']
+
+    def has_add_permission(self, request):
+        # Snapshots are made with the archive_schedule command
+        return False
+
+
+admin.site.register(ScheduleSnapshot, ScheduleSnapshotAdmin)
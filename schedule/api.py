@@ -0,0 +1,189 @@
+import base64
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.exceptions import BadRequest
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.db.models.functions import ExtractHour, ExtractMinute
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import PanelSchedule
+from .utils import contime
+
+# Every key a JSON API event can have; room openings have no hosts or room
+EVENT_FIELDS = ('title', 'description', 'hosts', 'start', 'end', 'room', 'track', 'type')
+EVENT_TYPES = ('panel', 'room')
+
+# Query parameters that ask for a slice rather than the whole schedule
+QUERY_PARAMS = ('from', 'to', 'day', 'room', 'track', 'type', 'fields', 'limit', 'cursor')
+
+
+def con_minutes_expression(field):
+    '''
+    Database version of utils.con_minutes for a TimeField, plus the day,
+    giving minutes since midnight on the Monday of the convention's week.
+    The same as where start_timestamp and end_timestamp land.
+    '''
+    after_midnight = Case(
+        When(**{field + '__lt': time(contime.day_transition_hour())}, then=Value(24 * 60)),
+        default=Value(0), output_field=IntegerField())
+    return F('day') * (24 * 60) + ExtractHour(field) * 60 + ExtractMinute(field) + after_midnight
+
+
+class EventQuery(object):
+    '''
+    A slice of the schedule asked for in the JSON API's query string:
+    - from, to: ISO 8601 date and times (or 'now'), for events overlapping them
+    - day: a day name, like saturday, in the schedule's day order
+    - room: a room name
+    - track: a track name, given more than once for several tracks
+    - type: panel or room, for just panels or just room openings
+    - fields: comma separated event keys to include, from EVENT_FIELDS
+    - limit: page size, up to SCHEDULE_API_MAX_PAGE_SIZE
+    - cursor: the next value from the previous page
+
+    Everything's filtered and ordered in the database, by start time,
+    and a page fetches at most limit + 1 of each kind of event.
+    Raises BadRequest for anything it can't make sense of.
+    '''
+
+    def __init__(self, params, convention):
+        self.convention = convention
+        monday = convention.start_date - timedelta(days=convention.start_date.weekday())
+        self.monday = datetime.combine(monday, time(0)).replace(tzinfo=timezone.get_current_timezone())
+
+        self.start = self.parse_time(params, 'from')
+        self.end = self.parse_time(params, 'to')
+
+        self.day = None
+        if params.get('day'):
+            days = {name.lower(): number for number, name in PanelSchedule.WEEKDAYS}
+            if params['day'].lower() not in days:
+                raise BadRequest('Unknown day.')
+            self.day = days[params['day'].lower()]
+
+        self.room = params.get('room') or None
+        self.tracks = [track for track in params.getlist('track') if track]
+
+        self.types = EVENT_TYPES
+        if params.get('type'):
+            if params['type'] not in EVENT_TYPES:
+                raise BadRequest('type should be panel or room.')
+            self.types = (params['type'],)
+
+        self.fields = EVENT_FIELDS
+        if params.get('fields'):
+            self.fields = tuple(field for field in params['fields'].split(',') if field)
+            if not self.fields or set(self.fields) - set(EVENT_FIELDS):
+                raise BadRequest('fields should be some of: ' + ', '.join(EVENT_FIELDS))
+
+        max_limit = getattr(settings, 'SCHEDULE_API_MAX_PAGE_SIZE', 500)
+        try:
+            self.limit = int(params.get('limit') or getattr(settings, 'SCHEDULE_API_PAGE_SIZE', 100))
+        except ValueError:
+            raise BadRequest('limit should be a number.')
+        self.limit = min(max(self.limit, 1), max_limit)
+
+        self.cursor = None
+        if params.get('cursor'):
+            self.cursor = self.decode_cursor(params['cursor'])
+
+    @classmethod
+    def from_params(cls, params, convention):
+        '''An EventQuery if any of its parameters were given, else None'''
+        if not any(param in params for param in QUERY_PARAMS):
+            return None
+        return cls(params, convention)
+
+    def parse_time(self, params, name):
+        '''Minutes since the convention's Monday for a time parameter'''
+        value = params.get(name)
+        if not value:
+            return None
+        if value == 'now':
+            moment = timezone.now()
+        else:
+            try:
+                moment = parse_datetime(value)
+            except ValueError:
+                moment = None
+            if moment is None:
+                raise BadRequest('{} should be an ISO 8601 date and time.'.format(name))
+            if timezone.is_naive(moment):
+                moment = timezone.make_aware(moment)
+        # Both in the schedule's time zone, so this counts wall clock
+        # minutes just like the schedule's own timestamps do
+        moment = timezone.localtime(moment).replace(tzinfo=self.monday.tzinfo)
+        return int((moment - self.monday).total_seconds() // 60)
+
+    def encode_cursor(self, start_at, kind, item_id):
+        value = '{}:{}:{}'.format(start_at, kind, item_id)
+        return base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            value = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+            start_at, kind, item_id = value.split(':')
+            return int(start_at), int(kind), int(item_id)
+        except ValueError:
+            raise BadRequest('Invalid cursor.')
+
+    def filter(self, panelschedules, roomschedules):
+        '''Narrow down the view's querysets to this page of the slice'''
+        return (self.filter_kind(panelschedules, 0, 'panel', 'panel__room__name', 'panel__track__name'),
+                self.filter_kind(roomschedules, 1, 'room', 'room__name', 'room__track__name'))
+
+    def filter_kind(self, queryset, kind, type_name, room_field, track_field):
+        if type_name not in self.types:
+            return queryset.none()
+        queryset = queryset.annotate(
+            start_at=con_minutes_expression('start_time'),
+            end_at=con_minutes_expression('end_time'),
+        )
+        if self.start is not None:
+            queryset = queryset.filter(end_at__gt=self.start)
+        if self.end is not None:
+            queryset = queryset.filter(start_at__lt=self.end)
+        if self.day is not None:
+            queryset = queryset.filter(day=self.day)
+        if self.room:
+            queryset = queryset.filter(**{room_field: self.room})
+        if self.tracks:
+            queryset = queryset.filter(**{track_field + '__in': self.tracks})
+        if self.cursor is not None:
+            # Pick up after the cursor: by start, then panels before room
+            # openings, then by id
+            start_at, cursor_kind, item_id = self.cursor
+            if kind < cursor_kind:
+                queryset = queryset.filter(start_at__gt=start_at)
+            elif kind == cursor_kind:
+                queryset = queryset.filter(Q(start_at__gt=start_at) | Q(start_at=start_at, id__gt=item_id))
+            else:
+                queryset = queryset.filter(start_at__gte=start_at)
+
+        # Don't load the long text that isn't wanted
+        deferred = []
+        if 'description' not in self.fields:
+            deferred.append(type_name + '__description')
+        if 'hosts' not in self.fields and type_name == 'panel':
+            deferred.append('panel__hosts')
+        if deferred:
+            queryset = queryset.defer(*deferred)
+        return queryset.order_by('start_at', 'id')[:self.limit + 1]
+
+    def page(self, panelschedules, roomschedules):
+        '''
+        Merge the loaded panels and room openings into start time order,
+        cut to the page size. Returns the items and the next page's
+        cursor, or None if this is the last page.
+        '''
+        items = sorted(
+            [(item.start_at, 0, item.id, item) for item in panelschedules] +
+            [(item.start_at, 1, item.id, item) for item in roomschedules],
+            key=lambda entry: entry[:3])
+        cursor = None
+        if len(items) > self.limit:
+            items = items[:self.limit]
+            cursor = self.encode_cursor(*items[-1][:3])
+        return [entry[3] for entry in items], cursor
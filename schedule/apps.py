@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ScheduleConfig(AppConfig):
     name = 'schedule'
+
+    def ready(self):
+        # Connect the schedule change signal receivers
+        from . import signals
@@ -0,0 +1,128 @@
+import hashlib
+import logging
+import pickle
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from convention import get_convention_model
+
+from . import metrics
+from .models import Panel, PanelSchedule, Room, RoomSchedule, ScheduleSnapshot, Track
+
+ARCHIVE_CACHE_KEY = 'schedule:archive:{year}:{format}'
+
+# Bump when what's packed into a snapshot changes shape
+SNAPSHOT_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot_format():
+    '''
+    Identifies what a snapshot's pickled model instances look like: the
+    snapshot version plus the fields of each model in them. Old pickles
+    of a model that's since gained or lost a field come back broken, so
+    snapshots of another format aren't served until they're frozen again.
+    '''
+    parts = [str(SNAPSHOT_VERSION)]
+    for model in (get_convention_model(), Track, Room, Panel, PanelSchedule, RoomSchedule):
+        parts.append('{}:{}'.format(model._meta.label, ','.join(
+            sorted(field.attname for field in model._meta.concrete_fields))))
+    return hashlib.md5(';'.join(parts).encode()).hexdigest()
+
+
+def load_uncached(view):
+    '''Run a view's schedule queries, bypassing the shared caches'''
+    view.filter_panels_rooms()
+    view.panelschedules = list(view.panelschedules)
+    view.roomschedules = list(view.roomschedules)
+    return (view.panelschedules, view.roomschedules)
+
+
+def freeze_convention(convention, year=None):
+    '''
+    Load and pack the full schedule for a convention, then store the
+    packed structures along with the JSON and ICS feeds as a snapshot.
+    Returns the ScheduleSnapshot.
+    '''
+    # Avoid a circular import, the views need the models
+    from .views import ScheduleGrid, ScheduleICS, ScheduleJSON, ScheduleList
+
+    if year is None:
+        year = convention.start_date.year
+
+    packed = {
+        'convention': convention,
+        'tracks': list(Track.objects.filter(convention=convention)),
+    }
+    # Archived schedules are always the complete view; everything is in
+    # the past, so the default filters would leave nothing to show. Read
+    # straight from the database, not load_panels_rooms, since the cached
+    # partitions may be older than whatever's being frozen.
+    for name, view_class in (('list', ScheduleList), ('grid', ScheduleGrid)):
+        view = view_class.for_convention(convention)
+        load_uncached(view)
+        packed[name] = view.pack_struct()
+
+    feed = ScheduleICS.for_convention(convention)
+    # Both feeds can share the same lists
+    panelschedules, roomschedules = load_uncached(feed)
+    ics = feed.serialize(panelschedules, roomschedules)
+    json = ScheduleJSON.for_convention(convention).serialize(panelschedules, roomschedules)
+
+    with transaction.atomic():
+        snapshot, created = ScheduleSnapshot.objects.update_or_create(
+            convention=convention,
+            defaults={
+                'year': year,
+                'format': snapshot_format(),
+                'packed': pickle.dumps(packed),
+                'json': json,
+                'ics': ics,
+            },
+        )
+    cache.delete(ARCHIVE_CACHE_KEY.format(year=year, format=snapshot_format()))
+
+    return snapshot
+
+
+def get_snapshot(year):
+    '''
+    Fetch the frozen schedule for a given year, as a dict with 'packed',
+    'json' and 'ics' keys. Kept in the cache indefinitely after the first
+    load, since archived schedules never change short of re-freezing.
+    Returns None if that year was never archived, or if its snapshot is
+    from before a change to the models and needs freezing again with the
+    archive_schedule command.
+    '''
+    current_format = snapshot_format()
+    key = ARCHIVE_CACHE_KEY.format(year=year, format=current_format)
+    frozen = cache.get(key)
+    metrics.cache_result('archive', frozen is not None)
+    if frozen is not None:
+        return frozen
+
+    try:
+        snapshot = ScheduleSnapshot.objects.get(year=year)
+    except ScheduleSnapshot.DoesNotExist:
+        return None
+
+    if snapshot.format != current_format:
+        logger.warning('Archived schedule for %s is out of date, re-run archive_schedule', year)
+        return None
+    try:
+        packed = pickle.loads(bytes(snapshot.packed))
+    except (AttributeError, ImportError, TypeError, pickle.UnpicklingError):
+        logger.warning('Archived schedule for %s is unreadable, re-run archive_schedule', year)
+        return None
+
+    frozen = {
+        'packed': packed,
+        'json': snapshot.json,
+        'ics': bytes(snapshot.ics),
+        'created': snapshot.created,
+    }
+    cache.set(key, frozen, timeout=getattr(settings, 'SCHEDULE_ARCHIVE_CACHE_TIMEOUT', None))
+    return frozen
@@ -0,0 +1,97 @@
+import gzip
+import hashlib
+import json
+
+from .cache import cached_for_version
+from .models import PanelSchedule, RoomSchedule, Track
+from .utils import con_minutes
+
+BUNDLE_VERSION = 1
+
+# Field order of the bundle's records, also sent along in the bundle
+PANEL_FIELDS = ['id', 'panel', 'title', 'description', 'hosts', 'room', 'track', 'day', 'start', 'end']
+ROOM_HOURS_FIELDS = ['id', 'room', 'day', 'start', 'end']
+
+
+class StringTable:
+    '''Numbers each distinct string as it's first seen'''
+    def __init__(self):
+        self.strings = []
+        self.index = {}
+
+    def __call__(self, value):
+        value = value or ''
+        if value not in self.index:
+            self.index[value] = len(self.strings)
+            self.strings.append(value)
+        return self.index[value]
+
+
+def build_bundle(convention):
+    '''
+    The convention's whole schedule as compact JSON for offline use. Room,
+    track and host names are string tables that records index into, times
+    are con minutes (see utils.con_minutes) on a weekday, and panel and
+    room opening records are plain arrays, fields as listed in the bundle.
+    Returns a dict of the content hash, the JSON and a gzipped copy.
+    '''
+    rooms, hosts = StringTable(), StringTable()
+    tracks = list(Track.objects.filter(convention=convention))
+    track_index = {track.id: i for i, track in enumerate(tracks)}
+
+    # Put everything in order first, so the string tables come out the
+    # same, and so does the hash; by day and con minutes, so after
+    # midnight goes last
+    panelschedules = sorted(
+        PanelSchedule.objects.select_related('panel', 'panel__room').filter(
+            panel__convention=convention, panel__hidden=False),
+        key=lambda item: (item.day, con_minutes(item.start_time), item.id))
+    roomschedules = sorted(
+        RoomSchedule.objects.select_related('room').filter(room__convention=convention),
+        key=lambda item: (item.day, con_minutes(item.start_time), item.id))
+
+    panels = [[
+        panelschedule.id,
+        panelschedule.panel_id,
+        panelschedule.panel.title,
+        panelschedule.panel.description or '',
+        hosts(panelschedule.panel.hosts),
+        rooms(panelschedule.panel.room.name),
+        track_index[panelschedule.panel.track_id],
+        panelschedule.day,
+        con_minutes(panelschedule.start_time),
+        con_minutes(panelschedule.end_time),
+    ] for panelschedule in panelschedules]
+
+    room_hours = [[
+        roomschedule.id,
+        rooms(roomschedule.room.name),
+        roomschedule.day,
+        con_minutes(roomschedule.start_time),
+        con_minutes(roomschedule.end_time),
+    ] for roomschedule in roomschedules]
+
+    content = {
+        'version': BUNDLE_VERSION,
+        'convention': convention.name,
+        'start_date': convention.start_date.isoformat(),
+        'rooms': rooms.strings,
+        'tracks': [[track.name, track.class_name, track.color] for track in tracks],
+        'hosts': hosts.strings,
+        'panel_fields': PANEL_FIELDS,
+        'panels': panels,
+        'room_hours_fields': ROOM_HOURS_FIELDS,
+        'room_hours': room_hours,
+    }
+    body = json.dumps(content, separators=(',', ':'), ensure_ascii=False).encode()
+    return {
+        'hash': hashlib.sha256(body).hexdigest()[:16],
+        'body': body,
+        # mtime fixed so the same schedule always gzips the same
+        'gzip': gzip.compress(body, compresslevel=9, mtime=0),
+    }
+
+
+def get_bundle(convention):
+    '''The convention's bundle, built once per schedule version'''
+    return cached_for_version('bundle', convention.pk, lambda: build_bundle(convention))
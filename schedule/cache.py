@@ -0,0 +1,207 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from convention import get_convention_model
+
+from . import metrics
+from .routers import fresh_reads
+
+SCHEDULE_VERSION_KEY = 'schedule:version:{convention_id}'
+CURRENT_CONVENTION_KEY = 'schedule:current_convention'
+
+# How often workers waiting on another's rebuild check for it, in seconds
+REBUILD_POLL = 0.05
+
+
+def get_schedule_version(convention_id):
+    '''
+    The convention's schedule version: a millisecond timestamp of the
+    last change to its panels, rooms or tracks. Anything cached from the
+    schedule includes this in its key, so a change (see signals.py)
+    leaves the stale copies behind to expire. If the version's been lost
+    from the cache a new one is started, which is never one seen before.
+    '''
+    key = SCHEDULE_VERSION_KEY.format(convention_id=convention_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_schedule_version(convention_id):
+    key = SCHEDULE_VERSION_KEY.format(convention_id=convention_id)
+    previous = cache.get(key) or 0
+    version = max(int(time.time() * 1000), previous + 1)
+    cache.set(key, version, timeout=None)
+    return version
+
+
+class LocalCache(object):
+    '''
+    A small in-process LRU in front of Django's cache, for the schedule
+    artifacts nearly every request wants. Entries are stored under their
+    full cache key, schedule version included, so once the version's
+    bumped every worker misses on its next lookup; old entries just age
+    out, or expire after the same timeout as the shared copy. Values are
+    handed to every request (and thread) as-is, without unpickling, so
+    they mustn't be changed.
+
+    Holds SCHEDULE_LOCAL_CACHE_SIZE entries, 0 turns it off.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        size = getattr(settings, 'SCHEDULE_LOCAL_CACHE_SIZE', 64)
+        with self.lock:
+            self.entries[key] = (time.monotonic() + timeout, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_cache = LocalCache()
+
+
+def version_key(name, convention_id, version, variant=None):
+    key = 'schedule:{}:{}:{}'.format(name, convention_id, version)
+    if variant:
+        # Variants can be anything, keep the key memcached-safe
+        key += ':' + hashlib.md5(variant.encode()).hexdigest()
+    return key
+
+
+def cached_for_version(name, convention_id, builder, timeout=None, variant=None, stale_variant=None):
+    '''
+    Return builder()'s result, cached against the convention's current
+    schedule version under the given name, and variant if the artifact
+    has more than one. Checks this process's LocalCache, then the shared
+    cache; checking the version costs one shared cache lookup, so edits
+    are picked up on the very next request.
+
+    On a miss only one worker rebuilds, under a lock in the cache. The
+    others get the last value built for the stale_variant (default the
+    variant) from any version, or with none wait SCHEDULE_REBUILD_WAIT
+    seconds for the new one before building it themselves. Builds for a
+    version just edited read from the default database, see routers.py.
+    '''
+    version = get_schedule_version(convention_id)
+    key = version_key(name, convention_id, version, variant)
+    value = local_cache.get(key)
+    if value is not None:
+        metrics.cache_result(name, True, tier='local')
+        return value
+
+    timeout = timeout or getattr(settings, 'SCHEDULE_CACHE_TIMEOUT', 60*60*24)
+    value = cache.get(key)
+    metrics.cache_result(name, value is not None)
+    if value is None:
+        stale_key = version_key(name, convention_id, 'stale', stale_variant or variant)
+        # The lock expires on its own, in case its holder dies
+        locked = cache.add(key + ':rebuilding', 1,
+                           timeout=getattr(settings, 'SCHEDULE_REBUILD_LOCK_TIMEOUT', 30))
+        if not locked:
+            value = cache.get(stale_key)
+            if value is not None:
+                # Not the current version, so don't keep it locally
+                metrics.inc('schedule_cache_coalesced_total', cache=name, result='stale')
+                return value
+            deadline = time.monotonic() + getattr(settings, 'SCHEDULE_REBUILD_WAIT', 2)
+            while value is None and time.monotonic() < deadline:
+                time.sleep(REBUILD_POLL)
+                value = cache.get(key)
+            if value is not None:
+                metrics.inc('schedule_cache_coalesced_total', cache=name, result='waited')
+        if value is None:
+            try:
+                with fresh_reads(version):
+                    value = builder()
+                cache.set_many({key: value, stale_key: value}, timeout=timeout)
+            finally:
+                if locked:
+                    cache.delete(key + ':rebuilding')
+    local_cache.set(key, value, timeout)
+    return value
+
+
+async def acached_for_version(name, convention_id, builder, timeout=None, variant=None, stale_variant=None):
+    '''Same as cached_for_version, for async views; builder is awaited'''
+    key = SCHEDULE_VERSION_KEY.format(convention_id=convention_id)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, int(time.time() * 1000), timeout=None)
+        version = await cache.aget(key)
+    key = version_key(name, convention_id, version, variant)
+    value = local_cache.get(key)
+    if value is not None:
+        metrics.cache_result(name, True, tier='local')
+        return value
+
+    timeout = timeout or getattr(settings, 'SCHEDULE_CACHE_TIMEOUT', 60*60*24)
+    value = await cache.aget(key)
+    metrics.cache_result(name, value is not None)
+    if value is None:
+        stale_key = version_key(name, convention_id, 'stale', stale_variant or variant)
+        locked = await cache.aadd(key + ':rebuilding', 1,
+                                  timeout=getattr(settings, 'SCHEDULE_REBUILD_LOCK_TIMEOUT', 30))
+        if not locked:
+            value = await cache.aget(stale_key)
+            if value is not None:
+                metrics.inc('schedule_cache_coalesced_total', cache=name, result='stale')
+                return value
+            deadline = time.monotonic() + getattr(settings, 'SCHEDULE_REBUILD_WAIT', 2)
+            while value is None and time.monotonic() < deadline:
+                await asyncio.sleep(REBUILD_POLL)
+                value = await cache.aget(key)
+            if value is not None:
+                metrics.inc('schedule_cache_coalesced_total', cache=name, result='waited')
+        if value is None:
+            try:
+                with fresh_reads(version):
+                    value = await builder()
+                await cache.aset_many({key: value, stale_key: value}, timeout=timeout)
+            finally:
+                if locked:
+                    await cache.adelete(key + ':rebuilding')
+    local_cache.set(key, value, timeout)
+    return value
+
+
+def current_convention():
+    '''
+    Convention.objects.current(), remembered briefly so the cheapest
+    endpoints don't need a query. Returns None if there isn't one.
+    '''
+    Convention = get_convention_model()
+    convention = cache.get(CURRENT_CONVENTION_KEY)
+    if convention is None:
+        convention = Convention.objects.current()
+        if convention is not None:
+            cache.set(CURRENT_CONVENTION_KEY, convention,
+                      timeout=getattr(settings, 'SCHEDULE_CURRENT_CONVENTION_CACHE_TIMEOUT', 60))
+    return convention
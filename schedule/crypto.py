@@ -18,16 +18,22 @@ def create_token(user):
     else:
         return ''
 
+def token_username(token):
+    """Unverified username from a token, or None if it's mangled"""
+    try:
+        return json.loads(b64_decode(token.split(':')[0].encode()).decode())
+    # Quite a few things could go wrong here; catch all at once for now
+    except:
+        return
+
 def parse_token(token):
     """
     Pull apart a signed token and try to obtain a user. Returns the user
     object if it is a Valid, Existing, Signature-Verified token.
     Otherwise returns None.
     """
-    try:
-        username = json.loads(b64_decode(token.split(':')[0].encode()).decode())
-    # Quite a few things could go wrong here; catch all at once for now
-    except:
+    username = token_username(token)
+    if username is None:
         return
 
     UserModel = get_user_model()
@@ -37,8 +43,28 @@ def parse_token(token):
     except UserModel.DoesNotExist:
         return
 
-    # Double check the signature is valid given the salt based on the
-    # user's password hash.
+    return verify_token(token, user)
+
+async def aparse_token(token):
+    """parse_token, with the async ORM"""
+    username = token_username(token)
+    if username is None:
+        return
+
+    UserModel = get_user_model()
+
+    try:
+        user = await UserModel.objects.aget(username=username)
+    except UserModel.DoesNotExist:
+        return
+
+    return verify_token(token, user)
+
+def verify_token(token, user):
+    """
+    Double check the signature is valid given the salt based on the
+    user's password hash. Returns the user if so, otherwise None.
+    """
     salt = TOKEN_SALT_PREFIX + user.password
     try:
         username = loads(token, salt=salt)
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+EVENT_SEQUENCE_KEY = 'schedule:events:{convention_id}:seq'
+EVENT_KEY = 'schedule:events:{convention_id}:{event_id}'
+
+# Clients further behind than this just get told to reload
+EVENT_BACKLOG = 100
+
+
+def publish(convention_id, event_type, data):
+    '''
+    Broadcast a schedule change to anyone listening on the convention's
+    event stream. Events are numbered from a counter in the cache and
+    each kept briefly under its own key, so with a shared cache every
+    worker's streams see them, and with a local memory cache it's simply
+    in-process.
+    '''
+    sequence_key = EVENT_SEQUENCE_KEY.format(convention_id=convention_id)
+    cache.add(sequence_key, 0, timeout=None)
+    try:
+        event_id = cache.incr(sequence_key)
+    except ValueError:
+        # Evicted in between, start the count over
+        event_id = 1
+        cache.set(sequence_key, event_id, timeout=None)
+
+    cache.set(EVENT_KEY.format(convention_id=convention_id, event_id=event_id),
+              {'id': event_id, 'type': event_type, 'data': data},
+              timeout=getattr(settings, 'SCHEDULE_EVENTS_TTL', 60*10))
+    return event_id
+
+
+def latest_event_id(convention_id):
+    return cache.get(EVENT_SEQUENCE_KEY.format(convention_id=convention_id), 0)
+
+
+async def alatest_event_id(convention_id):
+    return await cache.aget(EVENT_SEQUENCE_KEY.format(convention_id=convention_id), 0)
+
+
+def event_keys(convention_id, last_id, latest):
+    return [EVENT_KEY.format(convention_id=convention_id, event_id=event_id)
+            for event_id in range(last_id + 1, latest + 1)]
+
+
+def events_since(convention_id, last_id):
+    '''
+    Returns the list of events after last_id, in order. Events that have
+    expired are skipped. If last_id is ahead of the counter, it was
+    evicted or reset, so the client's told to reload and start over.
+    '''
+    latest = latest_event_id(convention_id)
+    if latest < last_id or latest - last_id > EVENT_BACKLOG:
+        return [{'id': latest, 'type': 'reload', 'data': {}}]
+    if latest == last_id:
+        return []
+    keys = event_keys(convention_id, last_id, latest)
+    found = cache.get_many(keys)
+    return [found[key] for key in keys if key in found]
+
+
+async def aevents_since(convention_id, last_id):
+    '''Same as events_since, with the async cache API'''
+    latest = await alatest_event_id(convention_id)
+    if latest < last_id or latest - last_id > EVENT_BACKLOG:
+        return [{'id': latest, 'type': 'reload', 'data': {}}]
+    if latest == last_id:
+        return []
+    keys = event_keys(convention_id, last_id, latest)
+    found = await cache.aget_many(keys)
+    return [found[key] for key in keys if key in found]
+
+
+def format_event(event):
+    '''Format an event for a text/event-stream response'''
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(
+        event['id'], event['type'], json.dumps(event['data']))
+
+
+async def stream_events(convention_id, last_id=None):
+    '''
+    Async generator for a Server-Sent Events response. Polls the cache
+    for new events every SCHEDULE_EVENTS_POLL seconds, sending a comment
+    now and then to keep proxies from closing the connection. Ends after
+    SCHEDULE_EVENTS_MAX_AGE seconds; the browser reconnects on its own
+    with the Last-Event-ID it got to. Being async, an open stream only
+    waits on the event loop rather than holding a worker thread.
+    '''
+    poll = getattr(settings, 'SCHEDULE_EVENTS_POLL', 2)
+    deadline = time.monotonic() + getattr(settings, 'SCHEDULE_EVENTS_MAX_AGE', 60*5)
+    keepalive = time.monotonic() + 15
+    if last_id is None:
+        last_id = await alatest_event_id(convention_id)
+
+    yield 'retry: 5000\n\n'
+    while time.monotonic() < deadline:
+        for event in await aevents_since(convention_id, last_id):
+            last_id = event['id']
+            yield format_event(event)
+        if time.monotonic() > keepalive:
+            keepalive = time.monotonic() + 15
+            yield ': keepalive\n\n'
+        await asyncio.sleep(poll)
@@ -0,0 +1,91 @@
+from django import forms
+
+from .models import PanelSchedule
+from .utils import contime
+
+
+class BulkScheduleForm(forms.Form):
+    '''One PanelSchedule row in the bulk schedule editor'''
+    id = forms.IntegerField(widget=forms.HiddenInput)
+    # Room ids, with the choices given once for every row rather than
+    # a ModelChoiceField querying the rooms for each
+    room = forms.TypedChoiceField(coerce=int)
+    day = forms.TypedChoiceField(choices=PanelSchedule.WEEKDAYS, coerce=int)
+    start_time = forms.TimeField(widget=forms.TimeInput(format='%H:%M', attrs={'size': 5}))
+    end_time = forms.TimeField(widget=forms.TimeInput(format='%H:%M', attrs={'size': 5}))
+
+    def __init__(self, *args, rooms=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['room'].choices = [(room.id, str(room)) for room in rooms]
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start, end = cleaned_data.get('start_time'), cleaned_data.get('end_time')
+        if start and end and contime(end) <= contime(start):
+            raise forms.ValidationError('The panel has to end after it starts.')
+        return cleaned_data
+
+
+class BaseBulkScheduleFormSet(forms.BaseFormSet):
+    '''
+    The whole convention's panel schedule, checked as one: a panel's
+    showings all have to be in the same room, and no changed showing
+    can overlap another panel in its room.
+    '''
+
+    def __init__(self, *args, rooms=(), **kwargs):
+        self.rooms = list(rooms)
+        super().__init__(*args, **kwargs)
+
+    def get_form_kwargs(self, index):
+        kwargs = super().get_form_kwargs(index)
+        kwargs['rooms'] = self.rooms
+        return kwargs
+
+    def clean(self):
+        if any(self.errors):
+            return
+
+        stale = forms.ValidationError(
+            'The schedule changed while you were editing it, reload the page and try again.')
+        if len(self.forms) != len(self.initial or []):
+            raise stale
+        for form in self.forms:
+            if form.cleaned_data['id'] != form.initial['id']:
+                raise stale
+
+        room_names = {room.id: str(room) for room in self.rooms}
+        panel_rooms = {}
+        by_room_day = {}
+        for form in self.forms:
+            data = form.cleaned_data
+            panel_id = form.initial['panel_id']
+            room = data['room']
+            if panel_rooms.setdefault(panel_id, room) != room:
+                raise forms.ValidationError(
+                    '{} is shown more than once, all its times need the same room.'.format(
+                        form.initial['title']))
+            by_room_day.setdefault((room, data['day']), []).append(
+                (contime(data['start_time']), contime(data['end_time']), form))
+
+        conflicts = []
+        for (room_id, day), slots in by_room_day.items():
+            slots.sort(key=lambda slot: slot[0])
+            # Compare each slot with everything still running when it starts
+            for i, (start, end, form) in enumerate(slots):
+                for other_start, other_end, other in slots[i + 1:]:
+                    if other_start >= end:
+                        break
+                    if form.initial['panel_id'] == other.initial['panel_id']:
+                        continue
+                    # Existing overlaps are someone else's problem
+                    if form.has_changed() or other.has_changed():
+                        conflicts.append('{} and {} overlap in {} on {}.'.format(
+                            form.initial['title'], other.initial['title'],
+                            room_names[room_id], dict(PanelSchedule.WEEKDAYS)[day]))
+        if conflicts:
+            raise forms.ValidationError(conflicts)
+
+
+BulkScheduleFormSet = forms.formset_factory(
+    BulkScheduleForm, formset=BaseBulkScheduleFormSet, extra=0)
@@ -0,0 +1,142 @@
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from .models import Panel, Room
+
+try:
+    from PIL import Image
+except ImportError:
+    # Without Pillow maps are only ever served as uploaded
+    Image = None
+
+# Format for the variants, as Pillow names it, and the file extension
+VARIANT_FORMAT = ('WEBP', 'webp')
+
+
+def variant_widths():
+    '''The widths to make, in pixels. The smallest doubles as the thumbnail.'''
+    return sorted(getattr(settings, 'SCHEDULE_MAP_WIDTHS', (320, 640, 1280)))
+
+
+def max_pixels():
+    '''The largest map, in pixels, to resize; anything bigger is left as uploaded'''
+    return getattr(settings, 'SCHEDULE_MAP_MAX_PIXELS', Image.MAX_IMAGE_PIXELS)
+
+
+def variant_name(name, width):
+    return '{}_{}w.{}'.format(os.path.splitext(name)[0], width, VARIANT_FORMAT[1])
+
+
+def build_map_variants(field_file):
+    '''
+    Resize an uploaded map image (a FieldFile) to each of the variant
+    widths narrower than it, saved next to it in the same storage.
+    Returns the metadata to keep in the model's map_variants: the source
+    file's name and size, and each variant's name and size, narrowest
+    first. Empty if there's no image or no Pillow, and without variants
+    if it isn't an image Pillow can read or is over max_pixels, so that
+    isn't tried again.
+    '''
+    if Image is None or not field_file:
+        return {}
+    storage = field_file.storage
+    try:
+        with storage.open(field_file.name, 'rb') as source:
+            image = Image.open(source)
+            # Only the header's been read so far, check before decoding
+            limit = max_pixels()
+            if limit and image.width * image.height > limit:
+                return {'source': field_file.name, 'variants': []}
+            image.load()
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        return {'source': field_file.name, 'variants': []}
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    variants = []
+    for width in variant_widths():
+        if width >= image.width:
+            break
+        height = max(1, round(image.height * width / image.width))
+        output = BytesIO()
+        image.resize((width, height), Image.LANCZOS).save(
+            output, VARIANT_FORMAT[0], quality=getattr(settings, 'SCHEDULE_MAP_QUALITY', 80))
+        name = variant_name(field_file.name, width)
+        if storage.exists(name):
+            storage.delete(name)
+        name = storage.save(name, ContentFile(output.getvalue()))
+        variants.append({'name': name, 'width': width, 'height': height})
+    return {
+        'source': field_file.name,
+        'width': image.width,
+        'height': image.height,
+        'variants': variants,
+    }
+
+
+def map_shared(instance, metadata):
+    '''
+    Whether another Room or Panel has the same map upload, and so the
+    same variants; copy_schedule_tracks copies rooms along with theirs.
+    '''
+    source = metadata.get('source')
+    if not source:
+        return False
+    for model in (Room, Panel):
+        others = model.objects.filter(map_variants__source=source)
+        if isinstance(instance, model):
+            others = others.exclude(pk=instance.pk)
+        if others.exists():
+            return True
+    return False
+
+
+def delete_map_variants(instance, metadata):
+    '''Delete the variant files in metadata, unless another Room or Panel uses them'''
+    if map_shared(instance, metadata):
+        return
+    for variant in metadata.get('variants', []):
+        instance.map_image.storage.delete(variant['name'])
+
+
+def update_map_variants(instance, force=False):
+    '''
+    Bring a Panel or Room's map_variants up to date with its map_image,
+    building new variants and deleting the old ones if the image has
+    changed since they were made. Saves just that field, with update(),
+    so nothing else about the object is touched. Returns whether it
+    changed anything.
+    '''
+    field_file = instance.map_image
+    metadata = instance.map_variants or {}
+    current = field_file.name if field_file else None
+    if not force and metadata.get('source') == current:
+        return False
+    if Image is None and not metadata:
+        return False
+
+    if metadata:
+        delete_map_variants(instance, metadata)
+    metadata = build_map_variants(field_file)
+    instance.map_variants = metadata
+    type(instance).objects.filter(pk=instance.pk).update(map_variants=metadata)
+    return True
+
+
+def map_srcset(field_file, metadata):
+    '''
+    The srcset for a map image from its map_variants, the variants plus
+    the original, or '' without any. URLs come from the storage, so
+    there's no looking at files.
+    '''
+    if not field_file or not metadata or metadata.get('source') != field_file.name \
+            or not metadata.get('variants'):
+        return ''
+    storage = field_file.storage
+    candidates = ['{} {}w'.format(storage.url(variant['name']), variant['width'])
+                  for variant in metadata['variants']]
+    candidates.append('{} {}w'.format(field_file.url, metadata['width']))
+    return ', '.join(candidates)
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from schedule.archive import freeze_convention, snapshot_format
+from schedule.models import ScheduleSnapshot
+# TODO: Need to abstract this link still...
+from convention.models import Convention
+
+class Command(BaseCommand):
+    help = 'Freeze a past convention schedule into a stored snapshot served under its year'
+
+    def add_arguments(self, parser):
+        parser.add_argument('convention', type=str, nargs='?')
+
+        parser.add_argument(
+            '--year',
+            type=int,
+            dest='year',
+            default=None,
+            help='Year to archive the schedule under, defaults to the year the convention starts'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            dest='force',
+            default=False,
+            help='Allow freezing the current convention, which is normally still being edited'
+        )
+        parser.add_argument(
+            '--outdated',
+            action='store_true',
+            dest='outdated',
+            default=False,
+            help='Freeze again every snapshot made before a change to the models, which aren\'t served until then'
+        )
+
+    def handle(self, *args, **options):
+        if options['outdated']:
+            for snapshot in ScheduleSnapshot.objects.exclude(format=snapshot_format()):
+                freeze_convention(snapshot.convention, year=snapshot.year)
+                self.stdout.write('Re-archived "{}" schedule as {}'.format(snapshot.convention.name, snapshot.year))
+            return
+        if options['convention'] is None:
+            raise CommandError('Give a convention to archive, or --outdated')
+
+        # If given a number, try that as the convention id. Otherwise, look up by name.
+        # And just fail out if we don't get a match.
+        try:
+            convention = Convention.objects.get(id=int(options['convention']))
+        except ValueError:
+            convention = Convention.objects.get(name=options['convention'])
+
+        if convention == Convention.objects.current() and not options['force']:
+            raise CommandError('Convention "{}" is the current convention, cannot archive without --force'.format(convention.name))
+
+        snapshot = freeze_convention(convention, year=options['year'])
+        self.stdout.write('Archived "{}" schedule as {}'.format(convention.name, snapshot.year))
@@ -0,0 +1,161 @@
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+
+import json
+import statistics
+import time
+from datetime import datetime
+
+from schedule.cache import bump_schedule_version
+from schedule.models import Attendee, Track
+from schedule.preferences import clear_preferences
+from schedule.views import ScheduleFull, ScheduleGrid, ScheduleICS, ScheduleJSON, ScheduleList
+
+from .generate_schedule import create_synthetic_convention, generate_schedule, next_thursday
+
+# Preset schedule sizes, roughly a small con up to well past our largest
+SIZES = {
+    'small': dict(rooms=5, tracks=4, panels=100, slots=120, users=200, attendees=2000),
+    'medium': dict(rooms=10, tracks=8, panels=400, slots=500, users=1000, attendees=20000),
+    'large': dict(rooms=20, tracks=12, panels=1500, slots=2000, users=5000, attendees=100000),
+}
+
+
+class Rollback(Exception):
+    '''Raised to discard the synthetic data once a size is measured'''
+
+
+class Command(BaseCommand):
+    help = 'Time each phase of building the schedule views against synthetic conventions of several sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=str,
+            dest='sizes',
+            default='small,medium',
+            help='Comma separated sizes to run, from: {}'.format(', '.join(SIZES))
+        )
+        parser.add_argument('--repeat', type=int, dest='repeat', default=5,
+                            help='Times to run each phase, the best and median are reported')
+        parser.add_argument('--seed', type=int, dest='seed', default=1)
+        parser.add_argument('--label', type=str, dest='label', default='',
+                            help='Label stored with the results, such as a commit id')
+        parser.add_argument('--output', type=str, dest='output', default=None,
+                            help='Save the results as JSON to this path')
+        parser.add_argument('--compare', type=str, dest='compare', default=None,
+                            help='Previously saved results to show the change against')
+
+    def handle(self, *args, **options):
+        sizes = [size.strip() for size in options['sizes'].split(',') if size.strip()]
+        for size in sizes:
+            if size not in SIZES:
+                raise CommandError('Unknown size "{}"'.format(size))
+        previous = {}
+        if options['compare']:
+            with open(options['compare'], 'r') as compare_file:
+                previous = {(result['size'], result['phase']): result
+                            for result in json.load(compare_file)['results']}
+
+        results = []
+        for size in sizes:
+            try:
+                with transaction.atomic():
+                    results += self.run_size(size, options['repeat'], options['seed'])
+                    # Don't leave the synthetic convention behind
+                    raise Rollback()
+            except Rollback:
+                pass
+
+        self.stdout.write('{:8} {:28} {:>10} {:>10} {:>9}'.format(
+            'size', 'phase', 'best ms', 'median ms', 'change'))
+        for result in results:
+            change = ''
+            old = previous.get((result['size'], result['phase']))
+            if old and old['median']:
+                change = '{:+.1f}%'.format((result['median'] - old['median']) / old['median'] * 100)
+            self.stdout.write('{:8} {:28} {:10.2f} {:10.2f} {:>9}'.format(
+                result['size'], result['phase'], result['best'], result['median'], change))
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                json.dump({
+                    'label': options['label'],
+                    'timestamp': datetime.now().isoformat(),
+                    'results': results,
+                }, output_file, indent=2)
+
+    def run_size(self, size, repeat, seed):
+        convention = create_synthetic_convention('Benchmark Con ({})'.format(size), next_thursday())
+        generate_schedule(convention, seed=seed, **SIZES[size])
+        # Benchmark the logged in path as any user with preferences
+        attendee = Attendee.objects.filter(panel__convention=convention).select_related('user').first()
+        user = attendee.user if attendee else None
+
+        results = []
+
+        def record(phase, func, setup=None):
+            timings = []
+            for i in range(repeat):
+                if setup is not None:
+                    setup()
+                start = time.perf_counter()
+                func()
+                timings.append((time.perf_counter() - start) * 1000)
+            results.append({
+                'size': size,
+                'phase': phase,
+                'best': min(timings),
+                'median': statistics.median(timings),
+            })
+
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        tracks = list(Track.objects.filter(convention=convention))
+
+        def uncached():
+            # A new schedule version, so the track partitions (and the
+            # user's preferences) are loaded from the database each time
+            bump_schedule_version(convention.pk)
+            if user is not None:
+                clear_preferences(user, convention.pk)
+
+        for view_class in (ScheduleList, ScheduleGrid):
+            name = view_class.__name__
+            view = view_class.for_convention(convention, addl_filter='')
+            record('{} load_panels_rooms'.format(name), view.load_panels_rooms, setup=uncached)
+            record('{} load_panels_rooms (cached)'.format(name), view.load_panels_rooms)
+            if user is not None:
+                user_view = view_class.for_convention(convention, addl_filter='')
+                user_view.user = user
+                record('{} load_panels_rooms (user)'.format(name), user_view.load_panels_rooms,
+                       setup=uncached)
+            record('{} create_base_days'.format(name), view.create_base_days_structure)
+            record('{} pack_struct'.format(name), view.pack_struct)
+
+        for view_class in (ScheduleList, ScheduleFull, ScheduleGrid):
+            view = view_class.for_convention(convention, addl_filter='')
+            view.load_panels_rooms()
+            context = {
+                'addl_filter': '',
+                'track_filter': None,
+                'convention': convention,
+                'request_user': request.user,
+                'today': None,
+                'auth_token': '',
+                'tracks': tracks,
+            }
+            context.update(view.pack_struct())
+            record('{} render'.format(view_class.__name__),
+                   lambda: render_to_string(view.template_name, context, request=request))
+
+        for view_class in (ScheduleICS, ScheduleJSON):
+            view = view_class.for_convention(convention, addl_filter='all')
+            view.load_panels_rooms()
+            record('{} serialize'.format(view_class.__name__),
+                   lambda: view.serialize(view.panelschedules, view.roomschedules))
+
+        return results
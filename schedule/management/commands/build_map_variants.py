@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from schedule.cache import bump_schedule_version
+from schedule.images import Image, update_map_variants
+from schedule.models import Panel, Room
+# TODO: Need to abstract this link still...
+from convention.models import Convention
+
+class Command(BaseCommand):
+    help = 'Make the resized variants of room and panel map images uploaded before they were made on upload'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'convention', type=str, nargs='?', default=None,
+            help='Convention id or name, defaults to every convention'
+        )
+        parser.add_argument('--force', action='store_true', dest='force', default=False,
+                            help='Rebuild variants that are already up to date, e.g. after changing SCHEDULE_MAP_WIDTHS')
+
+    def handle(self, *args, **options):
+        if Image is None:
+            raise CommandError('Pillow is needed to resize map images.')
+
+        panels = Panel.objects.exclude(map_image='').exclude(map_image__isnull=True)
+        rooms = Room.objects.exclude(map_image='').exclude(map_image__isnull=True)
+        if options['convention']:
+            # If given a number, try that as the convention id. Otherwise, look up by name.
+            try:
+                convention = Convention.objects.get(id=int(options['convention']))
+            except ValueError:
+                convention = Convention.objects.get(name=options['convention'])
+            panels = panels.filter(convention=convention)
+            rooms = rooms.filter(convention=convention)
+
+        conventions = set()
+        updated = 0
+        for item in list(panels) + list(rooms):
+            if update_map_variants(item, force=options['force']):
+                conventions.add(item.convention_id)
+                updated += 1
+        # Cached pages hold the old map markup
+        for convention_id in conventions:
+            bump_schedule_version(convention_id)
+        self.stdout.write('Made map variants for {} panels and rooms'.format(updated))
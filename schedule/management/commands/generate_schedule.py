@@ -0,0 +1,183 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+import random
+from datetime import date, datetime, time, timedelta
+
+from schedule.models import Attendee, Panel, PanelSchedule, Room, RoomSchedule, Track
+from schedule.preferences import recount_preferences
+# TODO: Need to abstract this link still...
+from convention.models import Convention
+
+# Con days and the span of each day that panels get packed into
+DAYS = (3, 4, 5, 6)
+DAY_START = 9 * 60
+DAY_END = 25 * 60
+
+
+def create_synthetic_convention(name, start_date):
+    '''
+    Create a convention to hang synthetic data on, filling in whichever
+    of the usual fields the convention model has.
+    '''
+    field_names = {field.name for field in Convention._meta.get_fields()}
+    values = {'name': name, 'start_date': start_date}
+    if 'end_date' in field_names:
+        values['end_date'] = start_date + timedelta(days=3)
+    if 'site' in field_names:
+        from django.contrib.sites.models import Site
+        values['site'] = Site.objects.get_current()
+    return Convention.objects.create(**values)
+
+
+def generate_schedule(convention, rooms=10, tracks=6, panels=200, slots=None,
+                      users=100, attendees=1000, open_rooms=2, seed=None):
+    '''
+    Fill a convention with a synthetic schedule of the given size. Panels
+    are packed into the rooms back to back across Thursday to Sunday;
+    slots beyond the number of panels become repeat showings. Attendee
+    rows are random (user, panel) pairs with a mix of stars, hides and
+    feedback. Returns a dict of counts of what was created.
+    '''
+    rng = random.Random(seed)
+    if slots is None:
+        slots = panels
+
+    # Each is reloaded after its bulk_create before anything refers to it,
+    # since not every backend hands back primary keys
+    Track.objects.bulk_create([
+        Track(convention=convention, name='Track {}'.format(i),
+              class_name='track{}'.format(i), color='#{:06x}'.format(rng.randrange(0x1000000)))
+        for i in range(tracks)
+    ])
+    track_objs = list(Track.objects.filter(convention=convention).order_by('id'))
+    Room.objects.bulk_create([
+        Room(convention=convention, name='Room {}'.format(i), sort_order=i,
+             track=track_objs[i % tracks] if i < open_rooms else None)
+        for i in range(rooms)
+    ])
+    room_objs = list(Room.objects.filter(convention=convention).order_by('id'))
+    open_room_objs = [room for room in room_objs if room.track_id]
+    panel_room_objs = [room for room in room_objs if not room.track_id] or room_objs
+
+    Panel.objects.bulk_create([
+        Panel(convention=convention, title='Synthetic Panel {}'.format(i),
+              track=rng.choice(track_objs), room=panel_room_objs[i % len(panel_room_objs)],
+              hosts='Host {}'.format(rng.randrange(max(panels // 3, 1))),
+              description='Description of synthetic panel {}. '.format(i) * rng.randint(1, 5))
+        for i in range(panels)
+    ])
+    panel_objs = list(Panel.objects.filter(convention=convention).order_by('id'))
+
+    # Where the next panel starts, in minutes from midnight, per room and day
+    cursors = {(room.id, day): DAY_START for room in panel_room_objs for day in DAYS}
+    schedules = []
+    for i in range(slots):
+        panel = panel_objs[i % len(panel_objs)]
+        day = DAYS[(i // len(panel_room_objs)) % len(DAYS)]
+        duration = rng.choice((30, 60, 60, 90, 120))
+        start = cursors[(panel.room_id, day)]
+        if start + duration > DAY_END:
+            # Room's full for the day, start overlapping from the morning
+            start = DAY_START
+        cursors[(panel.room_id, day)] = start + duration
+        schedules.append(PanelSchedule(
+            panel=panel, day=day,
+            start_time=minutes_to_time(start), end_time=minutes_to_time(start + duration)))
+    PanelSchedule.objects.bulk_create(schedules)
+
+    RoomSchedule.objects.bulk_create([
+        RoomSchedule(room=room, day=day, start_time=time(10, 0), end_time=time(18, 0))
+        for room in open_room_objs for day in DAYS
+    ])
+
+    UserModel = get_user_model()
+    prefix = 'synthetic-{}-'.format(convention.pk)
+    UserModel.objects.bulk_create([
+        UserModel(username='{}{}'.format(prefix, i), password='!')
+        for i in range(users)
+    ])
+    user_ids = list(UserModel.objects.filter(
+        username__startswith=prefix).values_list('id', flat=True))
+
+    # Random distinct (user, panel) pairs
+    attendees = min(attendees, len(user_ids) * len(panel_objs))
+    pairs = set()
+    while len(pairs) < attendees:
+        pairs.add((rng.choice(user_ids), rng.choice(panel_objs).id))
+    attendee_objs = []
+    for user_id, panel_id in pairs:
+        roll = rng.random()
+        attendee_objs.append(Attendee(
+            user_id=user_id, panel_id=panel_id,
+            starred=roll < 0.5,
+            hide_from_user=0.5 <= roll < 0.7,
+            attended=True if roll >= 0.9 else None,
+            feedback='Synthetic feedback' if roll >= 0.95 else None))
+    Attendee.objects.bulk_create(attendee_objs, batch_size=1000)
+    recount_preferences(Panel.objects.filter(convention=convention))
+
+    return {
+        'rooms': rooms,
+        'tracks': tracks,
+        'panels': panels,
+        'slots': slots,
+        'users': users,
+        'attendees': attendees,
+    }
+
+
+def minutes_to_time(minutes):
+    '''Cast minutes from midnight, possibly past the next midnight, to a time'''
+    return time((minutes // 60) % 24, minutes % 60)
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic convention schedule of a given size, for benchmarking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--name', type=str, dest='name', default=None,
+                            help='Name of the new convention, defaults to one with a timestamp')
+        parser.add_argument('--start-date', type=str, dest='start_date', default=None,
+                            help='Convention start date as YYYY-MM-DD, defaults to the next Thursday')
+        parser.add_argument('--rooms', type=int, dest='rooms', default=10)
+        parser.add_argument('--tracks', type=int, dest='tracks', default=6)
+        parser.add_argument('--panels', type=int, dest='panels', default=200)
+        parser.add_argument('--slots', type=int, dest='slots', default=None,
+                            help='Number of PanelSchedule rows, defaults to one per panel')
+        parser.add_argument('--users', type=int, dest='users', default=100)
+        parser.add_argument('--attendees', type=int, dest='attendees', default=1000,
+                            help='Number of Attendee preference rows')
+        parser.add_argument('--open-rooms', type=int, dest='open_rooms', default=2,
+                            help='How many rooms get open hours (RoomSchedules)')
+        parser.add_argument('--seed', type=int, dest='seed', default=None)
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        if options['start_date']:
+            start_date = datetime.strptime(options['start_date'], '%Y-%m-%d').date()
+        else:
+            start_date = next_thursday()
+        name = options['name'] or 'Synthetic Con {:%Y%m%d%H%M%S}'.format(datetime.now())
+
+        convention = create_synthetic_convention(name, start_date)
+        counts = generate_schedule(
+            convention,
+            rooms=options['rooms'],
+            tracks=options['tracks'],
+            panels=options['panels'],
+            slots=options['slots'],
+            users=options['users'],
+            attendees=options['attendees'],
+            open_rooms=options['open_rooms'],
+            seed=options['seed'],
+        )
+        self.stdout.write('Created "{}" (id {}): {}'.format(
+            convention.name, convention.pk,
+            ', '.join('{} {}'.format(count, item) for item, count in counts.items())))
+
+
+def next_thursday():
+    today = date.today()
+    return today + timedelta(days=(3 - today.weekday()) % 7 or 7)
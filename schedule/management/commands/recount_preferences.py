@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from schedule.models import Panel
+from schedule.preferences import recount_preferences
+# TODO: Need to abstract this link still...
+from convention.models import Convention
+
+class Command(BaseCommand):
+    help = 'Recompute the panels\' star, hide and attended counters from the Attendee records'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'convention', type=str, nargs='?', default=None,
+            help='Convention id or name, defaults to every convention'
+        )
+
+    def handle(self, *args, **options):
+        panels = Panel.objects.all()
+        if options['convention']:
+            # If given a number, try that as the convention id. Otherwise, look up by name.
+            try:
+                convention = Convention.objects.get(id=int(options['convention']))
+            except ValueError:
+                convention = Convention.objects.get(name=options['convention'])
+            panels = panels.filter(convention=convention)
+
+        updated = recount_preferences(panels)
+        self.stdout.write('Recounted preferences for {} panels'.format(updated))
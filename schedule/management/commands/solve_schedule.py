@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+
+import time
+
+from schedule.solver import Solver, describe_changes, load_problem, schedule_cost
+# TODO: Need to abstract this link still...
+from convention.models import Convention
+
+class Command(BaseCommand):
+    help = ('Propose rooms and times for a convention\'s panels that keep co-starred panels apart, '
+            'printed as a diff against the current schedule. Nothing is saved.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('convention', type=str)
+
+        parser.add_argument('--days', type=str, dest='days', default='4,5,6',
+                            help='Comma separated weekdays to schedule on, Monday is 0')
+        parser.add_argument('--day-start', type=int, dest='day_start', default=9,
+                            help='Hour panels can start from each day')
+        parser.add_argument('--day-end', type=int, dest='day_end', default=26,
+                            help='Hour panels have to end by, past 24 for after midnight')
+        parser.add_argument('--duration', type=int, dest='duration', default=60,
+                            help='Minutes to allow for panels that aren\'t scheduled yet')
+        parser.add_argument('--any-room', action='store_true', dest='any_room', default=False,
+                            help='Let panels go in any room, not just those their track uses')
+        parser.add_argument('--stability', type=float, dest='stability', default=1.0,
+                            help='Cost of moving an already scheduled panel, so small gains don\'t shuffle everything')
+        parser.add_argument('--iterations', type=int, dest='iterations', default=20000)
+        parser.add_argument('--time-limit', type=float, dest='time_limit', default=30,
+                            help='Seconds to spend improving the schedule')
+        parser.add_argument('--seed', type=int, dest='seed', default=None)
+
+    def handle(self, *args, **options):
+        # If given a number, try that as the convention id. Otherwise, look up by name.
+        # And just fail out if we don't get a match.
+        try:
+            convention = Convention.objects.get(id=int(options['convention']))
+        except ValueError:
+            convention = Convention.objects.get(name=options['convention'])
+
+        try:
+            days = [int(day) for day in options['days'].split(',')]
+        except ValueError:
+            raise CommandError('--days should be weekday numbers, like 4,5,6')
+        if options['day_end'] <= options['day_start']:
+            raise CommandError('--day-end has to be after --day-start')
+
+        started = time.monotonic()
+        problem = load_problem(convention, days, options['day_start'] * 60, options['day_end'] * 60,
+                               default_duration=options['duration'], any_room=options['any_room'])
+        current = [showing['current'] for showing in problem.showings]
+        solver = Solver(problem, stability=options['stability'], seed=options['seed'])
+        placement = solver.solve(options['iterations'], options['time_limit'])
+
+        for line in describe_changes(problem, placement):
+            self.stdout.write(line)
+        self.stdout.write('')
+        if problem.fixed:
+            self.stdout.write('Left where they are, outside the days and hours given: {}'.format(
+                ', '.join(problem.fixed)))
+        self.stdout.write('{} showings, {} moved, {} with no room. Co-starred overlap {} -> {}. ({:.1f}s)'.format(
+            len(problem.showings),
+            sum(1 for before, after in zip(current, placement) if before != after),
+            len(solver.unplaced),
+            schedule_cost(problem, current),
+            schedule_cost(problem, placement),
+            time.monotonic() - started,
+        ))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+import time
+
+from schedule.warmer import CacheWarmer
+
+class Command(BaseCommand):
+    help = ('Keep the schedule caches warm for the current convention, rebuilding them as panels '
+            'start and end and whenever the schedule changes. Runs until stopped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll', type=float, dest='poll', default=None,
+                            help='Seconds between checks for schedule changes, default SCHEDULE_WARMER_POLL or 30')
+        parser.add_argument('--once', action='store_true', dest='once', default=False,
+                            help='Warm the caches once and exit, e.g. after a deploy')
+
+    def handle(self, *args, **options):
+        warmer = CacheWarmer(poll=options['poll'], log=self.stdout.write)
+        try:
+            while True:
+                close_old_connections()
+                wait = warmer.step()
+                if options['once']:
+                    break
+                time.sleep(wait)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            close_old_connections()
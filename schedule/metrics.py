@@ -0,0 +1,265 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Name: (type, help text). Only metrics listed here can be recorded.
+METRICS = {
+    'schedule_requests_total': ('counter', 'Schedule view requests, by view and filter'),
+    'schedule_request_seconds': ('histogram', 'Schedule view response time, by view and filter'),
+    'schedule_cache_requests_total': ('counter', 'Schedule cache lookups, by cache, tier and hit or miss'),
+    'schedule_cache_coalesced_total': ('counter', 'Schedule cache misses left to another worker\'s rebuild, by cache and stale or waited'),
+    'schedule_ics_polls_total': ('counter', 'ICS calendar feed requests, by filter'),
+    'schedule_token_failures_total': ('counter', 'Calendar feed auth tokens that failed to parse'),
+    'schedule_preference_writes_total': ('counter', 'Attendee preference updates, by preference'),
+}
+
+# Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class MetricsRegistry(object):
+    '''
+    In-process metrics. Counters are a value per label set; histograms
+    keep a (non-cumulative) count per bucket plus a sum and count. Each
+    worker process has its own, see CacheMetricsRegistry for combining.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                # Buckets, then the +Inf bucket, sum and count
+                self.histograms[key] = [0] * (len(BUCKETS) + 3)
+            histogram = self.histograms[key]
+            histogram[bisect_left(BUCKETS, value)] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def collect(self):
+        '''Returns copies of the counters and histograms dicts'''
+        with self.lock:
+            return (dict(self.counters),
+                    {key: list(value) for key, value in self.histograms.items()})
+
+
+class CacheMetricsRegistry(object):
+    '''
+    Metrics kept in a shared Django cache, so every worker adds to the
+    same values and any of them can report the totals. Recording only
+    touches this process's own MetricsRegistry; what's built up there
+    is added to the cache every SCHEDULE_METRICS_FLUSH_INTERVAL seconds
+    (and before collecting), much like Prometheus' multiprocess mode.
+
+    In the cache each value is its own key updated with incr(), so
+    histogram sums are stored in integer microseconds. The label sets in
+    use are listed in numbered index slots, each claimed with add(), so
+    two workers registering at once can't overwrite each other.
+    '''
+    prefix = 'schedule:metrics:'
+    # Slots read at a time when collecting
+    index_batch = 100
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+        self.lock = threading.Lock()
+        self.pending = MetricsRegistry()
+        self.flushed = time.monotonic()
+
+    def _incr(self, key, value):
+        key = self.prefix + key
+        # add() is a no-op if the key already exists
+        self.cache.add(key, 0, timeout=None)
+        try:
+            self.cache.incr(key, value)
+        except ValueError:
+            # Evicted between add() and incr()
+            self.cache.set(key, value, timeout=None)
+
+    def _marker(self, entry):
+        kind, name, labels = entry
+        return self.prefix + 'series:' + self._key(kind, [('name', name)] + list(labels))
+
+    def _register(self, entries):
+        '''
+        Make sure each (kind, name, labels) is listed in an index slot.
+        Each series' marker key holds its slot, and it's listed again if
+        that slot (or the marker) has since been evicted.
+        '''
+        markers = {entry: self._marker(entry) for entry in entries}
+        slots = self.cache.get_many(markers.values())
+        slot_keys = {entry: self.prefix + 'index:{}'.format(slots[marker])
+                     for entry, marker in markers.items() if marker in slots}
+        listed = self.cache.get_many(slot_keys.values())
+        for entry, marker in markers.items():
+            if entry in slot_keys and listed.get(slot_keys[entry]) == entry:
+                continue
+            # Start at the last slot anyone's said they claimed; it's only
+            # a hint, add() is what makes the claim
+            slot = self.cache.get(self.prefix + 'index:next') or 0
+            while not self.cache.add(self.prefix + 'index:{}'.format(slot), entry, timeout=None):
+                slot += 1
+            self.cache.set(self.prefix + 'index:next', slot + 1, timeout=None)
+            self.cache.set(marker, slot, timeout=None)
+
+    def _index(self):
+        '''
+        Every registered (kind, name, labels), from the slots in order.
+        Evicted slots are skipped, up to the index:next hint, then it
+        carries on until a batch with nothing in it, for claims made
+        since the hint was last set.
+        '''
+        entries = []
+        claimed = self.cache.get(self.prefix + 'index:next') or 0
+        start = 0
+        while True:
+            keys = [self.prefix + 'index:{}'.format(slot)
+                    for slot in range(start, start + self.index_batch)]
+            values = self.cache.get_many(keys)
+            entries += [values[key] for key in keys if key in values]
+            start += self.index_batch
+            if start >= claimed and not values:
+                # Two workers can register the same label set at once
+                return list(OrderedDict.fromkeys(entries))
+
+    @staticmethod
+    def _key(name, labels, suffix=''):
+        return '{}{}:{}'.format(name, suffix, ','.join('{}={}'.format(*label) for label in labels))
+
+    def inc(self, name, value=1, **labels):
+        # Under the lock, so a flush can't swap pending out from under it
+        with self.lock:
+            self.pending.inc(name, value, **labels)
+        self._maybe_flush()
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            self.pending.observe(name, value, **labels)
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        interval = getattr(settings, 'SCHEDULE_METRICS_FLUSH_INTERVAL', 10)
+        if time.monotonic() - self.flushed >= interval:
+            self.flush()
+
+    def flush(self):
+        '''Add what this process has recorded since the last flush to the cache'''
+        with self.lock:
+            pending, self.pending = self.pending, MetricsRegistry()
+            self.flushed = time.monotonic()
+        counters, histograms = pending.collect()
+        self._register([('counter', name, labels) for name, labels in counters] +
+                       [('histogram', name, labels) for name, labels in histograms])
+        for (name, labels), value in counters.items():
+            self._incr(self._key(name, labels), value)
+        for (name, labels), histogram in histograms.items():
+            for bucket, count in enumerate(histogram[:-2]):
+                if count:
+                    self._incr(self._key(name, labels, ':{}'.format(bucket)), count)
+            self._incr(self._key(name, labels, ':sum'), int(histogram[-2] * 1000000))
+            self._incr(self._key(name, labels, ':count'), histogram[-1])
+
+    def collect(self):
+        self.flush()
+        counters = {}
+        histograms = {}
+        index = self._index()
+        keys = []
+        for kind, name, labels in index:
+            if kind == 'counter':
+                keys.append(self._key(name, labels))
+            else:
+                keys += [self._key(name, labels, ':{}'.format(i)) for i in range(len(BUCKETS) + 1)]
+                keys += [self._key(name, labels, ':sum'), self._key(name, labels, ':count')]
+        values = self.cache.get_many([self.prefix + key for key in keys])
+
+        def value(key):
+            return values.get(self.prefix + key, 0)
+
+        for kind, name, labels in index:
+            if kind == 'counter':
+                counters[(name, labels)] = value(self._key(name, labels))
+            else:
+                histogram = [value(self._key(name, labels, ':{}'.format(i)))
+                             for i in range(len(BUCKETS) + 1)]
+                histogram.append(value(self._key(name, labels, ':sum')) / 1000000)
+                histogram.append(value(self._key(name, labels, ':count')))
+                histograms[(name, labels)] = histogram
+        return counters, histograms
+
+
+_registry = None
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        alias = getattr(settings, 'SCHEDULE_METRICS_CACHE', None)
+        _registry = CacheMetricsRegistry(alias) if alias else MetricsRegistry()
+    return _registry
+
+
+def metrics_enabled():
+    return getattr(settings, 'SCHEDULE_METRICS', True)
+
+
+def inc(name, value=1, **labels):
+    if metrics_enabled():
+        get_registry().inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    if metrics_enabled():
+        get_registry().observe(name, value, **labels)
+
+
+def cache_result(cache_name, hit, tier='shared'):
+    '''Count a lookup in one of the schedule caches, local or shared'''
+    inc('schedule_cache_requests_total', cache=cache_name, tier=tier, result='hit' if hit else 'miss')
+
+
+def _format_labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        label, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for label, value in labels) + '}'
+
+
+def exposition():
+    '''Render the current metrics in the Prometheus text format'''
+    counters, histograms = get_registry().collect()
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append('{}{} {}'.format(name, _format_labels(labels), value))
+        else:
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), histogram):
+                    cumulative += count
+                    lines.append('{}_bucket{} {}'.format(
+                        name, _format_labels(labels, [('le', bound)]), cumulative))
+                lines.append('{}_sum{} {}'.format(name, _format_labels(labels), histogram[-2]))
+                lines.append('{}_count{} {}'.format(name, _format_labels(labels), histogram[-1]))
+    return '\n'.join(lines) + '\n'
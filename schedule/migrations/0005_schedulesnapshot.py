@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(getattr(settings, 'CONVENTION_MODEL', 'convention.Convention')),
+        ('schedule', '0004_restructure_attended_boolean'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduleSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField(unique=True)),
+                ('created', models.DateTimeField(auto_now=True)),
+                ('packed', models.BinaryField()),
+                ('json', models.TextField()),
+                ('ics', models.BinaryField()),
+                ('convention', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='schedule_snapshot', to=getattr(settings, 'CONVENTION_MODEL', 'convention.Convention'))),
+            ],
+            options={
+                'ordering': ['-year'],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Indexes matching the schedule view queries. See "Database indexes" in
+# the README for the queries these are meant to serve.
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('schedule', '0005_schedulesnapshot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='panel',
+            index=models.Index(fields=['convention', 'hidden'], name='schedule_panel_con_hidden'),
+        ),
+        migrations.AddIndex(
+            model_name='panelschedule',
+            index=models.Index(fields=['panel', 'day'], name='schedule_ps_panel_day'),
+        ),
+        migrations.AddIndex(
+            model_name='roomschedule',
+            index=models.Index(fields=['room', 'day'], name='schedule_rs_room_day'),
+        ),
+        migrations.AddIndex(
+            model_name='attendee',
+            index=models.Index(condition=models.Q(hide_from_user=True), fields=['user', 'panel'], name='schedule_att_user_hidden'),
+        ),
+        migrations.AddIndex(
+            model_name='attendee',
+            index=models.Index(condition=models.Q(starred=True), fields=['user', 'panel'], name='schedule_att_user_starred'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_preferences(apps, schema_editor):
+    Attendee = apps.get_model('schedule', 'Attendee')
+    Panel = apps.get_model('schedule', 'Panel')
+    counts = {}
+    for flag, counter in (('starred', 'star_count'),
+                          ('hide_from_user', 'hide_count'),
+                          ('attended', 'attended_count')):
+        count = Attendee.objects.filter(panel=OuterRef('pk'), **{flag: True}).order_by() \
+            .values('panel').annotate(count=Count('pk')).values('count')
+        counts[counter] = Coalesce(Subquery(count, output_field=IntegerField()), Value(0))
+    Panel.objects.update(**counts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0006_schedule_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='panel',
+            name='star_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='panel',
+            name='hide_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='panel',
+            name='attended_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_preferences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0007_panel_preference_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='panel',
+            name='map_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='map_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
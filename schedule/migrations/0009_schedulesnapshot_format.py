@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0008_map_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='schedulesnapshot',
+            name='format',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
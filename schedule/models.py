@@ -25,6 +25,20 @@ class Panel(models.Model):
     map_image = models.FileField(
         upload_to=getattr(settings, 'SCHEDULE_MEDIA_UPLOAD_TO', 'schedule/'),
         null=True, blank=True)
+    # Resized copies of map_image and their sizes, see images.py
+    map_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # Counts of the Attendee flags, kept up to date as they're set (see
+    # preferences.py) so popularity doesn't need counting on every use
+    star_count = models.PositiveIntegerField(default=0, editable=False)
+    hide_count = models.PositiveIntegerField(default=0, editable=False)
+    attended_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # Every schedule view filters on convention and hidden=False
+            models.Index(fields=['convention', 'hidden'],
+                         name='schedule_panel_con_hidden'),
+        ]
 
     def __str__(self):
         return self.title
@@ -48,6 +62,8 @@ class Room(models.Model):
     map_image = models.FileField(
         upload_to=getattr(settings, 'SCHEDULE_MEDIA_UPLOAD_TO', 'schedule/'),
         null=True, blank=True)
+    # Resized copies of map_image and their sizes, see images.py
+    map_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     class Meta:
         ordering = ['convention', 'sort_order']
@@ -158,11 +174,22 @@ class PanelSchedule(ItemSchedule):
     panel = models.ForeignKey(Panel, on_delete=models.CASCADE,
                               related_name='schedule')
 
+    class Meta:
+        indexes = [
+            # Schedules are joined by panel, then excluded and ordered by day
+            models.Index(fields=['panel', 'day'], name='schedule_ps_panel_day'),
+        ]
+
 
 class RoomSchedule(ItemSchedule):
     room = models.ForeignKey(Room, on_delete=models.CASCADE,
                              related_name='schedule')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', 'day'], name='schedule_rs_room_day'),
+        ]
+
 
 class Track(models.Model):
     convention = models.ForeignKey(Convention, on_delete=models.CASCADE)
@@ -193,3 +220,38 @@ class Attendee(models.Model):
         unique_together = (
             ('user', 'panel'),
         )
+        indexes = [
+            # Partial indexes for the per-user hidden and starred lookups.
+            # Only a small fraction of rows are flagged, so these stay small
+            # where partial indexes are supported. Elsewhere Django skips
+            # them and the (user, panel) unique index covers the lookup.
+            models.Index(fields=['user', 'panel'],
+                         condition=models.Q(hide_from_user=True),
+                         name='schedule_att_user_hidden'),
+            models.Index(fields=['user', 'panel'],
+                         condition=models.Q(starred=True),
+                         name='schedule_att_user_starred'),
+        ]
+
+
+class ScheduleSnapshot(models.Model):
+    '''
+    Frozen copy of an archived convention's schedule. Holds the packed
+    view structures (pickled) along with the rendered JSON and ICS feeds,
+    so past years can be served without querying the schedule tables.
+    '''
+    convention = models.OneToOneField(Convention, on_delete=models.CASCADE,
+                                      related_name='schedule_snapshot')
+    year = models.IntegerField(unique=True)
+    created = models.DateTimeField(auto_now=True)
+    # See archive.snapshot_format
+    format = models.CharField(max_length=32, blank=True, default='')
+    packed = models.BinaryField()
+    json = models.TextField()
+    ics = models.BinaryField()
+
+    class Meta:
+        ordering = ['-year']
+
+    def __str__(self):
+        return '{} schedule snapshot'.format(self.convention)
@@ -0,0 +1,149 @@
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import datetime
+
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .cache import cached_for_version
+from .models import PanelSchedule, RoomSchedule
+
+# Per room: starts and ends are epoch seconds in start order, with
+# max_ends[i] the latest end among the first i+1 items; items are dicts.
+RoomTimeline = namedtuple('RoomTimeline', ['room', 'starts', 'max_ends', 'items'])
+
+
+def build_timelines(convention):
+    '''
+    Gather every visible panel and room opening for the convention into
+    per-room timelines, sorted by start time, for bisect lookups. Returns
+    an ordered list of RoomTimelines, in the rooms' display order.
+    '''
+    entries = {}
+    rooms = {}
+
+    panelschedules = PanelSchedule.objects.select_related(
+        'panel', 'panel__convention', 'panel__room', 'panel__track'
+    ).filter(panel__convention=convention, panel__hidden=False)
+    for panelschedule in panelschedules:
+        room = panelschedule.panel.room
+        rooms[room.id] = room
+        entries.setdefault(room.id, []).append({
+            'id': panelschedule.id,
+            'type': 'panel',
+            'title': panelschedule.panel.title,
+            'hosts': panelschedule.panel.hosts,
+            'track': panelschedule.panel.track.name,
+            'track_class': panelschedule.panel.track.class_name,
+            'start': panelschedule.start_timestamp.timestamp(),
+            'end': panelschedule.end_timestamp.timestamp(),
+            'url': reverse('schedule_panel_detail', args=[
+                panelschedule.id, slugify(panelschedule.panel.title)]),
+        })
+
+    roomschedules = RoomSchedule.objects.select_related(
+        'room', 'room__convention', 'room__track'
+    ).filter(room__convention=convention)
+    for roomschedule in roomschedules:
+        room = roomschedule.room
+        rooms[room.id] = room
+        entries.setdefault(room.id, []).append({
+            'id': roomschedule.id,
+            'type': 'room',
+            'title': room.name + ' Open',
+            'hosts': '',
+            'track': room.track.name if room.track else '',
+            'track_class': room.track.class_name if room.track else '',
+            'start': roomschedule.start_timestamp.timestamp(),
+            'end': roomschedule.end_timestamp.timestamp(),
+            'url': '',
+        })
+
+    timelines = []
+    for room_id, items in entries.items():
+        items.sort(key=lambda item: (item['start'], item['end']))
+        max_ends = []
+        latest = 0
+        for item in items:
+            latest = max(latest, item['end'])
+            max_ends.append(latest)
+        room = rooms[room_id]
+        timelines.append(RoomTimeline(
+            room={'id': room.id, 'name': room.name, 'alias': room.alias or '',
+                  'location_hint': room.location_hint or '', 'sort_order': room.sort_order},
+            starts=[item['start'] for item in items],
+            max_ends=max_ends,
+            items=items,
+        ))
+    timelines.sort(key=lambda timeline: (
+        timeline.room['sort_order'] if timeline.room['sort_order'] is not None else 99,
+        timeline.room['name']))
+    return timelines
+
+
+def get_timelines(convention):
+    '''The convention's room timelines, built once per schedule version'''
+    return cached_for_version('nownext', convention.pk, lambda: build_timelines(convention))
+
+
+def get_end_times(convention):
+    '''Every panel and room opening's end, sorted, once per schedule version'''
+    return cached_for_version('ends', convention.pk, lambda: sorted(
+        item['end'] for timeline in get_timelines(convention) for item in timeline.items))
+
+
+def past_window(convention, at=None):
+    '''
+    The end time (epoch seconds) of the last thing to have ended, or 0.
+    Which past items drop off the schedule only changes when this does.
+    '''
+    if at is None:
+        at = timezone.now().timestamp()
+    ends = get_end_times(convention)
+    ended = bisect_right(ends, at)
+    return ends[ended - 1] if ended else 0
+
+
+def now_and_next(timeline, at, upcoming=1):
+    '''
+    Find what's on in a room at the given epoch time, and the next few
+    items after. Returns (current, next) lists of item dicts.
+    '''
+    started = bisect_right(timeline.starts, at)
+    current = []
+    # Walk back through the items that have started, stopping once
+    # nothing earlier could still be running
+    i = started - 1
+    while i >= 0 and timeline.max_ends[i] > at:
+        if timeline.items[i]['end'] > at:
+            current.append(timeline.items[i])
+        i -= 1
+    current.reverse()
+    return current, timeline.items[started:started + upcoming]
+
+
+def room_status(convention, room_id=None, at=None, upcoming=1):
+    '''
+    Now and next for every room with anything left on, or just one room.
+    Returns a list of dicts with 'room', 'current' and 'next' keys.
+    '''
+    if at is None:
+        at = timezone.now().timestamp()
+    status = []
+    for timeline in get_timelines(convention):
+        if room_id is not None and timeline.room['id'] != room_id:
+            continue
+        current, upcoming_items = now_and_next(timeline, at, upcoming)
+        if current or upcoming_items or room_id is not None:
+            status.append({'room': timeline.room, 'current': current, 'next': upcoming_items})
+    return status
+
+
+def localize(item):
+    '''Copy of an item with datetimes in place of epoch times, for display'''
+    item = dict(item)
+    tz = timezone.get_current_timezone()
+    item['start'] = datetime.fromtimestamp(item['start'], tz)
+    item['end'] = datetime.fromtimestamp(item['end'], tz)
+    return item
@@ -0,0 +1,76 @@
+import copy
+
+from .cache import cached_for_version
+from .models import PanelSchedule, RoomSchedule, Track
+
+
+def build_partitions(convention):
+    '''
+    Every visible panel showing and room opening for the convention,
+    split up by track: a dict of track id to a dict of 'panelschedules'
+    and 'roomschedules' lists, each in day then id order. Rooms without
+    a track are under None.
+    '''
+    partitions = {}
+
+    def partition(track_id):
+        return partitions.setdefault(track_id, {'panelschedules': [], 'roomschedules': []})
+
+    panelschedules = PanelSchedule.objects.select_related(
+        'panel', 'panel__convention', 'panel__room', 'panel__track'
+    ).filter(
+        panel__convention=convention, panel__hidden=False
+    ).order_by('day', 'id')
+    for panelschedule in panelschedules:
+        partition(panelschedule.panel.track_id)['panelschedules'].append(panelschedule)
+
+    roomschedules = RoomSchedule.objects.select_related(
+        'room', 'room__convention', 'room__track'
+    ).filter(
+        room__convention=convention
+    ).order_by('day', 'id')
+    for roomschedule in roomschedules:
+        partition(roomschedule.room.track_id)['roomschedules'].append(roomschedule)
+    return partitions
+
+
+def get_partitions(convention):
+    '''The convention's track partitions, built once per schedule version'''
+    return cached_for_version('partitions', convention.pk, lambda: build_partitions(convention))
+
+
+def merge_partitions(partitions, track_ids=None):
+    '''
+    Put the partitions for the given track ids, or all of them, back
+    together into (panelschedules, roomschedules) lists, in day order.
+    The objects are shared with everyone else using the partitions, so
+    mustn't be changed.
+    '''
+    if track_ids is None:
+        selected = list(partitions.values())
+    else:
+        selected = [partitions[track_id] for track_id in set(track_ids) if track_id in partitions]
+    if len(selected) == 1:
+        return list(selected[0]['panelschedules']), list(selected[0]['roomschedules'])
+
+    def merged(name):
+        items = [item for part in selected for item in part[name]]
+        items.sort(key=lambda item: (item.day, item.id))
+        return items
+    return merged('panelschedules'), merged('roomschedules')
+
+
+def unshared(panelschedule):
+    '''
+    A copy of a PanelSchedule from the partitions, with its own copy of
+    the panel, that's safe to attach things to
+    '''
+    copied = copy.copy(panelschedule)
+    copied.panel = copy.copy(panelschedule.panel)
+    return copied
+
+
+def get_track_ids(convention):
+    '''The convention's track names to ids, once per schedule version'''
+    return cached_for_version('track_ids', convention.pk, lambda: dict(
+        Track.objects.filter(convention=convention).values_list('name', 'id')))
@@ -0,0 +1,166 @@
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from . import metrics
+from .models import Attendee, Panel
+
+PREFERENCES_CACHE_KEY = 'schedule:prefs:{convention_id}:{user_id}'
+PREFERENCES_VERSION_KEY = 'schedule:prefs_version:{convention_id}:{user_id}'
+
+# hidden, starred and attended are frozensets of panel ids; attendees maps
+# panel id to that user's Attendee record, for templates' attendee_info.
+Preferences = namedtuple('Preferences', ['hidden', 'starred', 'attended', 'attendees'])
+
+NO_PREFERENCES = Preferences(frozenset(), frozenset(), frozenset(), {})
+
+# Attendee flags and the Panel counters that count them
+COUNTERS = (
+    ('starred', 'star_count'),
+    ('hide_from_user', 'hide_count'),
+    ('attended', 'attended_count'),
+)
+
+
+def get_preferences(user, convention):
+    '''
+    Load a user's preferences for one convention's panels, from the cache
+    when possible. Anonymous users have none.
+    '''
+    if not user or not user.is_authenticated:
+        return NO_PREFERENCES
+
+    key = PREFERENCES_CACHE_KEY.format(convention_id=convention.pk, user_id=user.pk)
+    prefs = cache.get(key)
+    metrics.cache_result('preferences', prefs is not None)
+    if prefs is None:
+        attendees = {attendee.panel_id: attendee for attendee in
+                     Attendee.objects.filter(user=user, panel__convention=convention)}
+        prefs = Preferences(
+            hidden=frozenset(panel_id for panel_id, attendee in attendees.items()
+                             if attendee.hide_from_user),
+            starred=frozenset(panel_id for panel_id, attendee in attendees.items()
+                              if attendee.starred),
+            attended=frozenset(panel_id for panel_id, attendee in attendees.items()
+                               if attendee.attended),
+            attendees=attendees,
+        )
+        cache.set(key, prefs, timeout=getattr(settings, 'SCHEDULE_PREFERENCES_CACHE_TIMEOUT', 60*60))
+    return prefs
+
+
+def get_preferences_version(user, convention_id):
+    '''
+    A millisecond timestamp of the user's last preference change for the
+    convention, like the schedule version (see cache.py). Anonymous users
+    are always 0.
+    '''
+    if not user or not user.is_authenticated:
+        return 0
+    key = PREFERENCES_VERSION_KEY.format(convention_id=convention_id, user_id=user.pk)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def clear_preferences(user, convention_id):
+    '''Drop the cached preferences after the user changes one'''
+    cache.delete(PREFERENCES_CACHE_KEY.format(convention_id=convention_id, user_id=user.pk))
+    cache.set(PREFERENCES_VERSION_KEY.format(convention_id=convention_id, user_id=user.pk),
+              int(time.time() * 1000), timeout=None)
+
+
+async def aclear_preferences(user, convention_id):
+    await cache.adelete(PREFERENCES_CACHE_KEY.format(convention_id=convention_id, user_id=user.pk))
+    await cache.aset(PREFERENCES_VERSION_KEY.format(convention_id=convention_id, user_id=user.pk),
+                     int(time.time() * 1000), timeout=None)
+
+
+def save_preference(user, panel, changes):
+    '''
+    Update (or create) a user's Attendee record for a panel with the
+    given field values, adjusting the panel's counters to match. The
+    panel row is locked first, so two changes to it at once (even the
+    same user's first two clicks, before there's a record to lock) are
+    made one after the other, and the counters stay right.
+    '''
+    with transaction.atomic():
+        Panel.objects.select_for_update().only('id').get(id=panel.id)
+        attendee = Attendee.objects.filter(user=user, panel=panel).first()
+        if attendee is None:
+            attendee = Attendee(user=user, panel=panel)
+        before = {flag: bool(getattr(attendee, flag)) for flag, counter in COUNTERS}
+        for name, value in changes.items():
+            setattr(attendee, name, Attendee._meta.get_field(name).to_python(value))
+        # Counted here, not by the attendee_saved signal
+        attendee._counted = True
+        attendee.save()
+
+        counts = {}
+        for flag, counter in COUNTERS:
+            delta = bool(getattr(attendee, flag)) - before[flag]
+            if delta:
+                counts[counter] = F(counter) + delta
+        if counts:
+            Panel.objects.filter(id=panel.id).update(**counts)
+    return attendee
+
+
+def recount_preferences(panels):
+    '''
+    Recompute the counters for a queryset of panels from their Attendee
+    records, in a single UPDATE. Attendee records saved or deleted some
+    other way than save_preference are recounted by signals; this is
+    for after bulk changes that don't send them.
+    '''
+    counts = {}
+    for flag, counter in COUNTERS:
+        count = Attendee.objects.filter(panel=OuterRef('pk'), **{flag: True}).order_by() \
+            .values('panel').annotate(count=Count('pk')).values('count')
+        counts[counter] = Coalesce(Subquery(count, output_field=IntegerField()), Value(0))
+    return panels.update(**counts)
+
+
+def filter_preferences(panelschedules, prefs, addl_filter):
+    '''
+    Filter an already loaded list of PanelSchedules for a user, the same
+    way filter_panels_rooms does in the database: the default view drops
+    hidden panels, custom keeps only starred ones.
+    '''
+    if addl_filter == '':
+        hidden = prefs.hidden
+        return [panelschedule for panelschedule in panelschedules
+                if panelschedule.panel_id not in hidden]
+    if addl_filter == 'custom':
+        starred = prefs.starred
+        return [panelschedule for panelschedule in panelschedules
+                if panelschedule.panel_id in starred]
+    return list(panelschedules)
+
+
+def apply_preferences(panelschedules, prefs, addl_filter):
+    '''
+    filter_preferences, then attach the user's attendee_info to each
+    panel for the templates.
+    '''
+    panelschedules = filter_preferences(panelschedules, prefs, addl_filter)
+    attach_preferences(panelschedules, prefs)
+    return panelschedules
+
+
+def attach_preferences(panelschedules, prefs):
+    '''
+    Set attendee_info on each panel, just like prefetching the user's
+    attendee_set with to_attr='attendee_info' would.
+    '''
+    attendees = prefs.attendees
+    for panelschedule in panelschedules:
+        attendee = attendees.get(panelschedule.panel_id)
+        panelschedule.panel.attendee_info = [attendee] if attendee else []
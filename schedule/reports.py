@@ -0,0 +1,70 @@
+from django.conf import settings
+from django.db.models import Count, Q
+
+from .cache import cached_for_version
+from .models import Attendee, Panel
+
+FEEDBACK_CSV_HEADER = ['panel id', 'panel', 'track', 'room', 'attended', 'feedback']
+
+# Cells starting with these are run as formulas by spreadsheets
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def spreadsheet_safe(value):
+    '''Quote a text cell so a spreadsheet shows it rather than running it'''
+    if value and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def build_feedback_summary(convention):
+    '''
+    Per-panel star, hide, attendance and feedback counts for the
+    convention, all counted by the database in one grouped query.
+    '''
+    has_feedback = Q(attendee__feedback__isnull=False) & ~Q(attendee__feedback='')
+    panels = Panel.objects.filter(convention=convention).annotate(
+        stars=Count('attendee', filter=Q(attendee__starred=True)),
+        hides=Count('attendee', filter=Q(attendee__hide_from_user=True)),
+        attended_yes=Count('attendee', filter=Q(attendee__attended=True)),
+        attended_no=Count('attendee', filter=Q(attendee__attended=False)),
+        feedback=Count('attendee', filter=has_feedback),
+    ).values(
+        'id', 'title', 'hidden', 'track__name', 'room__name',
+        'stars', 'hides', 'attended_yes', 'attended_no', 'feedback',
+    ).order_by('title')
+    return list(panels)
+
+
+def feedback_summary(convention):
+    '''
+    The feedback summary, cached per schedule version. Preferences don't
+    change the schedule version, so it's also only kept for a few
+    minutes, SCHEDULE_REPORT_CACHE_TIMEOUT.
+    '''
+    return cached_for_version('feedback_report', convention.pk,
+                              lambda: build_feedback_summary(convention),
+                              timeout=getattr(settings, 'SCHEDULE_REPORT_CACHE_TIMEOUT', 60*5))
+
+
+def feedback_rows(convention, panel_id=None):
+    '''
+    Generator of CSV rows of every attendance answer and feedback for
+    the convention, or just one panel, header first. Rows are streamed
+    from the database in chunks, so memory use doesn't grow with the
+    size of the convention.
+    '''
+    attendees = Attendee.objects.filter(panel__convention=convention).filter(
+        Q(attended__isnull=False) | (Q(feedback__isnull=False) & ~Q(feedback=''))
+    )
+    if panel_id is not None:
+        attendees = attendees.filter(panel_id=panel_id)
+    attendees = attendees.values_list(
+        'panel_id', 'panel__title', 'panel__track__name', 'panel__room__name', 'attended', 'feedback',
+    ).order_by('panel__title', 'id')
+
+    yield FEEDBACK_CSV_HEADER
+    for panel_id, title, track, room, attended, feedback in attendees.iterator(chunk_size=2000):
+        # Anyone can write feedback, and this is meant for a spreadsheet
+        yield [panel_id, spreadsheet_safe(title), spreadsheet_safe(track), spreadsheet_safe(room),
+               '' if attended is None else ('yes' if attended else 'no'), spreadsheet_safe(feedback or '')]
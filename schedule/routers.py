@@ -0,0 +1,92 @@
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+
+from convention import get_convention_model
+
+PRIMARY_PIN_KEY = 'schedule:primary_pin:{user_id}'
+
+# The database schedule reads go to right now, set by the views; None
+# leaves them on the default database like everything else.
+read_database = ContextVar('schedule_read_database', default=None)
+
+
+class ScheduleReplicaRouter(object):
+    '''
+    Sends reads of the schedule (and the convention) to the replica named
+    in SCHEDULE_READ_DATABASE, but only inside reads_from(), which the
+    schedule pages and feeds use. The admin, management commands, writes
+    and everything else stay on the default database. Add it to
+    DATABASE_ROUTERS.
+    '''
+
+    def db_for_read(self, model, **hints):
+        alias = read_database.get()
+        if alias is None:
+            return None
+        if model._meta.app_label != 'schedule' and model is not get_convention_model():
+            return None
+        # Related objects of something already loaded come from the same place
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return alias
+
+
+@contextmanager
+def reads_from(alias):
+    '''Route the schedule reads in the block to the given alias, None for the default'''
+    token = read_database.set(alias)
+    try:
+        yield
+    finally:
+        read_database.reset(token)
+
+
+def pin_timeout():
+    return getattr(settings, 'SCHEDULE_PRIMARY_PIN_SECONDS', 10)
+
+
+def pin_to_primary(user):
+    '''
+    After the user's written something, keep their schedule reads on the
+    default database for a while, so they see it before the replica does.
+    '''
+    cache.set(PRIMARY_PIN_KEY.format(user_id=user.pk), 1, timeout=pin_timeout())
+
+
+async def apin_to_primary(user):
+    await cache.aset(PRIMARY_PIN_KEY.format(user_id=user.pk), 1, timeout=pin_timeout())
+
+
+def replica_for(user):
+    '''The alias to read the user's schedule from: the replica, unless they're pinned'''
+    alias = getattr(settings, 'SCHEDULE_READ_DATABASE', None)
+    if alias and user is not None and user.is_authenticated \
+            and cache.get(PRIMARY_PIN_KEY.format(user_id=user.pk)):
+        return None
+    return alias
+
+
+async def areplica_for(user):
+    alias = getattr(settings, 'SCHEDULE_READ_DATABASE', None)
+    if alias and user is not None and user.is_authenticated \
+            and await cache.aget(PRIMARY_PIN_KEY.format(user_id=user.pk)):
+        return None
+    return alias
+
+
+def fresh_reads(version):
+    '''
+    Read from the default database to build something for a schedule
+    version (a millisecond timestamp, see cache.py) newer than the pin
+    timeout, since the replica may not have the edit yet. Whatever's
+    built is cached for everyone under that version, so it mustn't miss
+    it. Otherwise the reads stay where they are.
+    '''
+    if read_database.get() is not None and time.time() * 1000 - version < pin_timeout() * 1000:
+        return reads_from(None)
+    return nullcontext()
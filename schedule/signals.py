@@ -0,0 +1,158 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import events
+from .cache import bump_schedule_version
+from .images import update_map_variants
+from .models import Attendee, Panel, PanelSchedule, Room, RoomSchedule, Track
+from .preferences import recount_preferences
+
+# Signal receivers that bump the schedule version (see cache.py) and turn
+# schedule edits into live events (see events.py)
+
+
+def panelschedule_data(panelschedule, panel=None):
+    panel = panel or panelschedule.panel
+    return {
+        'panelschedule': panelschedule.id,
+        'panel': panel.id,
+        'title': panel.title,
+        'room': panel.room.name,
+        'day': panelschedule.get_day_display(),
+        'start': panelschedule.start_time.strftime('%H:%M'),
+        'end': panelschedule.end_time.strftime('%H:%M'),
+    }
+
+
+def roomschedule_data(roomschedule):
+    return {
+        'roomschedule': roomschedule.id,
+        'room': roomschedule.room.name,
+        'day': roomschedule.get_day_display(),
+        'start': roomschedule.start_time.strftime('%H:%M'),
+        'end': roomschedule.end_time.strftime('%H:%M'),
+    }
+
+
+@receiver(pre_save, sender=Panel)
+@receiver(pre_save, sender=PanelSchedule)
+def remember_previous(sender, instance, raw=False, **kwargs):
+    '''Keep the saved copy around, to tell what actually changed'''
+    instance._previous = None
+    if instance.pk and not raw:
+        instance._previous = sender.objects.filter(pk=instance.pk).first()
+
+
+@receiver(post_save, sender=PanelSchedule)
+def panelschedule_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous', None)
+    if created or previous is None:
+        event_type = 'panel_added'
+    elif (previous.day, previous.start_time, previous.end_time) != \
+            (instance.day, instance.start_time, instance.end_time):
+        event_type = 'panel_moved'
+    else:
+        return
+    if instance.panel.hidden:
+        return
+    events.publish(instance.panel.convention_id, event_type, panelschedule_data(instance))
+
+
+@receiver(post_delete, sender=PanelSchedule)
+def panelschedule_deleted(sender, instance, **kwargs):
+    try:
+        panel = instance.panel
+    except Panel.DoesNotExist:
+        # Deleted along with the panel
+        return
+    events.publish(panel.convention_id, 'panel_cancelled', panelschedule_data(instance, panel))
+
+
+@receiver(post_save, sender=Panel)
+def panel_saved(sender, instance, created, raw=False, **kwargs):
+    previous = getattr(instance, '_previous', None)
+    if raw or created or previous is None:
+        return
+    if instance.hidden and not previous.hidden:
+        event_type = 'panel_cancelled'
+    elif previous.hidden and not instance.hidden:
+        event_type = 'panel_added'
+    elif previous.room_id != instance.room_id and not instance.hidden:
+        event_type = 'panel_moved'
+    else:
+        return
+    for panelschedule in instance.schedule.all():
+        events.publish(instance.convention_id, event_type,
+                       panelschedule_data(panelschedule, instance))
+
+
+@receiver(post_save, sender=RoomSchedule)
+def roomschedule_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    events.publish(instance.room.convention_id, 'room_changed', roomschedule_data(instance))
+
+
+@receiver(post_delete, sender=RoomSchedule)
+def roomschedule_deleted(sender, instance, **kwargs):
+    try:
+        room = instance.room
+    except Room.DoesNotExist:
+        # Deleted along with the room
+        return
+    events.publish(room.convention_id, 'room_closed', roomschedule_data(instance))
+
+
+@receiver(post_save, sender=Attendee)
+@receiver(post_delete, sender=Attendee)
+def attendee_changed(sender, instance, raw=False, **kwargs):
+    '''
+    Recount the panel's counters after an Attendee record's written
+    anywhere but save_preference, which counts its own: the admin, the
+    shell, deleting a user.
+    '''
+    if raw or getattr(instance, '_counted', False):
+        return
+    recount_preferences(Panel.objects.filter(id=instance.panel_id))
+
+
+@receiver(post_save, sender=Panel)
+@receiver(post_save, sender=Room)
+def map_image_saved(sender, instance, raw=False, **kwargs):
+    '''Resize a newly uploaded map, before the version bump below'''
+    if raw:
+        return
+    update_map_variants(instance)
+
+
+def schedule_convention_id(instance):
+    '''Find the convention a schedule object belongs to, if it still exists'''
+    try:
+        if isinstance(instance, PanelSchedule):
+            return instance.panel.convention_id
+        if isinstance(instance, RoomSchedule):
+            return instance.room.convention_id
+    except (Panel.DoesNotExist, Room.DoesNotExist):
+        # Deleted along with the parent, which bumps the version itself
+        return None
+    return instance.convention_id
+
+
+@receiver(post_save, sender=Panel)
+@receiver(post_save, sender=PanelSchedule)
+@receiver(post_save, sender=Room)
+@receiver(post_save, sender=RoomSchedule)
+@receiver(post_save, sender=Track)
+@receiver(post_delete, sender=Panel)
+@receiver(post_delete, sender=PanelSchedule)
+@receiver(post_delete, sender=Room)
+@receiver(post_delete, sender=RoomSchedule)
+@receiver(post_delete, sender=Track)
+def schedule_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    convention_id = schedule_convention_id(instance)
+    if convention_id is not None:
+        bump_schedule_version(convention_id)
@@ -0,0 +1,427 @@
+import random
+import time
+from collections import Counter, namedtuple
+from datetime import time as dt_time
+from itertools import combinations
+
+from .models import Attendee, Panel, PanelSchedule, Room, RoomSchedule
+from .utils import con_minutes
+
+SLOT_MINUTES = 30
+# Co-star weight between two showings of the same panel, so repeats
+# don't get put on top of each other
+SAME_PANEL_WEIGHT = 1000
+
+# Time is cut into SLOT_MINUTES slots, numbered straight through the days,
+# slots_per_day to a day starting at day_start con minutes. Showings are
+# dicts with the panel, title, panelschedule id (None if it's new), length
+# in slots, candidate rooms, current (room, slot) if it's placed and the
+# (day, start, end) it's scheduled for now, if it is. available maps each
+# room id to a bytearray of which slots it's open, weights each panel id
+# to {panel id: users who starred both}. fixed lists the titles of the
+# showings left where they are, outside of the days and hours solved for.
+Problem = namedtuple('Problem', [
+    'days', 'day_start', 'slots_per_day', 'rooms', 'showings', 'panel_showings',
+    'available', 'weights', 'fixed',
+])
+
+
+def load_problem(convention, days, day_start, day_end, default_duration=60, any_room=False):
+    '''
+    Gather a convention's panels into a Problem for the solver. Candidate
+    rooms for a panel are the rooms its track already uses (or any room
+    at all with any_room), a room's availability is its RoomSchedule open
+    hours if it has any, otherwise the whole day_start to day_end window.
+    Panels that aren't scheduled yet get a single default_duration
+    (minutes) showing to place.
+
+    Showings off the SLOT_MINUTES grid count as being in every slot they
+    touch. Those not wholly within the days and hours given are left
+    where they are: not moved, but still taking up their room (and
+    keeping the rest of the panel's showings in it). So are hidden
+    panels' showings.
+    '''
+    slots_per_day = (day_end - day_start) // SLOT_MINUTES
+    total_slots = slots_per_day * len(days)
+
+    def slot_range(day, start, end, inner=False):
+        '''
+        The (first, last + 1) slots a time range touches within the day,
+        or only those it wholly covers with inner. None if it's not on
+        one of the days, or is outside the hours.
+        '''
+        if day not in days:
+            return None
+        start_offset = con_minutes(start) - day_start
+        end_offset = con_minutes(end) - day_start
+        if inner:
+            first, last = -(-start_offset // SLOT_MINUTES), end_offset // SLOT_MINUTES
+        else:
+            first, last = start_offset // SLOT_MINUTES, -(-end_offset // SLOT_MINUTES)
+        first, last = max(0, first), min(slots_per_day, last)
+        if first >= last:
+            return None
+        base = days.index(day) * slots_per_day
+        return base + first, base + last
+
+    def within(day, start, end):
+        return day in days and con_minutes(start) >= day_start and \
+            con_minutes(end) <= day_start + slots_per_day * SLOT_MINUTES
+
+    rooms = {room.id: room.name for room in Room.objects.filter(convention=convention)}
+    available = {}
+    for room_id in rooms:
+        available[room_id] = bytearray(b'\x01' * total_slots)
+    open_hours = {}
+    for roomschedule in RoomSchedule.objects.filter(room__convention=convention):
+        # Only the slots it's open for the whole of
+        hours = slot_range(roomschedule.day, roomschedule.start_time, roomschedule.end_time, inner=True)
+        if hours is None:
+            continue
+        room_hours = open_hours.setdefault(roomschedule.room_id, bytearray(total_slots))
+        for slot in range(*hours):
+            room_hours[slot] = 1
+    available.update(open_hours)
+
+    def take(room_id, day, start, end):
+        '''Mark a showing that isn't being moved as using its room'''
+        taken = slot_range(day, start, end)
+        if taken is not None and room_id in available:
+            for slot in range(*taken):
+                available[room_id][slot] = 0
+
+    for panelschedule in PanelSchedule.objects.filter(
+            panel__convention=convention, panel__hidden=True).select_related('panel'):
+        take(panelschedule.panel.room_id, panelschedule.day, panelschedule.start_time, panelschedule.end_time)
+
+    panels = list(Panel.objects.filter(convention=convention, hidden=False)
+                  .select_related('track').prefetch_related('schedule'))
+    track_rooms = {}
+    for panel in panels:
+        track_rooms.setdefault(panel.track_id, set()).add(panel.room_id)
+
+    showings = []
+    panel_showings = {}
+    fixed = []
+    for panel in panels:
+        candidates = sorted(rooms) if any_room else sorted(track_rooms[panel.track_id])
+        schedules = list(panel.schedule.all())
+        if any(not within(ps.day, ps.start_time, ps.end_time) for ps in schedules):
+            # Can't move out of the room its fixed showings are in
+            candidates = [panel.room_id]
+        for panelschedule in schedules or [None]:
+            if panelschedule is None:
+                length = -(-default_duration // SLOT_MINUTES)
+                current = None
+                scheduled = None
+            else:
+                scheduled = (panelschedule.day, panelschedule.start_time, panelschedule.end_time)
+                if not within(*scheduled):
+                    take(panel.room_id, *scheduled)
+                    fixed.append(panel.title)
+                    continue
+                first, last = slot_range(*scheduled)
+                length = last - first
+                current = (panel.room_id, first)
+            panel_showings.setdefault(panel.id, []).append(len(showings))
+            showings.append({
+                'panel': panel.id,
+                'title': panel.title,
+                'panelschedule': panelschedule.id if panelschedule else None,
+                'length': length,
+                'rooms': candidates,
+                'current': current,
+                'scheduled': scheduled,
+            })
+
+    # Count the users who starred each pair of panels
+    starred = {}
+    for user_id, panel_id in Attendee.objects.filter(
+            panel__convention=convention, panel__hidden=False, starred=True
+    ).values_list('user_id', 'panel_id').order_by('user_id').iterator():
+        if panel_id in panel_showings:
+            starred.setdefault(user_id, []).append(panel_id)
+    pairs = Counter()
+    for panel_ids in starred.values():
+        pairs.update(combinations(sorted(panel_ids), 2))
+    weights = {panel_id: {} for panel_id in panel_showings}
+    for (a, b), count in pairs.items():
+        weights[a][b] = count
+        weights[b][a] = count
+
+    return Problem(days, day_start, slots_per_day, rooms, showings, panel_showings, available, weights, fixed)
+
+
+class Solver:
+    '''
+    Assigns each showing a room and start slot, keeping to the rooms'
+    open hours without double booking, and trying to keep co-starred
+    panels from running at the same time. The cost is the number of
+    slots two showings overlap, times the users who starred both.
+
+    Showings are placed greedily, most co-starred first, each where it
+    costs least so far. Then a local search keeps moving single showings
+    to their cheapest spot, or swapping two of the same length, while it
+    helps. A panel only has one room, so all its showings share it.
+
+    stability is a cost for moving a showing from where it is now, so
+    that small gains don't reshuffle the whole schedule.
+    '''
+
+    def __init__(self, problem, stability=1.0, seed=None):
+        self.problem = problem
+        self.stability = stability
+        self.random = random.Random(seed)
+        self.total_slots = problem.slots_per_day * len(problem.days)
+        self.occupied = {room_id: [-1] * self.total_slots for room_id in problem.rooms}
+        self.placed = [None] * len(problem.showings)
+        self.unplaced = []
+
+    # Bookkeeping
+
+    def place(self, index, room_id, start):
+        occupied = self.occupied[room_id]
+        for slot in range(start, start + self.problem.showings[index]['length']):
+            occupied[slot] = index
+        self.placed[index] = (room_id, start)
+
+    def remove(self, index):
+        room_id, start = self.placed[index]
+        occupied = self.occupied[room_id]
+        for slot in range(start, start + self.problem.showings[index]['length']):
+            occupied[slot] = -1
+        self.placed[index] = None
+        return room_id, start
+
+    def fits(self, index, room_id, start):
+        length = self.problem.showings[index]['length']
+        day_end = (start // self.problem.slots_per_day + 1) * self.problem.slots_per_day
+        if start + length > day_end:
+            return False
+        available = self.problem.available[room_id]
+        occupied = self.occupied[room_id]
+        for slot in range(start, start + length):
+            if not available[slot] or occupied[slot] not in (-1, index):
+                return False
+        return True
+
+    def neighbours(self, index):
+        '''Placed showings that cost something to overlap, with weights'''
+        problem = self.problem
+        panel_id = problem.showings[index]['panel']
+        for other_panel, weight in problem.weights[panel_id].items():
+            for other in problem.panel_showings[other_panel]:
+                if self.placed[other] is not None:
+                    yield other, weight
+        for other in problem.panel_showings[panel_id]:
+            if other != index and self.placed[other] is not None:
+                yield other, SAME_PANEL_WEIGHT
+
+    def cost_profile(self, index):
+        '''
+        Prefix sums of the co-star weight running in each slot, so the
+        cost of any start is one subtraction.
+        '''
+        weights = [0] * self.total_slots
+        for other, weight in self.neighbours(index):
+            room_id, start = self.placed[other]
+            for slot in range(start, start + self.problem.showings[other]['length']):
+                weights[slot] += weight
+        prefix = [0] * (self.total_slots + 1)
+        for slot, weight in enumerate(weights):
+            prefix[slot + 1] = prefix[slot] + weight
+        return prefix
+
+    def room_choices(self, index):
+        '''A panel's room is fixed once any of its showings is placed'''
+        showing = self.problem.showings[index]
+        for other in self.problem.panel_showings[showing['panel']]:
+            if other != index and self.placed[other] is not None:
+                return [self.placed[other][0]]
+        return showing['rooms']
+
+    def best_spot(self, index):
+        '''
+        The cheapest (cost, room, start) the showing fits, counting the
+        stability cost of moving away from where it is now. None if it
+        doesn't fit anywhere.
+        '''
+        showing = self.problem.showings[index]
+        prefix = self.cost_profile(index)
+        length = showing['length']
+        rooms = self.room_choices(index)
+        starts = [start for start in range(self.total_slots - length + 1)
+                  if start % self.problem.slots_per_day + length <= self.problem.slots_per_day]
+        starts.sort(key=lambda start: prefix[start + length] - prefix[start])
+
+        best = None
+        current = showing['current']
+        if current and current[0] in rooms and self.fits(index, *current):
+            best = (prefix[current[1] + length] - prefix[current[1]], current[0], current[1])
+        # Starts are in order of cost, so the first that fits is the best
+        for start in starts:
+            cost = prefix[start + length] - prefix[start] + (self.stability if current else 0)
+            if best is not None and cost >= best[0]:
+                break
+            room_id = next((room_id for room_id in rooms if self.fits(index, room_id, start)), None)
+            if room_id is not None:
+                best = (cost, room_id, start)
+                break
+        return best
+
+    def spot_cost(self, index, room_id, start):
+        '''Cost of the showing at a spot, against everything else placed'''
+        showing = self.problem.showings[index]
+        prefix = self.cost_profile(index)
+        cost = prefix[start + showing['length']] - prefix[start]
+        if showing['current'] and showing['current'] != (room_id, start):
+            cost += self.stability
+        return cost
+
+    # Search
+
+    def greedy(self):
+        problem = self.problem
+        order = sorted(range(len(problem.showings)), key=lambda index: (
+            -sum(problem.weights[problem.showings[index]['panel']].values()),
+            -problem.showings[index]['length'],
+        ))
+        for index in order:
+            spot = self.best_spot(index)
+            if spot is None:
+                self.unplaced.append(index)
+            else:
+                self.place(index, spot[1], spot[2])
+
+    def relocate(self, index):
+        '''Move a showing to its cheapest spot, if that's cheaper'''
+        room_id, start = self.placed[index]
+        before = self.spot_cost(index, room_id, start)
+        spot = self.best_spot(index)
+        if spot is not None and spot[0] < before:
+            self.remove(index)
+            self.place(index, spot[1], spot[2])
+            return True
+        return False
+
+    def swap(self, first, second):
+        '''Swap two showings of the same length, if that's cheaper'''
+        showings = self.problem.showings
+        if first == second or showings[first]['length'] != showings[second]['length'] or \
+                showings[first]['panel'] == showings[second]['panel']:
+            return False
+        first_spot, second_spot = self.placed[first], self.placed[second]
+        # Changing rooms only works for panels shown once, in a room it can use
+        for index, spot in ((first, second_spot), (second, first_spot)):
+            if spot[0] != self.placed[index][0] and (
+                    len(self.problem.panel_showings[showings[index]['panel']]) > 1 or
+                    spot[0] not in showings[index]['rooms']):
+                return False
+
+        self.remove(first)
+        self.remove(second)
+        # With both out of the way; the two overlapping each other costs
+        # the same either way round
+        before = self.spot_cost(first, *first_spot) + self.spot_cost(second, *second_spot)
+        after = self.spot_cost(first, *second_spot) + self.spot_cost(second, *first_spot)
+        if after < before and self.fits(first, *second_spot) and self.fits(second, *first_spot):
+            self.place(first, *second_spot)
+            self.place(second, *first_spot)
+            return True
+        self.place(first, *first_spot)
+        self.place(second, *second_spot)
+        return False
+
+    def local_search(self, iterations=20000, time_limit=None):
+        '''Returns the number of improving moves made'''
+        deadline = time.monotonic() + time_limit if time_limit else None
+        placed = [index for index, spot in enumerate(self.placed) if spot is not None]
+        if not placed:
+            return 0
+        moves = 0
+        for iteration in range(iterations):
+            if deadline and iteration % 100 == 0 and time.monotonic() > deadline:
+                break
+            index = self.random.choice(placed)
+            if self.random.random() < 0.3:
+                moved = self.swap(index, self.random.choice(placed))
+            else:
+                moved = self.relocate(index)
+            moves += moved
+        return moves
+
+    def solve(self, iterations=20000, time_limit=None):
+        self.greedy()
+        self.local_search(iterations, time_limit)
+        # Things may have moved out of the way of anything left over
+        for index in list(self.unplaced):
+            spot = self.best_spot(index)
+            if spot is not None:
+                self.place(index, spot[1], spot[2])
+                self.unplaced.remove(index)
+        return self.placed
+
+
+def schedule_cost(problem, placement):
+    '''Total co-star overlap of a placement, each pair counted once'''
+    cost = 0
+    for index, spot in enumerate(placement):
+        if spot is None:
+            continue
+        showing = problem.showings[index]
+        start, end = spot[1], spot[1] + showing['length']
+        others = [(other, weight) for other_panel, weight in problem.weights[showing['panel']].items()
+                  for other in problem.panel_showings[other_panel]]
+        others += [(other, SAME_PANEL_WEIGHT) for other in problem.panel_showings[showing['panel']]
+                   if other != index]
+        for other, weight in others:
+            if other < index or placement[other] is None:
+                continue
+            other_start = placement[other][1]
+            other_end = other_start + problem.showings[other]['length']
+            cost += weight * max(0, min(end, other_end) - max(start, other_start))
+    return cost
+
+
+def slot_times(problem, start, length):
+    '''(weekday, start time, end time) of a run of slots'''
+    day = problem.days[start // problem.slots_per_day]
+
+    def to_time(slot):
+        minutes = (problem.day_start + slot * SLOT_MINUTES) % (24 * 60)
+        return dt_time(minutes // 60, minutes % 60)
+
+    offset = start % problem.slots_per_day
+    return day, to_time(offset), to_time(offset + length)
+
+
+def describe_changes(problem, placement):
+    '''
+    Lines of a diff between the current schedule and a placement: a '-'
+    line for where a showing is now and a '+' line for where it'd go.
+    '''
+    weekdays = dict(PanelSchedule.WEEKDAYS)
+
+    def describe(index, spot):
+        showing = problem.showings[index]
+        if spot == showing['current']:
+            # Where it really is, which may be off the slot grid
+            day, start, end = showing['scheduled']
+        else:
+            day, start, end = slot_times(problem, spot[1], showing['length'])
+        return '{}  {} {:%H:%M}-{:%H:%M}  {}'.format(
+            showing['title'], weekdays[day], start, end, problem.rooms[spot[0]])
+
+    lines = []
+    changes = [(spot, index) for index, spot in enumerate(placement)
+               if spot != problem.showings[index]['current']]
+    changes.sort(key=lambda change: (change[0] is None, change[0] and change[0][1], change[1]))
+    for spot, index in changes:
+        current = problem.showings[index]['current']
+        if current:
+            lines.append('- ' + describe(index, current))
+        if spot:
+            lines.append('+ ' + describe(index, spot))
+        else:
+            lines.append('! {}  no room available'.format(problem.showings[index]['title']))
+    return lines
@@ -0,0 +1,46 @@
+/*
+ * Keeps a copy of the schedule bundle in localStorage for offline use.
+ * Checks the manifest each time, and only downloads the bundle when its
+ * hash has changed. Calls back with the bundle, or the stored copy if
+ * the network's not cooperating.
+ *
+ *   loadScheduleBundle('/schedule/bundle/manifest.json', function (bundle) { ... });
+ */
+function loadScheduleBundle(manifestUrl, callback) {
+  var stored = null;
+  try {
+    stored = JSON.parse(localStorage.getItem('scheduleBundle'));
+  } catch (e) {}
+
+  fetch(manifestUrl, {cache: 'no-cache'}).then(function (response) {
+    return response.json();
+  }).then(function (manifest) {
+    if (stored && stored.hash === manifest.hash) {
+      return stored.bundle;
+    }
+    return fetch(manifest.url).then(function (response) {
+      return response.json();
+    }).then(function (bundle) {
+      try {
+        localStorage.setItem('scheduleBundle', JSON.stringify({hash: manifest.hash, bundle: bundle}));
+      } catch (e) {}
+      return bundle;
+    });
+  }).catch(function () {
+    return stored ? stored.bundle : null;
+  }).then(callback);
+}
+
+/* Turn a bundle's panel records back into objects, with names filled in */
+function scheduleBundlePanels(bundle) {
+  return bundle.panels.map(function (record) {
+    var panel = {};
+    bundle.panel_fields.forEach(function (field, i) {
+      panel[field] = record[i];
+    });
+    panel.hosts = bundle.hosts[panel.hosts];
+    panel.room = bundle.rooms[panel.room];
+    panel.track = bundle.tracks[panel.track][0];
+    return panel;
+  });
+}
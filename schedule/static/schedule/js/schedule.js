@@ -1,3 +1,6 @@
+// The user's preferences, for pages served the same to everyone
+var schedulePrefs = null;
+
 $(function () {
   // Grid view, show the requested tab
   if (window.location.hash && $('li.tab a[href="' + window.location.hash + '"]').length == 1) {
@@ -11,9 +14,18 @@ $(function () {
   $('[data-toggle="popover"]').popover().on('inserted.bs.popover', function () {
     var o = $(this);
     var p = $('#' + $(this).attr('aria-describedby'));
+    if (schedulePrefs) {
+      mergePrefs(p);
+    }
     fixPrefLinks(p, o, o);
   });
   fixPrefLinks($('div.panel-content'), null);
+
+  // Pages served the same to everyone leave the user's preferences to us
+  var preferencesUrl = $('#schedule').data('preferences-url');
+  if (preferencesUrl) {
+    $.getJSON(preferencesUrl, applySchedulePrefs);
+  }
   if ($(window).width() < 400) {
     $('li.tab a').each(function() {
       var a = $(this);
@@ -63,7 +75,18 @@ $(function () {
     }
   });
 
-  /* Scroll schedule to fill view, disabled for now...
+  // Live schedule changes pushed from the server
+  var eventsUrl = $('#schedule').data('events-url');
+  if (window.EventSource && eventsUrl) {
+    var source = new EventSource(eventsUrl);
+    ['panel_added', 'panel_moved', 'panel_cancelled', 'room_changed', 'room_closed', 'reload'].forEach(function(type) {
+      source.addEventListener(type, function(e) {
+        applyScheduleEvent(type, JSON.parse(e.data));
+      });
+    });
+  }
+
+    /* Scroll schedule to fill view, disabled for now...
   $('html,body').animate({
     scrollTop: ($('.nav-tabs').offset().top - 50) + 'px'
   }, 'fast');*/
@@ -107,6 +130,9 @@ function fixPrefLinks(p, o, initial=true) {
       e.preventDefault();
       $.get($(this).attr('href'),
         function(data) {
+          if (schedulePrefs) {
+            updateSchedulePrefs(thislink.data('panel'), thislink.data('pref'));
+          }
           switch (thislink.data('pref')) {
             case 'star':
             picon.removeClass('glyphicon-remove').addClass('glyphicon-star');
@@ -148,6 +174,115 @@ function fixPrefLinks(p, o, initial=true) {
   }
 }
 
+function applySchedulePrefs(prefs) {
+  schedulePrefs = prefs;
+  if (prefs.csrf) {
+    csrf = prefs.csrf;
+  }
+  if (prefs.token) {
+    // Calendar links for the user's own view
+    var ics = $('#ics-popover');
+    if (ics.length) {
+      ics.attr('data-content', ics.attr('data-content').split("@'").join('@' + prefs.token + "'"));
+    }
+  }
+  $('div.panel-content').each(function () {
+    mergePrefs($(this));
+    fixPrefLinks($(this), null, false);
+  });
+  if (!prefs.authenticated) {
+    return;
+  }
+  // Same order as the templates: attended, then hidden, then starred
+  $.each([[prefs.starred, 'glyphicon-star'], [prefs.hidden, 'glyphicon-remove'],
+          [prefs.attended, 'glyphicon-ok']], function (i, icon) {
+    $.each(icon[0], function (j, panel) {
+      $('span.icon_' + panel).removeClass('glyphicon-star glyphicon-remove glyphicon-ok').addClass(icon[1]);
+    });
+  });
+  if ($('#schedule').data('filter') === '') {
+    // The standard view leaves out hidden panels
+    $.each(prefs.hidden, function (i, panel) {
+      $('span.icon_' + panel).closest('.list-item, .grid-item, .full-item').hide();
+    });
+  }
+}
+
+function mergePrefs(p) {
+  // Set up preference links from schedulePrefs, or drop them if logged out
+  if (!schedulePrefs.authenticated) {
+    p.find('.schedule-prefs').remove();
+    return;
+  }
+  var panel = p.find('[data-panel]').data('panel');
+  p.data('starred', schedulePrefs.starred.indexOf(panel) >= 0 ? 'true' : 'false');
+  p.data('hide', schedulePrefs.hidden.indexOf(panel) >= 0 ? 'true' : 'false');
+}
+
+function updateSchedulePrefs(panel, pref) {
+  function drop(list) {
+    var i = list.indexOf(panel);
+    if (i >= 0) {
+      list.splice(i, 1);
+    }
+  }
+  switch (pref) {
+    case 'star':
+    schedulePrefs.starred.push(panel);
+    drop(schedulePrefs.hidden);
+    break;
+
+    case 'unstar':
+    drop(schedulePrefs.starred);
+    break;
+
+    case 'hide':
+    schedulePrefs.hidden.push(panel);
+    drop(schedulePrefs.starred);
+    break;
+
+    case 'unhide':
+    drop(schedulePrefs.hidden);
+    break;
+  }
+}
+
+function applyScheduleEvent(type, data) {
+  var items = $('[data-panelschedule="' + data.panelschedule + '"]');
+  var message;
+  switch (type) {
+    case 'panel_moved':
+    items.addClass('schedule-moved');
+    items.find('.schedule-times').text(data.start + ' - ' + data.end);
+    message = data.title + ' has moved to ' + data.day + ' ' + data.start + ', ' + data.room + '.';
+    break;
+
+    case 'panel_cancelled':
+    items.addClass('schedule-cancelled');
+    message = data.title + ' has been cancelled.';
+    break;
+
+    case 'panel_added':
+    message = data.title + ' has been added, ' + data.day + ' ' + data.start + ', ' + data.room + '.';
+    break;
+
+    case 'room_closed':
+    $('[data-roomschedule="' + data.roomschedule + '"]').addClass('schedule-cancelled');
+    message = data.room + ' is now closed ' + data.day + ' ' + data.start + ' - ' + data.end + '.';
+    break;
+
+    case 'room_changed':
+    message = data.room + ' hours have changed.';
+    break;
+
+    default:
+    message = 'The schedule has changed.';
+  }
+  var updates = $('#schedule-updates');
+  updates.find('.schedule-update-text').text(message);
+  updates.show();
+}
+
 function copyIcsLink() {
   document.getElementById('ics-link').select();
   document.execCommand('copy');
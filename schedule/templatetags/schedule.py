@@ -1,10 +1,12 @@
 from django import template
 from django.conf import settings
-from django.db.models import Prefetch
 from django.utils import timezone
+from django.utils.html import format_html
 from convention import get_convention_model
 
-from ..models import Attendee, PanelSchedule
+from ..images import map_srcset
+from ..partitions import get_partitions, merge_partitions, unshared
+from ..preferences import attach_preferences, filter_preferences, get_preferences
 
 Convention = get_convention_model()
 
@@ -36,35 +38,20 @@ def upcoming_panels(addl_filter='', limit=5, include_current=True, user=None):
         return {}
     now = timezone.now().replace(tzinfo=timezone.get_current_timezone())
 
-    # Determine query based on the parameters
-    panelschedules = PanelSchedule.objects.select_related(
-        'panel', 'panel__room'
-    ).filter(
-        panel__convention=convention, panel__hidden=False
-    ).order_by('day')
+    # Everyone sees the same panels, so those come from the cached track
+    # partitions (which the cache warmer keeps built). Logged in users
+    # get their hidden/starred filtering from their cached preferences.
+    panelschedules, roomschedules = merge_partitions(get_partitions(convention))
+    prefs = None
+    if user is not None and user.is_authenticated:
+        prefs = get_preferences(user, convention)
+        panelschedules = filter_preferences(panelschedules, prefs, addl_filter)
 
     if addl_filter != 'all':
         # Filter our not-all views by date, and later time, if the convention has started
         if convention.start_date < timezone.now().date():
-            panelschedules = panelschedules.exclude(
-                day__lt=convention.start_date.weekday())
-
-        # Apply additional filtering if the user has logged in
-        if user.is_authenticated:
-            if addl_filter == '':
-                panelschedules = panelschedules.exclude(
-                    panel__attendee__in=Attendee.objects.filter(
-                        user=user, hide_from_user=True))
-            if addl_filter == 'custom':
-                panelschedules = panelschedules.filter(
-                    panel__attendee__user=user, panel__attendee__starred=True)
-
-    if user.is_authenticated:
-        # Pre-fetch any preference records for this attendee
-        panelschedules = panelschedules.prefetch_related(
-            Prefetch('panel__attendee_set',
-                     queryset=Attendee.objects.filter(user=user),
-                     to_attr='attendee_info'))
+            panelschedules = [ps for ps in panelschedules
+                              if ps.day >= convention.start_date.weekday()]
 
     # Filter panelschedules by time, and then put in proper time order
     filtered_panelschedules = [ps for ps in panelschedules if
@@ -75,4 +62,34 @@ def upcoming_panels(addl_filter='', limit=5, include_current=True, user=None):
     if limit:
         filtered_panelschedules = filtered_panelschedules[:limit]
 
+    if prefs is not None:
+        # Preference icons, on their own copy of the shared panels
+        filtered_panelschedules = [unshared(ps) for ps in filtered_panelschedules]
+        attach_preferences(filtered_panelschedules, prefs)
+
     return {'panelschedules': filtered_panelschedules}
+
+
+@register.simple_tag
+def map_image(item, sizes='100vw'):
+    '''
+    An <img> for a Panel or Room's map, offering its resized variants
+    (see images.py) with srcset when there are any. Falls back to the
+    widest variant, not the upload, for browsers without srcset.
+    '''
+    srcset = map_srcset(item.map_image, item.map_variants)
+    if not srcset:
+        return format_html('<img class="img-responsive" src="{}">', item.map_image.url)
+    widest = item.map_variants['variants'][-1]
+    return format_html(
+        '<img class="img-responsive" src="{}" srcset="{}" sizes="{}" width="{}" height="{}">',
+        item.map_image.storage.url(widest['name']), srcset, sizes,
+        item.map_variants['width'], item.map_variants['height'])
+
+
+@register.simple_tag
+def map_thumbnail(item):
+    '''The URL of the smallest variant of a Panel or Room's map, or the map itself'''
+    if map_srcset(item.map_image, item.map_variants):
+        return item.map_image.storage.url(item.map_variants['variants'][0]['name'])
+    return item.map_image.url
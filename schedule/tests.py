@@ -1,12 +1,42 @@
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.html import escape
 
+import asyncio
+import gzip
+import json
+import shutil
+import tempfile
+import threading
 from datetime import datetime, time, timedelta
+from io import BytesIO, StringIO
+from unittest import skipUnless
 
 from convention.models import Convention
 from convention.tests import create_test_convention
 
-from .models import Panel, Room, Track
-from .utils import contime, time_range, time_round
+from .archive import freeze_convention, snapshot_format
+from .cache import SCHEDULE_VERSION_KEY, LocalCache, cached_for_version, get_schedule_version, local_cache, version_key
+from .crypto import create_token
+from .events import events_since, format_event, latest_event_id
+from .images import Image
+from .metrics import CacheMetricsRegistry, MetricsRegistry
+from .models import Attendee, Panel, PanelSchedule, Room, RoomSchedule, ScheduleSnapshot, Track
+from .nownext import RoomTimeline, get_timelines, now_and_next, past_window
+from .partitions import build_partitions, get_partitions, merge_partitions
+from .preferences import apply_preferences, get_preferences, recount_preferences
+from .reports import feedback_rows, feedback_summary
+from .solver import Solver, describe_changes, load_problem, schedule_cost
+from .utils import con_minutes, contime, time_range, time_round
+from .warmer import BOUNDARY_DELAY, CacheWarmer, next_midnights, upcoming_boundaries
 
 # Test Helpers
 
@@ -62,6 +92,57 @@ def create_test_track(**kwargs):
             **defaults
         )
 
+def create_test_schedule():
+    '''
+    Build a small but realistic convention schedule: a few tracks and
+    rooms, panels across the weekend (one of them scheduled twice), a room
+    with open hours, and a user with starred, hidden and feedback
+    preferences. Returns a dict of the interesting objects.
+    '''
+    convention = create_test_convention()
+    # Keep the whole schedule in the future so nothing drops off as past
+    convention.start_date = (datetime.today() + timedelta(days=14)).date()
+    convention.save()
+
+    main = create_test_track(convention=convention, name='Main', class_name='main')
+    gaming = create_test_track(convention=convention, name='Gaming', class_name='gaming')
+    art = create_test_track(convention=convention, name='Art', class_name='art')
+
+    stage = create_test_room(convention=convention, name='Main Stage', sort_order=1)
+    room_a = create_test_room(convention=convention, name='Panel Room A', sort_order=2)
+    room_b = create_test_room(convention=convention, name='Panel Room B', alias='Salon B', sort_order=3)
+    dealers = create_test_room(convention=convention, name="Dealer's Den", sort_order=4, track=main)
+    dealers.schedule.create(day=5, start_time=time(10, 0), end_time=time(18, 0))
+
+    panels = []
+    for title, track, room, day, start, end in (
+                ('Opening Ceremonies', main, stage, 4, time(18, 0), time(19, 0)),
+                ('Tabletop Tournament', gaming, room_a, 5, time(10, 0), time(14, 0)),
+                ('Drawing Paws', art, room_b, 5, time(11, 0), time(12, 30)),
+                ('Speedruns', gaming, room_a, 5, time(15, 0), time(16, 0)),
+                ('Late Night Art Jam', art, room_b, 5, time(23, 0), time(1, 0)),
+                ('Closing Ceremonies', main, stage, 6, time(15, 0), time(16, 0)),
+            ):
+        panel = create_test_panel(convention=convention, title=title, track=track, room=room,
+                                  description='About {}'.format(title))
+        panel.schedule.create(day=day, start_time=start, end_time=end)
+        panels.append(panel)
+    # And a panel that runs twice
+    panels[2].schedule.create(day=6, start_time=time(11, 0), end_time=time(12, 30))
+
+    user = get_user_model().objects.create_user('attendee', password='attendee')
+    Attendee.objects.create(user=user, panel=panels[1], starred=True)
+    Attendee.objects.create(user=user, panel=panels[3], hide_from_user=True)
+    Attendee.objects.create(user=user, panel=panels[4], attended=True, feedback='Great!')
+
+    return {
+        'convention': convention,
+        'tracks': [main, gaming, art],
+        'rooms': [stage, room_a, room_b, dealers],
+        'panels': panels,
+        'user': user,
+    }
+
 # Model tests
 class PanelModelTestCase(TestCase):
     def test_model_name(self):
@@ -100,6 +181,1257 @@ class TrackModelTestCase(TestCase):
 
 
 # View tests
+class ArchivedScheduleViewTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_archived_schedule_cached(self):
+        panel = create_test_panel(title='Archived Panel')
+        panel.schedule.create(day=5, start_time=time(12, 0), end_time=time(13, 0))
+        freeze_convention(panel.convention, year=1999)
+
+        url = reverse('schedule_archive_grid', kwargs={'year': 1999})
+        # First request loads the snapshot from the database
+        self.client.get(url)
+        # After that it should come entirely from the cache
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, 'Archived Panel')
+        self.assertIn('immutable', response['Cache-Control'])
+
+        response = self.client.get(reverse('schedule_archive_json', kwargs={'year': 1999}))
+        self.assertContains(response, 'Archived Panel')
+
+    def test_archived_schedule_missing(self):
+        response = self.client.get(reverse('schedule_archive', kwargs={'year': 1999}))
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(SCHEDULE_IS_PUBLIC=False)
+    def test_archived_schedule_not_public(self):
+        panel = create_test_panel(title='Archived Panel')
+        panel.schedule.create(day=5, start_time=time(12, 0), end_time=time(13, 0))
+        freeze_convention(panel.convention, year=1999)
+        url = reverse('schedule_archive_grid', kwargs={'year': 1999})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        staff = get_user_model().objects.create_user(username='staff', password='secret', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(url)
+        self.assertContains(response, 'Archived Panel')
+        self.assertIn('private', response['Cache-Control'])
+        self.assertNotIn('public', response['Cache-Control'])
+
+    def test_snapshot_format_change(self):
+        panel = create_test_panel(title='Archived Panel')
+        panel.schedule.create(day=5, start_time=time(12, 0), end_time=time(13, 0))
+        snapshot = freeze_convention(panel.convention, year=1999)
+        # As if frozen before a model changed
+        ScheduleSnapshot.objects.filter(id=snapshot.id).update(format='old', packed=b'broken')
+        # Left unserved rather than frozen again mid-request
+        response = self.client.get(reverse('schedule_archive', kwargs={'year': 1999}))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(ScheduleSnapshot.objects.get(id=snapshot.id).format, 'old')
+
+        # Freezing reads the database, not the cached partitions, which
+        # don't know about an update() without a version bump
+        get_partitions(panel.convention)
+        Panel.objects.filter(id=panel.id).update(title='Refrozen Panel')
+        call_command('archive_schedule', '--outdated', stdout=StringIO())
+        self.assertEqual(ScheduleSnapshot.objects.get(id=snapshot.id).format, snapshot_format())
+        response = self.client.get(reverse('schedule_archive', kwargs={'year': 1999}))
+        self.assertContains(response, 'Refrozen Panel')
+
+
+class ScheduleQueryCountTestCase(TestCase):
+    '''
+    Pin down exactly how many queries each view runs, so N+1 regressions
+    show up as test failures. The counts assume the site's base.html
+    template doesn't query on its own. Breakdowns are in the comments:
+    - current: Convention.objects.current()
+    - session, user: loading a logged in user
+    - panels, rooms: the PanelSchedule and RoomSchedule lists
+    - prefs: a logged in user's Attendee records, cached after the first
+    - tracks: the track list for the filter menu
+    - site: convention.site, for the ICS links
+    - track_ids: the track name to id map, for ?track=
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.schedule = create_test_schedule()
+        cls.user = cls.schedule['user']
+
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+        # The HTML views' ETags need the schedule's end times, which are
+        # built once per schedule version, not per request
+        get_timelines(self.schedule['convention'])
+
+    def login(self):
+        self.client.force_login(self.user)
+
+    def test_schedule_list(self):
+        # current, panels, rooms, tracks, site
+        with self.assertNumQueries(5):
+            self.client.get(reverse('schedule_list', kwargs={'addl_filter': ''}))
+        # The panels and rooms are kept in track partitions now
+        with self.assertNumQueries(3):
+            self.client.get(reverse('schedule_list', kwargs={'addl_filter': 'all'}))
+        # Anonymous pages are packed once: just current, tracks, site
+        with self.assertNumQueries(3):
+            self.client.get(reverse('schedule_list', kwargs={'addl_filter': ''}))
+
+    def test_schedule_list_logged_in(self):
+        self.login()
+        # session, user, current, panels, rooms, prefs, tracks, site
+        with self.assertNumQueries(8):
+            self.client.get(reverse('schedule_list', kwargs={'addl_filter': ''}))
+        # The panels and rooms come from the partitions for logged in
+        # users too, and prefs are cached now
+        with self.assertNumQueries(5):
+            self.client.get(reverse('schedule_list', kwargs={'addl_filter': 'custom'}))
+
+    def test_schedule_custom_anonymous(self):
+        # Only current, before redirecting to log in
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('schedule_list', kwargs={'addl_filter': 'custom'}))
+        self.assertEqual(response.status_code, 302)
+
+    def test_schedule_grid(self):
+        with self.assertNumQueries(5):
+            self.client.get(reverse('schedule_grid', kwargs={'addl_filter': ''}))
+        # Track filtering looks up the track names, then merges partitions
+        with self.assertNumQueries(4):
+            self.client.get(reverse('schedule_grid', kwargs={'addl_filter': ''}), {'track': 'Gaming'})
+        with self.assertNumQueries(3):
+            self.client.get(reverse('schedule_grid', kwargs={'addl_filter': ''}), {'track': ['Gaming', 'Art']})
+
+    def test_schedule_grid_logged_in(self):
+        self.login()
+        with self.assertNumQueries(8):
+            self.client.get(reverse('schedule_grid', kwargs={'addl_filter': ''}))
+        with self.assertNumQueries(5):
+            self.client.get(reverse('schedule_grid', kwargs={'addl_filter': 'custom'}))
+
+    def test_schedule_full(self):
+        with self.assertNumQueries(5):
+            self.client.get(reverse('schedule_full', kwargs={'addl_filter': ''}))
+        self.login()
+        # session, user, current, prefs, tracks, site
+        with self.assertNumQueries(6):
+            self.client.get(reverse('schedule_full', kwargs={'addl_filter': ''}))
+
+    def test_schedule_ics(self):
+        # current, panels, rooms, site
+        with self.assertNumQueries(4):
+            self.client.get(reverse('schedule_ics', kwargs={'addl_filter': '', 'auth_token': ''}))
+        # The token's user filters the partitions with their prefs:
+        # current, user, prefs, site
+        token = create_token(self.user)
+        with self.assertNumQueries(4):
+            self.client.get(reverse('schedule_ics', kwargs={'addl_filter': '', 'auth_token': token}))
+        # Then prefs are cached
+        with self.assertNumQueries(3):
+            self.client.get(reverse('schedule_ics', kwargs={'addl_filter': 'custom', 'auth_token': token}))
+
+    def test_schedule_json(self):
+        # current, panels, rooms
+        with self.assertNumQueries(3):
+            self.client.get(reverse('schedule_json', kwargs={'addl_filter': '', 'auth_token': ''}))
+        # Then the anonymous feed is cached
+        with self.assertNumQueries(1):
+            self.client.get(reverse('schedule_json', kwargs={'addl_filter': '', 'auth_token': ''}))
+        # current, user, prefs
+        token = create_token(self.user)
+        with self.assertNumQueries(3):
+            self.client.get(reverse('schedule_json', kwargs={'addl_filter': '', 'auth_token': token}))
+
+    def test_panel_detail(self):
+        panelschedule = self.schedule['panels'][2].schedule.first()
+        url = reverse('schedule_panel_detail', args=[panelschedule.id, 'drawing-paws'])
+        # PanelSchedule joined with its panel, convention, track and room,
+        # plus the prefetched other times
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertContains(response, 'additional times')
+        # Then it's cached
+        with self.assertNumQueries(0):
+            self.client.get(url)
+        self.login()
+        # session, user, prefs
+        with self.assertNumQueries(3):
+            self.client.get(url)
+        # And a schedule change means reloading it
+        panelschedule.save()
+        with self.assertNumQueries(4):
+            self.client.get(url)
+
+    def test_set_preference(self):
+        self.login()
+        panels = self.schedule['panels']
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        # session, user, panel, then a savepoint, locking the panel, the
+        # select, the update, the panel's counters and the release
+        with self.assertNumQueries(9):
+            response = self.client.get(reverse('schedule_set_preference', args=[panels[1].id, 'unstar']), **ajax)
+        self.assertEqual(response.status_code, 204)
+        # Same for a new preference, with an insert instead
+        with self.assertNumQueries(9):
+            self.client.get(reverse('schedule_set_preference', args=[panels[0].id, 'star']), **ajax)
+
+    def test_upcoming_panels(self):
+        template = Template('{% load schedule %}{% upcoming_panels addl_filter=addl_filter user=user %}')
+        # current, then panels and rooms for the track partitions, which are cached
+        with self.assertNumQueries(3):
+            template.render(Context({'addl_filter': '', 'user': AnonymousUser()}))
+        with self.assertNumQueries(1):
+            template.render(Context({'addl_filter': 'all', 'user': AnonymousUser()}))
+        # Logged in users share the partitions too, plus prefs, then
+        # those are cached
+        with self.assertNumQueries(2):
+            template.render(Context({'addl_filter': '', 'user': self.user}))
+        with self.assertNumQueries(1):
+            template.render(Context({'addl_filter': 'custom', 'user': self.user}))
+
+
+class AsyncViewsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.schedule = create_test_schedule()
+        cls.user = cls.schedule['user']
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_concurrent_feed_polls(self):
+        token = create_token(self.user)
+        urls = [
+            reverse('schedule_ics', kwargs={'addl_filter': '', 'auth_token': ''}),
+            reverse('schedule_ics', kwargs={'addl_filter': 'custom', 'auth_token': token}),
+            reverse('schedule_json', kwargs={'addl_filter': '', 'auth_token': token}),
+            reverse('schedule_json', kwargs={'addl_filter': 'custom', 'auth_token': token}),
+        ] * 5
+        responses = await asyncio.gather(*[self.async_client.get(url) for url in urls])
+
+        self.assertEqual([response.status_code for response in responses], [200] * len(urls))
+        # Each poll got its own user's view of the schedule
+        custom = json.loads(responses[3].content)
+        self.assertEqual([event['title'] for event in custom['events']], ['Tabletop Tournament'])
+        default = json.loads(responses[2].content)
+        self.assertNotIn('Speedruns', [event['title'] for event in default['events']])
+        self.assertIn(b'Drawing Paws', responses[0].content)
+        self.assertNotIn(b'Drawing Paws', responses[1].content)
+
+    async def test_concurrent_preferences(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        panels = self.schedule['panels']
+        responses = await asyncio.gather(*[
+            self.async_client.get(reverse('schedule_set_preference', args=[panel.id, 'star']),
+                                  headers={'X-Requested-With': 'XMLHttpRequest'})
+            for panel in panels
+        ])
+        self.assertEqual([response.status_code for response in responses], [204] * len(panels))
+        prefs = await sync_to_async(get_preferences)(self.user, self.schedule['convention'])
+        self.assertEqual(prefs.starred, frozenset(panel.id for panel in panels))
+
+    async def test_preference_requires_login(self):
+        response = await self.async_client.get(
+            reverse('schedule_set_preference', args=[self.schedule['panels'][0].id, 'star']))
+        self.assertEqual(response.status_code, 302)
+
+
+class JSONQueryTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.schedule = create_test_schedule()
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('schedule_json', kwargs={'addl_filter': 'all', 'auth_token': ''})
+
+    def get(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_pages(self):
+        titles = []
+        cursor = ''
+        for page in range(3):
+            content = self.get(day='saturday', limit=2, cursor=cursor)
+            titles += [event['title'] for event in content['events']]
+            cursor = content['next']
+        self.assertIsNone(cursor)
+        # In start order, panels before room openings at the same time
+        self.assertEqual(titles, ['Tabletop Tournament', "Dealer's Den Open", 'Drawing Paws',
+                                  'Speedruns', 'Late Night Art Jam'])
+
+    def test_filters(self):
+        content = self.get(room='Panel Room A', fields='title,start')
+        self.assertEqual(content['events'], [
+            {'title': title, 'start': str(panel.schedule.get().start_timestamp)}
+            for title, panel in (('Tabletop Tournament', self.schedule['panels'][1]),
+                                 ('Speedruns', self.schedule['panels'][3]))])
+        content = self.get(type='room', fields='title')
+        self.assertEqual(content['events'], [{'title': "Dealer's Den Open"}])
+
+    def test_time_window(self):
+        speedruns = self.schedule['panels'][3].schedule.get()
+        art_jam = self.schedule['panels'][4].schedule.get()
+        # Overlapping the window, including past midnight
+        content = self.get(**{'from': speedruns.end_timestamp.isoformat(),
+                              'to': (art_jam.end_timestamp + timedelta(hours=12)).isoformat(),
+                              'fields': 'title'})
+        self.assertEqual([event['title'] for event in content['events']],
+                         ["Dealer's Den Open", 'Late Night Art Jam', 'Drawing Paws'])
+        content = self.get(**{'from': (art_jam.end_timestamp - timedelta(minutes=30)).isoformat(),
+                              'to': art_jam.end_timestamp.isoformat(), 'fields': 'title'})
+        self.assertEqual(content['events'], [{'title': 'Late Night Art Jam'}])
+
+    def test_track_pages(self):
+        # A track alone is a slice too, paged
+        content = self.get(track='Art', fields='title')
+        self.assertEqual([event['title'] for event in content['events']],
+                         ['Drawing Paws', 'Late Night Art Jam', 'Drawing Paws'])
+        self.assertIsNone(content['next'])
+
+        content = self.get(track='Art', fields='title', limit=2)
+        self.assertEqual([event['title'] for event in content['events']], ['Drawing Paws', 'Late Night Art Jam'])
+        content = self.get(track='Art', fields='title', limit=2, cursor=content['next'])
+        self.assertEqual((content['events'], content['next']), ([{'title': 'Drawing Paws'}], None))
+
+    def test_bad_params(self):
+        for params in ({'day': 'someday'}, {'fields': 'title,secrets'}, {'type': 'party'},
+                       {'from': 'yesterday'}, {'cursor': '!!'}, {'limit': 'lots'}):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400)
+
+    def test_unsliced(self):
+        # No parameters is still the whole schedule, as before
+        content = self.get()
+        self.assertNotIn('next', content)
+        self.assertEqual(len(content['events']), 8)
+
+
+class TrackPartitionsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.schedule = create_test_schedule()
+
+    def setUp(self):
+        cache.clear()
+
+    def titles(self, params, **kwargs):
+        response = self.client.get(reverse('schedule_json', kwargs={'addl_filter': 'all', 'auth_token': ''}),
+                                   params, **kwargs)
+        return sorted(event['title'] for event in json.loads(response.content)['events'])
+
+    def test_merge_partitions(self):
+        convention = self.schedule['convention']
+        main, gaming, art = self.schedule['tracks']
+        partitions = build_partitions(convention)
+        panelschedules, roomschedules = merge_partitions(partitions, [gaming.id, art.id])
+        self.assertEqual(len(panelschedules), 5)
+        self.assertEqual(roomschedules, [])
+        self.assertEqual([item.day for item in panelschedules], sorted(item.day for item in panelschedules))
+        panelschedules, roomschedules = merge_partitions(partitions)
+        self.assertEqual((len(panelschedules), len(roomschedules)), (7, 1))
+
+    def test_multiple_tracks(self):
+        self.assertEqual(self.titles({'track': ['Gaming', 'Art']}), [
+            'Drawing Paws', 'Drawing Paws', 'Late Night Art Jam', 'Speedruns', 'Tabletop Tournament'])
+        self.assertEqual(self.titles({'track': 'Main'}), [
+            'Closing Ceremonies', "Dealer's Den Open", 'Opening Ceremonies'])
+        # Same for a logged in user, from the database
+        self.client.force_login(self.schedule['user'])
+        response = self.client.get(reverse('schedule_list', kwargs={'addl_filter': ''}),
+                                   {'track': ['Gaming', 'Art']})
+        self.assertContains(response, 'Drawing Paws')
+        self.assertNotContains(response, 'Speedruns')
+        self.assertNotContains(response, 'Opening Ceremonies')
+
+    def test_unknown_track(self):
+        response = self.client.get(reverse('schedule_grid', kwargs={'addl_filter': ''}),
+                                   {'track': ['Gaming', 'Knitting']})
+        self.assertEqual(response.status_code, 404)
+
+
+class UserIndependentPagesTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.schedule = create_test_schedule()
+        cls.user = cls.schedule['user']
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_preferences(self):
+        panels = self.schedule['panels']
+        content = json.loads(self.client.get(reverse('schedule_preferences')).content)
+        self.assertTrue(content['authenticated'])
+        self.assertEqual((content['starred'], content['hidden'], content['attended']),
+                         ([panels[1].id], [panels[3].id], [panels[4].id]))
+        self.assertEqual(content['token'], create_token(self.user))
+        self.assertIn('csrf', content)
+
+        self.client.get(reverse('schedule_set_preference', args=[panels[0].id, 'star']),
+                        HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        updated = json.loads(self.client.get(reverse('schedule_preferences')).content)
+        self.assertEqual(updated['starred'], [panels[0].id, panels[1].id])
+        self.assertGreater(updated['version'], content['version'])
+
+        self.client.logout()
+        content = json.loads(self.client.get(reverse('schedule_preferences')).content)
+        self.assertEqual(content, {'authenticated': False, 'version': 0, 'starred': [],
+                                   'hidden': [], 'attended': []})
+
+    @override_settings(SCHEDULE_USER_INDEPENDENT_PAGES=True)
+    def test_pages_are_the_same_for_everyone(self):
+        url = reverse('schedule_list', kwargs={'addl_filter': ''})
+        response = self.client.get(url)
+        self.assertIn('public', response['Cache-Control'])
+        # The user's hidden panel is left for schedule.js to hide
+        self.assertContains(response, 'Speedruns')
+        self.assertContains(response, reverse('schedule_preferences'))
+        self.client.logout()
+        self.assertEqual(self.client.get(url)['ETag'], response['ETag'])
+
+        # Feeds without a token too
+        response = self.client.get(reverse('schedule_json', kwargs={'addl_filter': '', 'auth_token': ''}))
+        self.assertIn('Speedruns', [event['title'] for event in json.loads(response.content)['events']])
+
+    @override_settings(SCHEDULE_USER_INDEPENDENT_PAGES=True)
+    def test_custom_is_still_per_user(self):
+        response = self.client.get(reverse('schedule_list', kwargs={'addl_filter': 'custom'}))
+        self.assertIn('private', response['Cache-Control'])
+        self.assertContains(response, 'Tabletop Tournament')
+        self.assertNotContains(response, 'Drawing Paws')
+
+
+class FeedbackReportTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.schedule = create_test_schedule()
+        cls.staff = get_user_model().objects.create_user('staff', password='staff', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_feedback_summary(self):
+        convention = self.schedule['convention']
+        with self.assertNumQueries(1):
+            summary = {panel['title']: panel for panel in feedback_summary(convention)}
+        self.assertEqual(summary['Tabletop Tournament']['stars'], 1)
+        self.assertEqual(summary['Speedruns']['hides'], 1)
+        self.assertEqual(summary['Late Night Art Jam']['attended_yes'], 1)
+        self.assertEqual(summary['Late Night Art Jam']['feedback'], 1)
+        self.assertEqual(summary['Opening Ceremonies']['feedback'], 0)
+        with self.assertNumQueries(0):
+            feedback_summary(convention)
+
+    def test_feedback_export(self):
+        url = reverse('schedule_feedback_export')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.staff)
+        response = self.client.get(url)
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(rows[0], 'panel id,panel,track,room,attended,feedback')
+        self.assertEqual(rows[1:], ['{},Late Night Art Jam,Art,Panel Room B,yes,Great!'.format(
+            self.schedule['panels'][4].id)])
+        # Just one panel's
+        response = self.client.get(url, {'panel': self.schedule['panels'][0].id})
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 1)
+
+    def test_feedback_export_formulas(self):
+        art_jam = self.schedule['panels'][4]
+        Attendee.objects.filter(panel=art_jam).update(feedback='=HYPERLINK("http://example.com")')
+        Panel.objects.filter(id=art_jam.id).update(title='@Art Jam')
+        rows = list(feedback_rows(self.schedule['convention']))
+        self.assertEqual(rows[1], [art_jam.id, "'@Art Jam", 'Art', 'Panel Room B', 'yes',
+                                   '\'=HYPERLINK("http://example.com")'])
+
+
+class BulkScheduleEditorTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.schedule = create_test_schedule()
+        cls.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'admin')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+        self.url = reverse('admin:schedule_panel_bulk_schedule') + '?convention={}'.format(
+            self.schedule['convention'].pk)
+
+    def post_changes(self, changes):
+        '''Post the editor's form back, with changes by PanelSchedule'''
+        formset = self.client.get(self.url).context['formset']
+        data = {
+            'form-TOTAL_FORMS': len(formset.forms),
+            'form-INITIAL_FORMS': len(formset.forms),
+        }
+        for i, form in enumerate(formset.forms):
+            row = {name: form.initial[name] for name in ('id', 'room', 'day', 'start_time', 'end_time')}
+            row.update(changes.get(form.initial['id'], {}))
+            for name, value in row.items():
+                data['form-{}-{}'.format(i, name)] = value.strftime('%H:%M') if isinstance(value, time) else value
+        return self.client.post(self.url, data)
+
+    def test_bulk_schedule_editor(self):
+        panels = self.schedule['panels']
+        room_b = self.schedule['rooms'][2]
+        last_event = latest_event_id(self.schedule['convention'].pk)
+
+        # Speedruns can't move onto the tournament
+        speedruns, tournament = panels[3].schedule.get(), panels[1].schedule.get()
+        response = self.post_changes({speedruns.id: {'start_time': time(11, 0), 'end_time': time(12, 0)}})
+        self.assertContains(response, 'Tabletop Tournament and Speedruns overlap')
+        self.assertEqual(panels[3].schedule.get().start_time, time(15, 0))
+
+        # But it can go to the other room, while the tournament runs later
+        response = self.post_changes({
+            speedruns.id: {'room': room_b.id, 'start_time': time(13, 0), 'end_time': time(14, 0)},
+            tournament.id: {'end_time': time(16, 0)},
+        })
+        self.assertEqual(response.status_code, 302)
+        panels[3].refresh_from_db()
+        self.assertEqual(panels[3].room, room_b)
+        self.assertEqual(panels[3].schedule.get().start_time, time(13, 0))
+        self.assertEqual(panels[1].schedule.get().end_time, time(16, 0))
+        self.assertEqual([event['type'] for event in events_since(self.schedule['convention'].pk, last_event)],
+                         ['panel_moved', 'panel_moved'])
+
+    def test_shared_room(self):
+        # Drawing Paws is on twice, both have to be in the same room
+        panelschedule = self.schedule['panels'][2].schedule.first()
+        response = self.post_changes({panelschedule.id: {'room': self.schedule['rooms'][0].id}})
+        self.assertContains(response, 'all its times need the same room')
+
+
+class ConditionalGetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.schedule = create_test_schedule()
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('schedule_grid', kwargs={'addl_filter': ''})
+
+    def assertNotModified(self, etag, **extra):
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag, **extra)
+        self.assertEqual(response.status_code, 304)
+
+    def test_not_modified(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+        # Only the current convention, no panels
+        with self.assertNumQueries(1):
+            self.assertNotModified(etag)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        # Other filters are different pages
+        self.assertEqual(self.client.get(self.url, {'track': 'Art'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # A schedule change makes it stale
+        panelschedule = self.schedule['panels'][3].schedule.get()
+        panelschedule.start_time = time(14, 0)
+        panelschedule.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotModified(response['ETag'])
+
+    def test_preferences_change_etag(self):
+        self.client.force_login(self.schedule['user'])
+        etag = self.client.get(self.url)['ETag']
+        self.assertNotModified(etag)
+        self.client.get(reverse('schedule_set_preference', args=[self.schedule['panels'][0].id, 'hide']),
+                        HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_past_window(self):
+        convention = self.schedule['convention']
+        art_jam = self.schedule['panels'][4].schedule.get()
+        self.assertEqual(past_window(convention, at=0), 0)
+        end = art_jam.end_timestamp.timestamp()
+        self.assertEqual(past_window(convention, at=end + 60), end)
+        self.assertLess(past_window(convention, at=end - 60), end)
+
+
+class ServerTimingTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.schedule = create_test_schedule()
+
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+
+    def test_disabled_by_default(self):
+        response = self.client.get(reverse('schedule_grid', kwargs={'addl_filter': ''}))
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(SCHEDULE_SERVER_TIMING=True)
+    def test_phases_reported(self):
+        with self.assertLogs('schedule.timing', level='INFO'):
+            response = self.client.get(reverse('schedule_grid', kwargs={'addl_filter': ''}))
+        for phase in ('query', 'pack', 'render', 'total'):
+            self.assertIn(phase + ';dur=', response['Server-Timing'])
+
+        token = create_token(self.schedule['user'])
+        response = self.client.get(reverse('schedule_ics', kwargs={'addl_filter': '', 'auth_token': token}))
+        for phase in ('token', 'query', 'serialize', 'total'):
+            self.assertIn(phase + ';dur=', response['Server-Timing'])
+
+
+class MetricsTestCase(TestCase):
+    def test_registry(self):
+        registry = MetricsRegistry()
+        registry.inc('schedule_requests_total', view='ScheduleGrid', filter='default')
+        registry.inc('schedule_requests_total', view='ScheduleGrid', filter='default')
+        registry.observe('schedule_request_seconds', 0.02, view='ScheduleGrid', filter='default')
+        registry.observe('schedule_request_seconds', 20, view='ScheduleGrid', filter='default')
+        counters, histograms = registry.collect()
+
+        labels = (('filter', 'default'), ('view', 'ScheduleGrid'))
+        self.assertEqual(counters[('schedule_requests_total', labels)], 2)
+        histogram = histograms[('schedule_request_seconds', labels)]
+        # One in the 0.025 bucket, one past the last, then sum and count
+        self.assertEqual(histogram[2], 1)
+        self.assertEqual(histogram[-3], 1)
+        self.assertEqual(histogram[-1], 2)
+
+    @override_settings(SCHEDULE_METRICS_FLUSH_INTERVAL=60)
+    def test_cache_registry(self):
+        cache.clear()
+        # Two workers, each with label sets the other hasn't seen
+        first, second = CacheMetricsRegistry('default'), CacheMetricsRegistry('default')
+        first.inc('schedule_ics_polls_total', filter='default')
+        second.inc('schedule_ics_polls_total', filter='all', value=2)
+        second.observe('schedule_request_seconds', 0.02, view='ScheduleGrid', filter='default')
+        # Nothing's in the cache until they flush
+        self.assertEqual(first.collect()[0], {('schedule_ics_polls_total', (('filter', 'default'),)): 1})
+        second.flush()
+        first.inc('schedule_ics_polls_total', filter='default')
+
+        counters, histograms = first.collect()
+        self.assertEqual(counters, {
+            ('schedule_ics_polls_total', (('filter', 'default'),)): 2,
+            ('schedule_ics_polls_total', (('filter', 'all'),)): 2,
+        })
+        labels = (('filter', 'default'), ('view', 'ScheduleGrid'))
+        self.assertEqual(histograms[('schedule_request_seconds', labels)][-1], 1)
+
+    @override_settings(SCHEDULE_METRICS_FLUSH_INTERVAL=60)
+    def test_cache_registry_evicted_slot(self):
+        cache.clear()
+        registry = CacheMetricsRegistry('default')
+        for view in ('ScheduleList', 'ScheduleGrid', 'ScheduleFull'):
+            registry.inc('schedule_requests_total', view=view)
+        registry.flush()
+        # An evicted slot only loses its own series
+        first = cache.get(registry.prefix + 'index:0')
+        cache.delete(registry.prefix + 'index:0')
+        self.assertEqual(len(registry.collect()[0]), 2)
+        # Which is listed again the next time it's recorded
+        registry.inc(first[1], **dict(first[2]))
+        self.assertEqual(registry.collect()[0][(first[1], first[2])], 2)
+
+    def test_export_staff_only(self):
+        response = self.client.get(reverse('schedule_metrics'))
+        self.assertNotEqual(response.status_code, 200)
+
+        staff = get_user_model().objects.create_user('staff', password='staff', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse('schedule_metrics'))
+        self.assertContains(response, '# TYPE schedule_request_seconds histogram')
+
+
+class PreferencesTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.schedule = create_test_schedule()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_apply_preferences(self):
+        convention = self.schedule['convention']
+        panels = self.schedule['panels']
+        prefs = get_preferences(self.schedule['user'], convention)
+        self.assertEqual(prefs.starred, {panels[1].id})
+        self.assertEqual(prefs.hidden, {panels[3].id})
+
+        panelschedules = list(PanelSchedule.objects.select_related('panel').filter(
+            panel__convention=convention))
+        shown = apply_preferences(panelschedules, prefs, '')
+        self.assertNotIn(panels[3].id, [ps.panel_id for ps in shown])
+        self.assertEqual(len(shown), len(panelschedules) - 1)
+        starred = apply_preferences(panelschedules, prefs, 'custom')
+        self.assertEqual([ps.panel_id for ps in starred], [panels[1].id])
+        self.assertTrue(starred[0].panel.attendee_info[0].starred)
+
+    def test_shared_panels_untouched(self):
+        convention = self.schedule['convention']
+        self.client.force_login(self.schedule['user'])
+        response = self.client.get(reverse('schedule_list', kwargs={'addl_filter': ''}))
+        self.assertNotContains(response, 'Speedruns')
+        # The user's preferences went on copies, not the partitions' panels
+        panelschedules, roomschedules = merge_partitions(get_partitions(convention))
+        self.assertIn('Speedruns', [ps.panel.title for ps in panelschedules])
+        self.assertFalse(any(hasattr(ps.panel, 'attendee_info') for ps in panelschedules))
+
+    def test_set_preference_clears_cache(self):
+        user = self.schedule['user']
+        panel = self.schedule['panels'][0]
+        self.assertNotIn(panel.id, get_preferences(user, self.schedule['convention']).starred)
+        self.client.force_login(user)
+        self.client.get(reverse('schedule_set_preference', args=[panel.id, 'star']),
+                        HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertIn(panel.id, get_preferences(user, self.schedule['convention']).starred)
+
+
+class PreferenceCountersTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.schedule = create_test_schedule()
+        self.panels = self.schedule['panels']
+        self.client.force_login(self.schedule['user'])
+
+    def counts(self, panel):
+        panel.refresh_from_db()
+        return (panel.star_count, panel.hide_count, panel.attended_count)
+
+    def test_recount(self):
+        recount_preferences(Panel.objects.all())
+        self.assertEqual(self.counts(self.panels[1]), (1, 0, 0))
+        self.assertEqual(self.counts(self.panels[3]), (0, 1, 0))
+        self.assertEqual(self.counts(self.panels[4]), (0, 0, 1))
+        self.assertEqual(self.counts(self.panels[0]), (0, 0, 0))
+
+    def test_counters_follow_preferences(self):
+        recount_preferences(Panel.objects.all())
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        set_url = lambda panel, pref: reverse('schedule_set_preference', args=[panel.id, pref])
+
+        self.client.get(set_url(self.panels[0], 'star'), **ajax)
+        # Setting it again doesn't count twice
+        self.client.get(set_url(self.panels[0], 'star'), **ajax)
+        self.assertEqual(self.counts(self.panels[0]), (1, 0, 0))
+        # Hiding unstars
+        self.client.get(set_url(self.panels[0], 'hide'), **ajax)
+        self.assertEqual(self.counts(self.panels[0]), (0, 1, 0))
+        self.client.post(set_url(self.panels[4], ''), {'attended': 'False', 'feedback': 'Missed it'}, **ajax)
+        self.assertEqual(self.counts(self.panels[4]), (0, 0, 0))
+
+    def test_other_writes_recounted(self):
+        # The test schedule's Attendee records were made directly, and
+        # counted by the signals
+        self.assertEqual(self.counts(self.panels[1]), (1, 0, 0))
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        response = self.client.get(reverse('schedule_set_preference', args=[self.panels[1].id, 'unstar']), **ajax)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.counts(self.panels[1]), (0, 0, 0))
+        # As when the user's deleted
+        Attendee.objects.filter(panel=self.panels[3]).delete()
+        self.assertEqual(self.counts(self.panels[3]), (0, 0, 0))
+
+
+class ScheduleEventsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_schedule_change_events(self):
+        panel = create_test_panel(title='Moving Panel')
+        convention_id = panel.convention_id
+        panelschedule = panel.schedule.create(day=5, start_time=time(12, 0), end_time=time(13, 0))
+        last_id = latest_event_id(convention_id)
+
+        panelschedule.start_time = time(14, 0)
+        panelschedule.end_time = time(15, 0)
+        panelschedule.save()
+        # Saving without changes shouldn't announce anything
+        panelschedule.save()
+        panelschedule.delete()
+
+        new_events = events_since(convention_id, last_id)
+        self.assertEqual([event['type'] for event in new_events], ['panel_moved', 'panel_cancelled'])
+        self.assertEqual(new_events[0]['data']['start'], '14:00')
+        self.assertIn('event: panel_moved\n', format_event(new_events[0]))
+
+    def test_sequence_reset(self):
+        panel = create_test_panel(title='Moving Panel')
+        convention_id = panel.convention_id
+        panel.schedule.create(day=5, start_time=time(12, 0), end_time=time(13, 0))
+        last_id = latest_event_id(convention_id)
+        self.assertEqual(events_since(convention_id, last_id), [])
+
+        # The counter's gone, say evicted, so the client is ahead of it
+        cache.clear()
+        self.assertEqual(events_since(convention_id, last_id), [{'id': 0, 'type': 'reload', 'data': {}}])
+        # Then it picks up from the new count
+        panel.schedule.create(day=6, start_time=time(12, 0), end_time=time(13, 0))
+        self.assertEqual([event['type'] for event in events_since(convention_id, 0)], ['panel_added'])
+
+    async def test_events_stream(self):
+        await sync_to_async(create_test_convention)()
+        response = await self.async_client.get(reverse('schedule_events'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertTrue(response.is_async)
+        content = response.streaming_content
+        self.assertEqual(await content.__anext__(), b'retry: 5000\n\n')
+        await content.aclose()
+
+
+class BundleTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.schedule = create_test_schedule()
+
+    def test_bundle(self):
+        manifest = json.loads(self.client.get(reverse('schedule_bundle_manifest')).content)
+        response = self.client.get(manifest['url'])
+        self.assertIn('immutable', response['Cache-Control'])
+        bundle = json.loads(response.content)
+        self.assertEqual(bundle['rooms'][bundle['panels'][0][5]], 'Main Stage')
+        self.assertEqual(len(bundle['panels']), 7)
+        # The art jam runs past midnight, in con minutes
+        art_jam = [record for record in bundle['panels'] if record[2] == 'Late Night Art Jam'][0]
+        self.assertEqual(art_jam[8:], [23 * 60, 25 * 60])
+        self.assertEqual(len(bundle['room_hours']), 1)
+        self.assertEqual(bundle['rooms'][bundle['room_hours'][0][1]], "Dealer's Den")
+        self.assertEqual(bundle['room_hours'][0][2:], [5, 600, 1080])
+
+        # Gzipped when asked
+        response = self.client.get(manifest['url'], HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content)), bundle)
+
+    def test_bundle_hash_changes(self):
+        manifest = json.loads(self.client.get(reverse('schedule_bundle_manifest')).content)
+        # Same schedule, same hash
+        cache.clear()
+        self.assertEqual(json.loads(self.client.get(reverse('schedule_bundle_manifest')).content), manifest)
+
+        panelschedule = self.schedule['panels'][3].schedule.get()
+        panelschedule.start_time = time(14, 0)
+        panelschedule.save()
+        new_manifest = json.loads(self.client.get(reverse('schedule_bundle_manifest')).content)
+        self.assertNotEqual(new_manifest['hash'], manifest['hash'])
+        # And the old bundle sends clients to the new one
+        self.assertRedirects(self.client.get(manifest['url']), new_manifest['url'])
+
+    @override_settings(SCHEDULE_IS_PUBLIC=False)
+    def test_bundle_not_public(self):
+        self.assertEqual(self.client.get(reverse('schedule_bundle_manifest')).status_code, 404)
+        staff = get_user_model().objects.create_user('staff', password='staff', is_staff=True)
+        self.client.force_login(staff)
+        manifest = json.loads(self.client.get(reverse('schedule_bundle_manifest')).content)
+        response = self.client.get(manifest['url'])
+        self.assertIn('private', response['Cache-Control'])
+        self.assertNotIn('public', response['Cache-Control'])
+
+
+class LocalCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+
+    @override_settings(SCHEDULE_LOCAL_CACHE_SIZE=2)
+    def test_lru(self):
+        lru = LocalCache()
+        lru.set('a', 1, 60)
+        lru.set('b', 2, 60)
+        self.assertEqual(lru.get('a'), 1)
+        lru.set('c', 3, 60)
+        # b was the least recently used
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual((lru.get('a'), lru.get('c')), (1, 3))
+        lru.set('d', 4, -1)
+        self.assertIsNone(lru.get('d'))
+
+    def test_tiers(self):
+        built = []
+
+        def builder():
+            built.append(1)
+            return ['packed']
+
+        self.assertEqual(cached_for_version('test', 1, builder, variant='x'), ['packed'])
+        # Gone from the shared cache, but still in this process
+        cache.delete(version_key('test', 1, get_schedule_version(1), 'x'))
+        self.assertEqual(cached_for_version('test', 1, builder, variant='x'), ['packed'])
+        self.assertEqual(len(built), 1)
+        # Other variants are separate
+        cached_for_version('test', 1, builder, variant='y')
+        self.assertEqual(len(built), 2)
+
+    def test_version_bump(self):
+        schedule = create_test_schedule()
+        url = reverse('schedule_list', kwargs={'addl_filter': 'all'})
+        self.assertContains(self.client.get(url), 'Speedruns')
+        panel = schedule['panels'][3]
+        panel.title = 'Any% Speedruns'
+        panel.save()
+        # The next request sees the change, without waiting on anything
+        self.assertContains(self.client.get(url), 'Any% Speedruns')
+
+
+class SingleFlightTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+        self.built = []
+
+    def builder(self):
+        self.built.append(1)
+        return 'fresh'
+
+    def key(self):
+        return version_key('test', 1, get_schedule_version(1), 'a:1')
+
+    def test_serves_stale_while_rebuilding(self):
+        cache.set(version_key('test', 1, 'stale', 'a'), 'previous')
+        cache.add(self.key() + ':rebuilding', 1)
+        value = cached_for_version('test', 1, self.builder, variant='a:1', stale_variant='a')
+        self.assertEqual((value, self.built), ('previous', []))
+        # Once the lock's free the next request rebuilds
+        cache.delete(self.key() + ':rebuilding')
+        self.assertEqual(cached_for_version('test', 1, self.builder, variant='a:1', stale_variant='a'), 'fresh')
+        self.assertEqual(cache.get(version_key('test', 1, 'stale', 'a')), 'fresh')
+        self.assertIsNone(cache.get(self.key() + ':rebuilding'))
+
+    @override_settings(SCHEDULE_REBUILD_WAIT=2)
+    def test_waits_for_rebuild(self):
+        cache.add(self.key() + ':rebuilding', 1)
+        timer = threading.Timer(0.1, cache.set, [self.key(), 'rebuilt'])
+        timer.start()
+        self.addCleanup(timer.cancel)
+        self.assertEqual(cached_for_version('test', 1, self.builder, variant='a:1'), 'rebuilt')
+        self.assertEqual(self.built, [])
+
+    @override_settings(SCHEDULE_REBUILD_WAIT=0)
+    def test_builds_after_waiting(self):
+        cache.add(self.key() + ':rebuilding', 1)
+        self.assertEqual(cached_for_version('test', 1, self.builder, variant='a:1'), 'fresh')
+        # Someone else's lock is left alone
+        self.assertEqual(cache.get(self.key() + ':rebuilding'), 1)
+
+    def test_lock_released_on_error(self):
+        def builder():
+            raise ValueError()
+        with self.assertRaises(ValueError):
+            cached_for_version('test', 1, builder, variant='a:1')
+        self.assertIsNone(cache.get(self.key() + ':rebuilding'))
+
+
+
+class CacheWarmerTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.schedule = create_test_schedule()
+
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+
+    def test_warmed_pages_and_feeds(self):
+        warmer = CacheWarmer()
+        warmer.step()
+        # As if on another worker, without the warmer's local cache
+        local_cache.clear()
+        # current, tracks, site
+        with self.assertNumQueries(3):
+            self.client.get(reverse('schedule_list', kwargs={'addl_filter': ''}))
+        with self.assertNumQueries(3):
+            self.client.get(reverse('schedule_grid', kwargs={'addl_filter': 'all'}), {'track': 'Gaming'})
+        # current
+        with self.assertNumQueries(1):
+            self.client.get(reverse('schedule_json', kwargs={'addl_filter': '', 'auth_token': ''}))
+
+    def test_boundaries_and_edits(self):
+        convention = self.schedule['convention']
+        times = sorted({moment for timeline in get_timelines(convention)
+                        for item in timeline.items for moment in (item['start'], item['end'])})
+        # An hour before the first panel, along with the next midnight,
+        # when earlier days drop off the pages
+        start = times[0] - 60 * 60
+        boundaries = upcoming_boundaries(convention, start)
+        self.assertEqual(boundaries, sorted(set(boundaries)))
+        self.assertEqual(set(boundaries), set(times) | next_midnights(start))
+        self.assertEqual(upcoming_boundaries(convention, times[-1]), sorted(next_midnights(times[-1])))
+
+        passes = []
+        warmer = CacheWarmer(poll=10**6, log=passes.append)
+        at = boundaries[0] - 100
+        self.assertEqual(warmer.step(now=at), 100 + BOUNDARY_DELAY)
+        # Nothing to do before the boundary, and it doesn't touch the database
+        with self.assertNumQueries(0):
+            self.assertEqual(warmer.step(now=at + 50), 50 + BOUNDARY_DELAY)
+        self.assertEqual(len(passes), 1)
+        # Past it, warm up and wait for the next one
+        at = boundaries[0] + BOUNDARY_DELAY
+        self.assertEqual(warmer.step(now=at), boundaries[1] - boundaries[0])
+        self.assertEqual(len(passes), 2)
+
+        # An edit bumps the schedule version, picked up on the next step
+        self.schedule['panels'][0].save()
+        warmer.step(now=at)
+        self.assertEqual(len(passes), 3)
+        self.assertIn('schedule version', passes[-1])
+
+
+HAS_REPLICA = 'replica' in settings.DATABASES
+
+
+@skipUnless(HAS_REPLICA, "needs a second database, aliased 'replica'")
+@override_settings(DATABASE_ROUTERS=['schedule.routers.ScheduleReplicaRouter'],
+                   SCHEDULE_READ_DATABASE='replica', SCHEDULE_PRIMARY_PIN_SECONDS=10)
+class ReplicaRoutingTestCase(TestCase):
+    # The test runner sets up every alias listed here, even for skipped tests
+    databases = {'default', 'replica'} if HAS_REPLICA else {'default'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.schedule = create_test_schedule()
+        cls.user = cls.schedule['user']
+        # Copy the schedule over, as replication would
+        for model in (Convention, Track, Room, Panel, PanelSchedule, RoomSchedule):
+            for obj in model.objects.all():
+                obj.save(using='replica', force_insert=True)
+
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+        # An old schedule version, so cached builds use the replica too
+        cache.set(SCHEDULE_VERSION_KEY.format(convention_id=self.schedule['convention'].pk), 1, timeout=None)
+        self.opening = self.schedule['panels'][0]
+        # Not replicated yet, and without the signals a save() sends
+        Panel.objects.filter(id=self.opening.id).update(title='Grand Opening')
+
+    def feed_titles(self):
+        response = self.client.get(reverse('schedule_json', kwargs={'addl_filter': 'all', 'auth_token': ''}))
+        return [event['title'] for event in json.loads(response.content)['events']]
+
+    def test_feeds_read_from_replica(self):
+        with self.assertNumQueries(0, using='default'):
+            titles = self.feed_titles()
+        self.assertIn('Opening Ceremonies', titles)
+        self.assertNotIn('Grand Opening', titles)
+
+    def test_pinned_to_primary_after_write(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('schedule_list', kwargs={'addl_filter': 'all'}))
+        self.assertNotContains(response, 'Grand Opening')
+        self.client.get(reverse('schedule_set_preference', args=[self.opening.id, 'star']),
+                        HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        response = self.client.get(reverse('schedule_list', kwargs={'addl_filter': 'all'}))
+        self.assertContains(response, 'Grand Opening')
+        # Everyone else still reads the replica
+        self.client.logout()
+        self.assertNotIn('Grand Opening', self.feed_titles())
+
+    def test_fresh_versions_built_from_primary(self):
+        # A save() bumps the schedule version, and what's cached for it
+        # must have the edit even if the replica's behind
+        self.opening.title = 'Grand Opening'
+        self.opening.save()
+        self.assertIn('Grand Opening', self.feed_titles())
+
+    @override_settings(SCHEDULE_PRIMARY_PIN_SECONDS=0)
+    def test_old_versions_built_from_replica(self):
+        self.opening.title = 'Grand Opening'
+        self.opening.save()
+        self.assertNotIn('Grand Opening', self.feed_titles())
+
+
+
+@skipUnless(Image, 'needs Pillow')
+class MapVariantsTestCase(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        overrides = override_settings(MEDIA_ROOT=media_root, SCHEDULE_MAP_WIDTHS=(100, 200, 800))
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.room = create_test_room(name='Main Hall')
+
+    def upload(self, width, height):
+        output = BytesIO()
+        Image.new('RGB', (width, height), 'white').save(output, 'PNG')
+        self.room.map_image = ContentFile(output.getvalue(), name='map.png')
+        self.room.save()
+        return Room.objects.get(id=self.room.id)
+
+    def render(self, room):
+        return Template('{% load schedule %}{% map_image room %}').render(Context({'room': room}))
+
+    def test_variants_made_on_upload(self):
+        room = self.upload(400, 300)
+        variants = room.map_variants['variants']
+        self.assertEqual([(variant['width'], variant['height']) for variant in variants], [(100, 75), (200, 150)])
+        with room.map_image.storage.open(variants[0]['name']) as variant_file:
+            with Image.open(variant_file) as image:
+                self.assertEqual((image.format, image.size), ('WEBP', (100, 75)))
+        html = self.render(room)
+        self.assertIn('srcset="{} 100w, {} 200w, {} 400w"'.format(
+            room.map_image.storage.url(variants[0]['name']),
+            room.map_image.storage.url(variants[1]['name']),
+            room.map_image.url), html)
+
+    def test_replaced_image(self):
+        old = self.upload(400, 300).map_variants['variants']
+        room = self.upload(250, 100)
+        self.assertEqual([variant['width'] for variant in room.map_variants['variants']], [100, 200])
+        for variant in old:
+            self.assertFalse(room.map_image.storage.exists(variant['name']))
+
+    def test_shared_variants_kept(self):
+        room = self.upload(400, 300)
+        # As copy_schedule_tracks does
+        copied = Room.objects.get(id=room.id)
+        copied.pk = None
+        copied.convention = create_test_convention()
+        copied.save()
+        self.assertEqual(copied.map_variants, room.map_variants)
+        variants = room.map_variants['variants']
+        self.upload(250, 100)
+        for variant in variants:
+            self.assertTrue(room.map_image.storage.exists(variant['name']))
+
+    @override_settings(SCHEDULE_MAP_MAX_PIXELS=1000)
+    def test_too_many_pixels(self):
+        room = self.upload(400, 300)
+        self.assertEqual(room.map_variants['variants'], [])
+
+    def test_not_an_image(self):
+        self.room.map_image = ContentFile(b'not a map', name='map.png')
+        self.room.save()
+        room = Room.objects.get(id=self.room.id)
+        self.assertEqual(room.map_variants['variants'], [])
+        self.assertEqual(self.render(room), '<img class="img-responsive" src="{}">'.format(room.map_image.url))
+
+
+class NowNextTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_now_and_next(self):
+        items = [
+            {'title': 'Long', 'start': 0, 'end': 100},
+            {'title': 'Short', 'start': 10, 'end': 20},
+            {'title': 'Later', 'start': 30, 'end': 40},
+            {'title': 'Last', 'start': 120, 'end': 130},
+        ]
+        timeline = RoomTimeline(room={}, starts=[0, 10, 30, 120], max_ends=[100, 100, 100, 130], items=items)
+
+        current, upcoming = now_and_next(timeline, 15)
+        self.assertEqual([item['title'] for item in current], ['Long', 'Short'])
+        self.assertEqual([item['title'] for item in upcoming], ['Later'])
+        # Short has ended, but Long from before it is still on
+        current, upcoming = now_and_next(timeline, 25, upcoming=2)
+        self.assertEqual([item['title'] for item in current], ['Long'])
+        self.assertEqual([item['title'] for item in upcoming], ['Later', 'Last'])
+        current, upcoming = now_and_next(timeline, 110)
+        self.assertEqual((current, [item['title'] for item in upcoming]), ([], ['Last']))
+        self.assertEqual(now_and_next(timeline, 200), ([], []))
+
+    def test_timelines_follow_schedule_version(self):
+        schedule = create_test_schedule()
+        convention = schedule['convention']
+        with self.assertNumQueries(2):
+            get_timelines(convention)
+        with self.assertNumQueries(0):
+            get_timelines(convention)
+
+        schedule['panels'][3].schedule.update(start_time=time(16, 0))
+        # update() doesn't send signals, the next save does
+        schedule['panels'][3].schedule.first().save()
+        with self.assertNumQueries(2):
+            timelines = get_timelines(convention)
+        room_a = [timeline for timeline in timelines if timeline.room['name'] == 'Panel Room A'][0]
+        self.assertEqual([item['title'] for item in room_a.items], ['Tabletop Tournament', 'Speedruns'])
+
+    def test_now_next_views(self):
+        schedule = create_test_schedule()
+        room_a = schedule['rooms'][1]
+        response = self.client.get(reverse('schedule_now_next_room_json', args=[room_a.id]) + '?next=2')
+        rooms = json.loads(response.content)['rooms']
+        self.assertEqual(len(rooms), 1)
+        self.assertEqual(rooms[0]['current'], [])
+        self.assertEqual([item['title'] for item in rooms[0]['next']], ['Tabletop Tournament', 'Speedruns'])
+
+        response = self.client.get(reverse('schedule_now_next'))
+        self.assertContains(response, 'Opening Ceremonies')
+        # The page escapes the apostrophe
+        self.assertContains(response, escape("Dealer's Den Open"))
+
+    @override_settings(SCHEDULE_IS_PUBLIC=False)
+    def test_now_next_not_public(self):
+        create_test_schedule()
+        self.assertEqual(self.client.get(reverse('schedule_now_next')).status_code, 404)
+        staff = get_user_model().objects.create_user('staff', password='staff', is_staff=True)
+        self.client.force_login(staff)
+        for url in (reverse('schedule_now_next'), reverse('schedule_now_next_json')):
+            response = self.client.get(url)
+            self.assertIn('private', response['Cache-Control'])
+            self.assertIn('max-age=30', response['Cache-Control'])
+
+
+class SolverTestCase(TestCase):
+    def test_solver_separates_co_starred_panels(self):
+        schedule = create_test_schedule()
+        panels = schedule['panels']
+        # Fans of the tournament want to draw too, but they overlap
+        for i in range(3):
+            user = get_user_model().objects.create_user('fan{}'.format(i))
+            Attendee.objects.create(user=user, panel=panels[1], starred=True)
+            Attendee.objects.create(user=user, panel=panels[2], starred=True)
+
+        problem = load_problem(schedule['convention'], [3, 4, 5, 6], 9 * 60, 26 * 60)
+        current = [showing['current'] for showing in problem.showings]
+        self.assertNotIn(None, current)
+        self.assertGreater(schedule_cost(problem, current), 0)
+
+        solver = Solver(problem, seed=1)
+        placement = solver.solve(iterations=500)
+        self.assertEqual(schedule_cost(problem, placement), 0)
+        self.assertEqual(solver.unplaced, [])
+        # Only what it had to move, and the database is untouched
+        changes = describe_changes(problem, placement)
+        self.assertEqual(len(changes), 2)
+        self.assertTrue(changes[0].startswith('- '))
+        self.assertEqual(panels[1].schedule.get().start_time, time(10, 0))
+
+    def test_solver_keeps_fixed_showings(self):
+        schedule = create_test_schedule()
+        panels = schedule['panels']
+        stage, room_a = schedule['rooms'][0], schedule['rooms'][1]
+        # A showing before the hours being solved for, one off the half
+        # hour grid, and a hidden panel still using its room
+        panels[0].schedule.create(day=4, start_time=time(7, 0), end_time=time(8, 0))
+        panels[3].schedule.update(start_time=time(15, 10))
+        staff_meeting = create_test_panel(convention=schedule['convention'], title='Staff Meeting',
+                                          track=schedule['tracks'][1], room=room_a, hidden=True)
+        staff_meeting.schedule.create(day=5, start_time=time(16, 0), end_time=time(17, 0))
+
+        problem = load_problem(schedule['convention'], [3, 4, 5, 6], 9 * 60, 26 * 60)
+        saturday = 2 * problem.slots_per_day
+        self.assertEqual(problem.fixed, ['Opening Ceremonies'])
+        opening = [showing for showing in problem.showings if showing['panel'] == panels[0].id]
+        self.assertEqual([showing['rooms'] for showing in opening], [[stage.id]])
+        speedruns = problem.panel_showings[panels[3].id][0]
+        self.assertEqual(problem.showings[speedruns]['current'], (room_a.id, saturday + 12))
+        self.assertEqual(problem.showings[speedruns]['length'], 2)
+        self.assertEqual(problem.available[room_a.id][saturday + 14], 0)
+
+        placement = [showing['current'] for showing in problem.showings]
+        placement[speedruns] = (room_a.id, saturday + 20)
+        self.assertEqual(describe_changes(problem, placement), [
+            '- Speedruns  Saturday 15:10-16:00  Panel Room A',
+            '+ Speedruns  Saturday 19:00-20:00  Panel Room A',
+        ])
+
 
 # Utility function tests
 class ConTimeTypeTestCase(TestCase):
@@ -184,3 +1516,11 @@ class TimeRoundTestCase(TestCase):
         self.assertIn(rounded.minute, [0, 30])
         self.assertEqual(rounded.second, 0)
         self.assertEqual(rounded.microsecond, 0)
+
+
+class ConMinutesTestCase(TestCase):
+    def test_con_minutes(self):
+        self.assertEqual(con_minutes(time(9, 30)), 570)
+        # After midnight is still the same con day
+        self.assertEqual(con_minutes(time(1, 0)), 1500)
+        self.assertEqual(con_minutes(contime(1, 0)), 1500)
@@ -0,0 +1,90 @@
+import logging
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger('schedule.timing')
+
+
+def timing_enabled():
+    return getattr(settings, 'SCHEDULE_SERVER_TIMING', False)
+
+
+class PhaseTimer(object):
+    '''
+    Collects how long each phase of building a schedule response takes,
+    then reports them in a Server-Timing header and a log line. Use as:
+
+        with timer.phase('query'):
+            ...
+
+    When disabled, phase() hands back a shared do-nothing context manager
+    and finish() returns the response untouched, so leaving the calls in
+    place costs next to nothing.
+    '''
+
+    def __init__(self, enabled=None):
+        self.enabled = timing_enabled() if enabled is None else enabled
+        self.phases = []
+        if self.enabled:
+            self.started = time.perf_counter()
+
+    def phase(self, name):
+        if not self.enabled:
+            return NULL_PHASE
+        return TimedPhase(self, name)
+
+    def record(self, name, duration):
+        '''Add a phase timed elsewhere, duration in milliseconds'''
+        if self.enabled:
+            self.phases.append((name, duration))
+
+    def finish(self, response, view_name='', **fields):
+        '''
+        Add the Server-Timing header to the response and log the phases.
+        Any extra keyword arguments are included in the log line.
+        '''
+        if not self.enabled:
+            return response
+        total = (time.perf_counter() - self.started) * 1000
+
+        metrics = ['{};dur={:.1f}'.format(name, duration) for name, duration in self.phases]
+        metrics.append('total;dur={:.1f}'.format(total))
+        response['Server-Timing'] = ', '.join(metrics)
+
+        data = {'view': view_name}
+        data.update(fields)
+        data.update(('{}_ms'.format(name), round(duration, 1)) for name, duration in self.phases)
+        data['total_ms'] = round(total, 1)
+        logger.info(' '.join('{}={}'.format(key, value) for key, value in data.items()),
+                    extra={'schedule_timing': data})
+        return response
+
+
+class TimedPhase(object):
+    __slots__ = ('timer', 'name', 'started')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.phases.append((self.name, (time.perf_counter() - self.started) * 1000))
+        return False
+
+
+class NullPhase(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_PHASE = NullPhase()
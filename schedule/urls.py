@@ -11,5 +11,22 @@ urlpatterns = [
     re_path(r'^ics/(?P<addl_filter>\w*)@(?P<auth_token>.*)$', views.ScheduleICS.as_view(), name='schedule_ics'),
     path('panel/<int:panelschedule_id>/<slug:slug>', views.panel_detail, name='schedule_panel_detail'),
     path('schedule.css', views.generate_css, name='schedule_css'),
+    path('events', views.schedule_events, name='schedule_events'),
+    path('bundle/manifest.json', views.bundle_manifest, name='schedule_bundle_manifest'),
+    path('bundle/<slug:bundle_hash>.json', views.bundle, name='schedule_bundle'),
+    path('now/', views.now_next, name='schedule_now_next'),
+    path('now/json', views.now_next, {'format': 'json'}, name='schedule_now_next_json'),
+    path('now/<int:room_id>/', views.now_next, name='schedule_now_next_room'),
+    path('now/<int:room_id>/json', views.now_next, {'format': 'json'}, name='schedule_now_next_room_json'),
+    path('metrics', views.metrics_export, name='schedule_metrics'),
+    path('report/feedback', views.feedback_report, name='schedule_feedback_report'),
+    path('report/feedback.csv', views.feedback_export, name='schedule_feedback_export'),
+    path('archive/<int:year>/', views.ArchivedScheduleList.as_view(), name='schedule_archive'),
+    path('archive/<int:year>/grid/', views.ArchivedScheduleGrid.as_view(), name='schedule_archive_grid'),
+    path('archive/<int:year>/list/', views.ArchivedScheduleList.as_view(), name='schedule_archive_list'),
+    path('archive/<int:year>/full/', views.ArchivedScheduleFull.as_view(), name='schedule_archive_full'),
+    path('archive/<int:year>/json', views.ArchivedScheduleJSON.as_view(), name='schedule_archive_json'),
+    path('archive/<int:year>/ics', views.ArchivedScheduleICS.as_view(), name='schedule_archive_ics'),
+    path('preferences.json', views.user_preferences, name='schedule_preferences'),
     re_path(r'^setpref/(?P<panel_id>\d+)/(?P<pref>\w*)$', views.set_preference, name='schedule_set_preference'),
 ]
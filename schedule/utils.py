@@ -130,3 +130,21 @@ def time_round(tm, minutes=30):
     else:
         raise ValueError("Can't round '%s' as a time value" % (
             type(tm).__name__))
+
+def is_ajax(request):
+    '''
+    Whether the request came from the schedule's own JavaScript, now that
+    Django no longer has request.is_ajax().
+    '''
+    return request.headers.get('x-requested-with') == 'XMLHttpRequest'
+
+def con_minutes(tm):
+    '''
+    Minutes since midnight for a time, in convention day order: times
+    before SCHEDULE_DAY_TRANSITION_HOUR count as the end of the day
+    before, so 1 AM is 1500 rather than 60.
+    '''
+    minutes = tm.hour * 60 + tm.minute
+    if tm.hour < contime.day_transition_hour():
+        minutes += 24 * 60
+    return minutes
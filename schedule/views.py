@@ -1,11 +1,25 @@
+import csv
+import hashlib
+import time
 from collections import OrderedDict
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.contrib.auth.decorators import login_required
-from django.db.models import Prefetch
-from django.http import Http404, HttpResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth import get_user
+from django.contrib.auth.views import redirect_to_login
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+from django.http import Http404, HttpRequest, HttpResponse, StreamingHttpResponse
+from django.middleware.csrf import get_token
 from django.shortcuts import get_object_or_404, redirect, render
+from django.template.loader import render_to_string
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.utils.safestring import mark_safe
 from django.views.decorators.cache import cache_control
 from django.views.generic import View
 from icalendar import Calendar, Event, vText
@@ -13,9 +27,35 @@ from json import dumps as json_dumps
 
 from convention import get_convention_model
 
-from .crypto import create_token, parse_token
-from .models import Attendee, Panel, PanelSchedule, RoomSchedule, Track
-from .utils import contime, time_range, time_round
+from . import events, metrics
+from .api import EVENT_FIELDS, EventQuery
+from .archive import get_snapshot
+from .bundle import get_bundle
+from .crypto import aparse_token, create_token
+from .cache import acached_for_version, cached_for_version, current_convention, get_schedule_version
+from .models import Attendee, Panel, PanelSchedule, Room, RoomSchedule, Track
+from .nownext import localize, past_window, room_status
+from .partitions import get_partitions, get_track_ids, merge_partitions, unshared
+from .preferences import (aclear_preferences, attach_preferences, filter_preferences, get_preferences,
+                          get_preferences_version, save_preference)
+from .reports import feedback_rows, feedback_summary
+from .routers import apin_to_primary, areplica_for, reads_from, replica_for
+from .timing import PhaseTimer
+from .utils import contime, is_ajax, time_range, time_round
+
+PANEL_DETAIL_CACHE_KEY = 'schedule:panel_detail:{panelschedule_id}'
+
+
+def is_user_independent(addl_filter):
+    '''
+    Whether schedule pages with this filter are served the same to
+    everyone, whoever's logged in, with schedule.js applying the user's
+    preferences from user_preferences. See SCHEDULE_USER_INDEPENDENT_PAGES.
+    The custom filter is only the user's own panels, so never is.
+    '''
+    return getattr(settings, 'SCHEDULE_USER_INDEPENDENT_PAGES', False) \
+        and getattr(settings, 'SCHEDULE_IS_PUBLIC', True) \
+        and addl_filter != 'custom'
 
 
 class Schedule(View):
@@ -31,21 +71,127 @@ class Schedule(View):
     '''
     template_name = None
     preload_panels_rooms = False
+    # Whether panels need the user's attendee_info for the template
+    with_preferences = True
+    # Whether to answer If-None-Match/If-Modified-Since before loading
+    conditional = True
     convention = None
     user = None
+    etag = None
+    window = None
+    user_independent = False
+
+    def setup(self, request, *args, **kwargs):
+        super().setup(request, *args, **kwargs)
+        self.started = time.perf_counter()
+        self.timer = PhaseTimer()
 
     def dispatch(self, request, addl_filter='', convention=None, **kwargs):
+        self.user_independent = is_user_independent(addl_filter)
+        # Don't even look at the session for pages served the same to everyone
+        self.request_user = AnonymousUser() if self.user_independent else request.user
+        # The schedule can come from a replica, see routers.py
+        with reads_from(replica_for(self.request_user)):
+            return self.dispatch_schedule(request, addl_filter, convention, **kwargs)
+
+    def dispatch_schedule(self, request, addl_filter, convention, **kwargs):
         self.current_convention = get_convention_model().objects.current()
+        response = self.check_request(request, self.request_user, addl_filter, convention)
+        if response is not None:
+            return response
+
+        if self.conditional and request.method in ('GET', 'HEAD'):
+            response = self.conditional_response(request)
+            if response is not None:
+                return self.finish_request(response, addl_filter)
+
+        response = super().dispatch(request, addl_filter=addl_filter, convention=convention, **kwargs)
+        if self.etag and response.status_code == 200:
+            response['ETag'] = self.etag
+            response['Last-Modified'] = http_date(self.last_modified)
+            if self.user_independent:
+                patch_cache_control(response, public=True,
+                                    max_age=getattr(settings, 'SCHEDULE_PUBLIC_MAX_AGE', 60))
+            else:
+                # Let the browser keep it, but check back every time
+                patch_cache_control(response, private=True, no_cache=True)
+        return self.finish_request(response, addl_filter)
+
+    def conditional_response(self, request):
+        '''
+        Work out the page's ETag and Last-Modified from everything that
+        changes it: the schedule version, the user and their preference
+        version, the filter and track, and which past items have dropped
+        off. Returns a 304 response if the browser's copy is current, all
+        without touching the panels.
+        '''
+        schedule_version = get_schedule_version(self.convention.pk)
+        preferences_version = get_preferences_version(self.user, self.convention.pk)
+        window = self.get_past_window()
+        key = ':'.join(str(part) for part in (
+            type(self).__name__, self.convention.pk, schedule_version,
+            self.user.pk if self.user else '', preferences_version,
+            self.addl_filter, ','.join(sorted(request.GET.getlist('track'))), window,
+        ))
+        # Weak, since the CSRF token on the page differs every time
+        self.etag = 'W/"{}"'.format(hashlib.md5(key.encode()).hexdigest())
+        self.last_modified = int(max(schedule_version / 1000, preferences_version / 1000, window))
+        return get_conditional_response(request, etag=self.etag, last_modified=self.last_modified)
+
+    def get_past_window(self):
+        '''
+        The end time of the last thing to have dropped off the page, see
+        nownext.past_window. Always 0 for the all view, which keeps them.
+        '''
+        if self.window is None:
+            self.window = 0
+            if self.addl_filter != 'all':
+                self.window = past_window(self.convention)
+        return self.window
+
+    def shared_variant(self):
+        '''
+        Which page this is, as a string to cache the packed schedule
+        under, when it's the same for everyone asking. None if it depends
+        on who's asking.
+        '''
+        if self.user and (self.with_preferences or self.addl_filter != 'all'):
+            return None
+        return ':'.join((type(self).__name__, self.addl_filter,
+                         ','.join(sorted(self.request.GET.getlist('track')))))
+
+    def cached_for_variant(self, name, builder):
+        '''
+        Build something for the request, cached per schedule version if
+        it's the same for everyone, see shared_variant. As panels end the
+        page changes too, but until it's rebuilt for the new window the
+        previous one is served to everyone else asking.
+        '''
+        variant = self.shared_variant()
+        if variant is None:
+            return builder()
+        window = ''
+        if self.addl_filter != 'all':
+            # Earlier days drop off once the convention starts
+            window = ':{}:{}'.format(timezone.now().date(), self.get_past_window())
+        return cached_for_version(name, self.convention.pk, builder,
+                                  variant=variant + window, stale_variant=variant)
+
+    def check_request(self, request, request_user, addl_filter, convention):
+        '''
+        Set up the convention and user for the request, and sanity check
+        it. Returns a response to send instead, if there is one.
+        '''
         # Load in convention and user instance variables
         self.convention = convention
         if not convention:
             self.convention = self.current_convention
-        if not self.user and request.user.is_authenticated:
-            self.user = request.user
+        if not self.user and request_user.is_authenticated:
+            self.user = request_user
 
         if not getattr(settings, 'SCHEDULE_IS_PUBLIC', True):
-            if not request.user.is_authenticated or \
-                    not request.user.is_staff:
+            if not request_user.is_authenticated or \
+                    not request_user.is_staff:
                 raise Http404()
 
         # Do some request sanity checking
@@ -58,34 +204,162 @@ class Schedule(View):
             return response
         self.addl_filter = addl_filter
 
-        return super().dispatch(request, addl_filter=addl_filter, convention=convention, **kwargs)
+    def finish_request(self, response, addl_filter):
+        view_name = type(self).__name__
+        filter_name = addl_filter or 'default'
+        metrics.inc('schedule_requests_total', view=view_name, filter=filter_name)
+        metrics.observe('schedule_request_seconds', time.perf_counter() - self.started,
+                        view=view_name, filter=filter_name)
+        return self.timer.finish(response, view_name, filter=filter_name)
 
     def get(self, request, addl_filter='', convention=None):
         if self.preload_panels_rooms:
-            self.load_panels_rooms()
-        structure = self.pack_struct()
+            # Anonymous visitors all get the same pages, so pack them once
+            structure = self.cached_for_variant('packed', self.build_struct)
+        else:
+            structure = self.build_struct()
 
         context = {
             'addl_filter': addl_filter,
-            'track_filter': request.GET['track'] if 'track' in request.GET.keys() else None,
+            'track_filter': request.GET.getlist('track') or None,
             'convention': self.convention,
-            'request_user': request.user,
+            'request_user': self.request_user,
+            'user_independent': self.user_independent,
             'today': None,  # TODO: Today detection for tab auto-selection
-            'auth_token': create_token(request.user),
+            # Pages served to everyone get the user's token from schedule.js
+            'auth_token': create_token(self.request_user),
             'tracks': Track.objects.filter(convention=self.convention),
         }
         context.update(structure)
 
-        return render(request, self.template_name, context)
+        with self.timer.phase('render'):
+            return render(request, self.template_name, context)
+
+    def build_struct(self):
+        if self.preload_panels_rooms:
+            with self.timer.phase('query'):
+                self.load_panels_rooms()
+        with self.timer.phase('pack'):
+            return self.pack_struct()
 
     def pack_struct(self):
         raise NotImplementedError
 
+    @classmethod
+    def for_convention(cls, convention, addl_filter='all'):
+        '''
+        Set up a view instance outside of the request cycle for the given
+        convention, so the schedule can be loaded and packed directly,
+        e.g. when freezing an archived convention.
+        '''
+        view = cls()
+        view.setup(HttpRequest())
+        view.current_convention = get_convention_model().objects.current()
+        view.convention = convention
+        view.addl_filter = addl_filter
+        return view
+
+    def requested_tracks(self):
+        '''
+        The ids of the tracks asked for by name with ?track= (any number
+        of them), or None for every track. Unknown tracks are a 404.
+        '''
+        names = self.request.GET.getlist('track')
+        if not names:
+            return None
+        track_ids = get_track_ids(self.convention)
+        try:
+            return sorted({track_ids[name] for name in names})
+        except KeyError:
+            raise Http404('No Track matches the given query.')
+
+    def merge_panels_rooms(self, partitions, track_ids):
+        '''
+        Put together the panels and rooms lists from the cached track
+        partitions, when they're the same for everyone (see
+        shared_variant), with the same day filtering as
+        filter_panels_rooms. The objects are shared, so aren't to be
+        changed.
+        '''
+        self.panelschedules, self.roomschedules = merge_partitions(partitions, track_ids)
+        if self.addl_filter != 'all':
+            if self.convention == self.current_convention \
+                and self.convention.start_date < timezone.now().date():
+                first_day = self.convention.start_date.weekday()
+                self.panelschedules = [panelschedule for panelschedule in self.panelschedules
+                                       if panelschedule.day >= first_day]
+                self.roomschedules = [roomschedule for roomschedule in self.roomschedules
+                                      if roomschedule.day >= first_day]
+        return (self.panelschedules, self.roomschedules)
+
+    def uses_partitions(self):
+        '''Whether the lists can be put together from the track partitions'''
+        return True
+
+    def personalize(self, prefs):
+        '''
+        Narrow down the lists merged from the partitions for the logged
+        in user, the same way filter_panels_rooms does in the database,
+        and attach their attendee_info. The panels get copied first for
+        that, since the partitions' objects are shared.
+        '''
+        self.panelschedules = filter_preferences(self.panelschedules, prefs, self.addl_filter)
+        if self.addl_filter == 'custom':
+            self.roomschedules = []
+        if self.with_preferences:
+            self.panelschedules = [unshared(panelschedule) for panelschedule in self.panelschedules]
+            attach_preferences(self.panelschedules, prefs)
+        return (self.panelschedules, self.roomschedules)
+
     def load_panels_rooms(self):
         '''
         Load in the panels and rooms lists based on the logged in user,
         the requested preset filter, and time for a given convention.
         '''
+        track_ids = self.requested_tracks()
+        if self.uses_partitions():
+            self.merge_panels_rooms(get_partitions(self.convention), track_ids)
+            if self.shared_variant() is None:
+                # From the user's cached preferences rather than another query
+                self.personalize(get_preferences(self.user, self.convention))
+            return (self.panelschedules, self.roomschedules)
+        self.filter_panels_rooms(track_ids)
+
+        # Run the queries now, rather than whenever the lists are first used
+        self.panelschedules = list(self.panelschedules)
+        self.roomschedules = list(self.roomschedules)
+
+        if self.user and self.with_preferences:
+            attach_preferences(self.panelschedules, get_preferences(self.user, self.convention))
+        return (self.panelschedules, self.roomschedules)
+
+    async def aload_panels_rooms(self):
+        '''
+        Same as load_panels_rooms, but with the async ORM, for the async
+        views.
+        '''
+        track_ids = await sync_to_async(self.requested_tracks)()
+        if self.uses_partitions():
+            partitions = await sync_to_async(get_partitions)(self.convention)
+            self.merge_panels_rooms(partitions, track_ids)
+            if self.shared_variant() is None:
+                self.personalize(await sync_to_async(get_preferences)(self.user, self.convention))
+            return (self.panelschedules, self.roomschedules)
+        self.filter_panels_rooms(track_ids)
+
+        self.panelschedules = [panelschedule async for panelschedule in self.panelschedules]
+        self.roomschedules = [roomschedule async for roomschedule in self.roomschedules]
+
+        if self.user and self.with_preferences:
+            prefs = await sync_to_async(get_preferences)(self.user, self.convention)
+            attach_preferences(self.panelschedules, prefs)
+        return (self.panelschedules, self.roomschedules)
+
+    def filter_panels_rooms(self, track_ids=None):
+        '''
+        Set up the panelschedules and roomschedules querysets for the
+        request, without running them yet.
+        '''
         self.panelschedules = PanelSchedule.objects.select_related(
             'panel', 'panel__convention', 'panel__room', 'panel__track'
         ).filter(
@@ -107,28 +381,23 @@ class Schedule(View):
                 self.roomschedules = self.roomschedules.exclude(
                     day__lt=self.convention.start_date.weekday())
 
-            # Apply additional filtering if the user has logged in
+            # Apply additional filtering if the user has logged in. These
+            # are (NOT) EXISTS subqueries against the user's partial
+            # indexes, rather than joining in the whole Attendee table.
             if self.user:
                 if self.addl_filter == '':
-                    self.panelschedules = self.panelschedules.exclude(
-                        panel__attendee__in=Attendee.objects.filter(
-                            user=self.user, hide_from_user=True))
+                    self.panelschedules = self.panelschedules.filter(
+                        ~Exists(Attendee.objects.filter(
+                            panel=OuterRef('panel'), user=self.user, hide_from_user=True)))
                 if self.addl_filter == 'custom':
                     self.panelschedules = self.panelschedules.filter(
-                        panel__attendee__user=self.user, panel__attendee__starred=True)
+                        Exists(Attendee.objects.filter(
+                            panel=OuterRef('panel'), user=self.user, starred=True)))
                     self.roomschedules = RoomSchedule.objects.none()
 
-        if 'track' in self.request.GET.keys():
-            track = get_object_or_404(Track, name=self.request.GET['track'], convention=self.current_convention)
-            self.panelschedules = self.panelschedules.filter(panel__track=track)
-            self.roomschedules = self.roomschedules.filter(room__track=track)
-
-        if self.user:
-            # Pre-fetch any preference records for this attendee
-            self.panelschedules = self.panelschedules.prefetch_related(
-                Prefetch('panel__attendee_set',
-                         queryset=Attendee.objects.filter(user=self.user),
-                         to_attr='attendee_info'))
+        if track_ids is not None:
+            self.panelschedules = self.panelschedules.filter(panel__track__in=track_ids)
+            self.roomschedules = self.roomschedules.filter(room__track__in=track_ids)
         return (self.panelschedules, self.roomschedules)
 
     def create_base_days_structure(self):
@@ -304,26 +573,86 @@ class ScheduleGrid(Schedule):
 
 
 class SerializedSchedule(Schedule):
-    """Abstract subclass that packs the schedule into some other format"""
+    """
+    Abstract subclass that packs the schedule into some other format.
 
-    def dispatch(self, request, auth_token=None, **kwargs):
+    These are async views: calendar apps poll the feeds constantly, and
+    under ASGI one worker can keep many polls going while they wait on
+    the database. load_panels_rooms() and serialize() still work
+    synchronously for use outside of a request, like archiving.
+    """
+    with_preferences = False
+
+    async def dispatch(self, request, auth_token=None, addl_filter='', convention=None, **kwargs):
         # If we've been given an auth token, try to parse into user
         if auth_token:
-            user = parse_token(auth_token)
+            with self.timer.phase('token'):
+                user = await aparse_token(auth_token)
             if user:
                 # Don't need to do a proper logon, just stash the user
                 # object for the subsequent queries.
                 self.user = user
-        # Superclass's dispatch should load in user if we didn't here
-        return super().dispatch(request, auth_token=auth_token, **kwargs)
+            else:
+                metrics.inc('schedule_token_failures_total')
+
+        # Load in the session's user if we didn't get one here, unless the
+        # feed is served the same to everyone
+        self.user_independent = is_user_independent(addl_filter)
+        if self.user_independent:
+            request_user = AnonymousUser()
+        else:
+            request_user = await sync_to_async(get_user)(request)
+
+        with reads_from(await areplica_for(self.user or request_user)):
+            self.current_convention = await sync_to_async(get_convention_model().objects.current)()
+            response = self.check_request(request, request_user, addl_filter, convention)
+            if response is not None:
+                return response
+
+            # Skip Schedule's synchronous dispatch, straight to the handler
+            response = await super(Schedule, self).dispatch(
+                request, auth_token=auth_token, addl_filter=addl_filter, convention=convention, **kwargs)
+        return self.finish_request(response, addl_filter)
+
+    async def aserialize(self, panelschedules, roomschedules):
+        # Building the feed is CPU work that may also lazily load the
+        # convention's site, so keep it off the event loop
+        return await sync_to_async(self.serialize)(panelschedules, roomschedules)
+
+    async def abuild_body(self):
+        with self.timer.phase('query'):
+            panelschedules, roomschedules = await self.aload_panels_rooms()
+        with self.timer.phase('serialize'):
+            return await self.aserialize(panelschedules, roomschedules)
+
+    async def abody(self):
+        '''
+        The serialized feed. Anonymous feeds, and the all feed for
+        anyone, are cached per schedule version.
+        '''
+        variant = self.shared_variant()
+        if variant is None:
+            return await self.abuild_body()
+        window = ''
+        if self.addl_filter != 'all':
+            window = ':{}'.format(timezone.now().date())
+        return await acached_for_version('feed', self.convention.pk, self.abuild_body,
+                                         variant=variant + window, stale_variant=variant)
 
 
 class ScheduleICS(SerializedSchedule):
     """Makes an ICS file rather than HTML"""
 
-    def get(self, request, addl_filter='', **kwargs):
-        panelschedules, roomschedules = self.load_panels_rooms()
+    async def get(self, request, addl_filter='', **kwargs):
+        metrics.inc('schedule_ics_polls_total', filter=addl_filter or 'default')
+        response = HttpResponse(await self.abody(), content_type='text/calendar')
+        response['Content-Disposition'] = 'attachment; filename="{con}{filter}.ics"'.format(
+            con=self.convention.name,
+            filter=' ' + addl_filter if addl_filter else '',
+        )
+        return response
 
+    def serialize(self, panelschedules, roomschedules):
         cal = Calendar()
         cal.add('prodid', '-//Motor City Furry Con//mcfc_schedule//EN')
         cal.add('version', '2.0')
@@ -361,67 +690,207 @@ class ScheduleICS(SerializedSchedule):
                 domain=self.convention.site.domain))
             cal.add_component(event)
 
-        response = HttpResponse(cal.to_ical(), content_type='text/calendar')
-        response['Content-Disposition'] = 'attachment; filename="{con}{filter}.ics"'.format(
-            con=self.convention.name,
-            filter=' ' + addl_filter if addl_filter else '',
-        )
-        return response
+        return cal.to_ical()
 
 
 class ScheduleJSON(SerializedSchedule):
-    """Makes JSON output rather than HTML, for future PWA use or such."""
+    """
+    Makes JSON output rather than HTML, for future PWA use or such.
+
+    Query parameters (see api.EventQuery) ask for a slice of it instead,
+    ordered by start time, a page at a time.
+    """
+    query = None
+
+    async def get(self, request, addl_filter='', **kwargs):
+        self.query = EventQuery.from_params(request.GET, self.convention)
+        if self.query is None:
+            return HttpResponse(await self.abody(), content_type='text/json')
+
+        with self.timer.phase('query'):
+            panelschedules, roomschedules = await self.aload_panels_rooms()
+        with self.timer.phase('serialize'):
+            items, cursor = self.query.page(panelschedules, roomschedules)
+            response = HttpResponse(json_dumps({
+                'convention': self.convention.name,
+                'events': [self.serialize_panel(item, self.query.fields) if isinstance(item, PanelSchedule)
+                           else self.serialize_room(item, self.query.fields) for item in items],
+                'next': cursor,
+            }), content_type='text/json')
+        return response
 
-    def get(self, request, addl_filter='', **kwargs):
-        panelschedules, roomschedules = self.load_panels_rooms()
+    def shared_variant(self):
+        # Slices aren't worth caching, they vary too much
+        if self.query is not None:
+            return None
+        return super().shared_variant()
+
+    def uses_partitions(self):
+        # Slices are filtered in the database
+        return self.query is None
+
+    def filter_panels_rooms(self, track_ids=None):
+        if self.query is not None:
+            # Slices do their own track filtering
+            track_ids = None
+        super().filter_panels_rooms(track_ids)
+        if self.query is not None:
+            self.panelschedules, self.roomschedules = self.query.filter(
+                self.panelschedules, self.roomschedules)
+        return (self.panelschedules, self.roomschedules)
 
-        panel_list = [{
+    def serialize_panel(self, panelschedule, fields=EVENT_FIELDS):
+        # Long text fields may have been deferred if they're not wanted
+        event = {
             'title': panelschedule.panel.title,
-            'description': panelschedule.panel.description,
-            'hosts': panelschedule.panel.hosts,
+            'description': panelschedule.panel.description if 'description' in fields else None,
+            'hosts': panelschedule.panel.hosts if 'hosts' in fields else None,
             'start': str(panelschedule.start_timestamp),
             'end': str(panelschedule.end_timestamp),
             'room': panelschedule.panel.room.name,
             'track': panelschedule.panel.track.name,
             'type': 'panel'
-        } for panelschedule in panelschedules]
+        }
+        return {key: value for key, value in event.items() if key in fields}
 
-        room_list = [{
+    def serialize_room(self, roomschedule, fields=EVENT_FIELDS):
+        event = {
             'title': roomschedule.room.name + ' Open',
-            'description': roomschedule.room.description,
+            'description': roomschedule.room.description if 'description' in fields else None,
             'start': str(roomschedule.start_timestamp),
             'end': str(roomschedule.end_timestamp),
             'track': roomschedule.room.track.name,
             'type': 'room'
-        } for roomschedule in roomschedules]
+        }
+        return {key: value for key, value in event.items() if key in fields}
 
+    def serialize(self, panelschedules, roomschedules):
         event_struct = {
-            'convention': current_convention.name,
-            'events': panel_list + room_list,
+            'convention': self.convention.name,
+            'events': [self.serialize_panel(panelschedule) for panelschedule in panelschedules] +
+                      [self.serialize_room(roomschedule) for roomschedule in roomschedules],
+        }
+
+        return json_dumps(event_struct)
+
+
+class ArchivedSchedule(View):
+    '''
+    Serves a frozen snapshot of a past convention's schedule, by year.
+    Nothing here touches the database once the snapshot is cached, and
+    since the content can't change the responses are marked immutable.
+
+    Pages are rendered without the request, so they carry no user or
+    CSRF state and are safe for any shared cache to keep, as long as
+    the schedule is public. Otherwise they're for staff only, like the
+    live schedule, and only the browser may keep them.
+    '''
+    template_name = None
+    packed_name = None
+
+    def get(self, request, year):
+        is_public = getattr(settings, 'SCHEDULE_IS_PUBLIC', True)
+        if not is_public:
+            if not request.user.is_authenticated or not request.user.is_staff:
+                raise Http404()
+
+        frozen = get_snapshot(year)
+        if frozen is None:
+            raise Http404('No archived schedule for that year.')
+
+        response = self.render_snapshot(frozen)
+        max_age = getattr(settings, 'SCHEDULE_ARCHIVE_MAX_AGE', 60*60*24*365)
+        if is_public:
+            patch_cache_control(response, public=True, immutable=True, max_age=max_age)
+        else:
+            patch_cache_control(response, private=True, immutable=True, max_age=max_age)
+        return response
+
+    def render_snapshot(self, frozen):
+        packed = frozen['packed']
+        context = {
+            'addl_filter': 'all',
+            'track_filter': None,
+            'convention': packed['convention'],
+            'request_user': AnonymousUser(),
+            'today': None,
+            'archived': True,
+            'tracks': packed['tracks'],
         }
+        context.update(packed[self.packed_name])
+        return HttpResponse(render_to_string(self.template_name, context))
+
+
+class ArchivedScheduleList(ArchivedSchedule):
+    template_name = 'schedule/list.html'
+    packed_name = 'list'
+
+
+class ArchivedScheduleFull(ArchivedSchedule):
+    template_name = 'schedule/full.html'
+    packed_name = 'list'
 
-        response = HttpResponse(json_dumps(event_struct), content_type='text/json')
+
+class ArchivedScheduleGrid(ArchivedSchedule):
+    template_name = 'schedule/grid.html'
+    packed_name = 'grid'
+
+
+class ArchivedScheduleICS(ArchivedSchedule):
+    def render_snapshot(self, frozen):
+        response = HttpResponse(frozen['ics'], content_type='text/calendar')
+        response['Content-Disposition'] = 'attachment; filename="{con}.ics"'.format(
+            con=frozen['packed']['convention'].name)
         return response
 
 
-def panel_detail(request, panelschedule_id, **kwargs):
+class ArchivedScheduleJSON(ArchivedSchedule):
+    def render_snapshot(self, frozen):
+        return HttpResponse(frozen['json'], content_type='text/json')
+
+
+def load_panel_detail(panelschedule_id):
     '''
-    Show detail info for a PanelSchedule item. May get a slug field in
-    kwargs, but we don't really care about it; just for better links.
+    Load a PanelSchedule for the detail page, along with the page's body
+    rendered as seen anonymously. Both are cached until the panel's
+    convention's schedule changes. Returns (panelschedule, body).
     '''
+    key = PANEL_DETAIL_CACHE_KEY.format(panelschedule_id=panelschedule_id)
+    cached = cache.get(key)
+    if cached is not None and \
+            cached['version'] == get_schedule_version(cached['panelschedule'].panel.convention_id):
+        metrics.cache_result('panel_detail', True)
+        return cached['panelschedule'], cached['body']
+    metrics.cache_result('panel_detail', False)
+
     try:
-        panelobjects = PanelSchedule.objects
-        if request.user.is_authenticated:
-            panelobjects = panelobjects.prefetch_related(
-                Prefetch('panel__attendee_set',
-                         queryset=Attendee.objects.filter(user=request.user),
-                         to_attr='attendee_info')
-            )
-        panelschedule = panelobjects.get(id=panelschedule_id, panel__hidden=False)
+        panelschedule = PanelSchedule.objects.select_related(
+            'panel', 'panel__convention', 'panel__room', 'panel__track'
+        ).prefetch_related('panel__schedule').get(id=panelschedule_id, panel__hidden=False)
     except PanelSchedule.DoesNotExist:
         raise Http404("No panel found with that ID.")
+    version = get_schedule_version(panelschedule.panel.convention_id)
+
+    other_times = [other for other in panelschedule.panel.schedule.all()
+                   if other.id != panelschedule.id]
+    body = render_to_string('schedule/panel_detail_body.html', {
+        'panelschedule': panelschedule,
+        'other_times': other_times,
+    })
+    cache.set(key, {'version': version, 'panelschedule': panelschedule, 'body': body},
+              timeout=getattr(settings, 'SCHEDULE_CACHE_TIMEOUT', 60*60*24))
+    return panelschedule, body
 
-    other_times = panelschedule.panel.schedule.exclude(id=panelschedule.id)
+def panel_detail(request, panelschedule_id, **kwargs):
+    '''
+    Show detail info for a PanelSchedule item. May get a slug field in
+    kwargs, but we don't really care about it; just for better links.
+    The panel info itself comes from the cache, with only the user's
+    star/hide/feedback state added on top.
+    '''
+    panelschedule, body = load_panel_detail(panelschedule_id)
+    if request.user.is_authenticated:
+        attach_preferences([panelschedule], get_preferences(request.user, panelschedule.panel.convention))
 
     # Try to detect if we've come from the grid or list view
     # TODO: Might even be able to inspect urlpatterns. But for now...
@@ -436,11 +905,141 @@ def panel_detail(request, panelschedule_id, **kwargs):
                   'schedule/panel_detail.html',
                   {
                     'panelschedule': panelschedule,
-                    'other_times': other_times,
+                    'panel_body': mark_safe(body),
                     'referer': referer,
                     'request_user': request.user,
                   })
 
+async def schedule_events(request, convention=None):
+    '''
+    Server-Sent Events stream of changes to a convention's schedule, so
+    open schedule pages can update without reloading. Async, so under
+    ASGI each open page is a coroutine waiting on the cache, not a thread.
+    '''
+    if not getattr(settings, 'SCHEDULE_IS_PUBLIC', True):
+        user = await sync_to_async(get_user)(request)
+        if not user.is_authenticated or not user.is_staff:
+            raise Http404()
+    if not convention:
+        convention = await sync_to_async(get_convention_model().objects.current)()
+
+    last_id = request.META.get('HTTP_LAST_EVENT_ID')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        last_id = None
+
+    response = StreamingHttpResponse(events.stream_events(convention.pk, last_id),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Don't let nginx buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@cache_control(max_age=30)
+def now_next(request, room_id=None, format='html'):
+    '''
+    What's on now and next, in every room or just one, for signage and
+    door displays. Served from per-room timelines cached per schedule
+    version, so a poll is a couple of cache hits and a binary search.
+    '''
+    if not getattr(settings, 'SCHEDULE_IS_PUBLIC', True):
+        if not request.user.is_authenticated or not request.user.is_staff:
+            raise Http404()
+    convention = current_convention()
+    if convention is None:
+        raise Http404()
+    try:
+        upcoming = min(max(int(request.GET.get('next', 1)), 0), 10)
+    except ValueError:
+        upcoming = 1
+
+    status = room_status(convention, room_id=room_id, upcoming=upcoming)
+    if room_id is not None and not status:
+        # Nothing scheduled in the room at all, but it should still exist
+        room = get_object_or_404(Room, id=room_id, convention=convention)
+        status = [{'room': {'id': room.id, 'name': room.name, 'alias': room.alias or '',
+                            'location_hint': room.location_hint or ''},
+                   'current': [], 'next': []}]
+
+    if format == 'json':
+        def serialize(item):
+            item = localize(item)
+            item['start'] = item['start'].isoformat()
+            item['end'] = item['end'].isoformat()
+            return item
+        response = HttpResponse(json_dumps({
+            'convention': convention.name,
+            'now': timezone.now().isoformat(),
+            'rooms': [{
+                'room': room['room'],
+                'current': [serialize(item) for item in room['current']],
+                'next': [serialize(item) for item in room['next']],
+            } for room in status],
+        }), content_type='text/json')
+    else:
+        response = render(request, 'schedule/now_next.html', {
+            'convention': convention,
+            'rooms': [{
+                'room': room['room'],
+                'current': [localize(item) for item in room['current']],
+                'next': [localize(item) for item in room['next']],
+            } for room in status],
+        })
+    # A staff only schedule mustn't end up in shared caches
+    if not getattr(settings, 'SCHEDULE_IS_PUBLIC', True):
+        patch_cache_control(response, private=True)
+    return response
+
+def bundle_convention(request):
+    '''The current convention, for the public offline bundle views'''
+    if not getattr(settings, 'SCHEDULE_IS_PUBLIC', True):
+        if not request.user.is_authenticated or not request.user.is_staff:
+            raise Http404()
+    convention = current_convention()
+    if convention is None:
+        raise Http404()
+    return convention
+
+@cache_control(no_cache=True)
+def bundle_manifest(request):
+    '''
+    Just the current offline bundle's hash and URL, for clients to check
+    on every open, fetching the bundle only when it's changed.
+    '''
+    current = get_bundle(bundle_convention(request))
+    return HttpResponse(json_dumps({
+        'hash': current['hash'],
+        'url': reverse('schedule_bundle', args=[current['hash']]),
+    }), content_type='text/json')
+
+def bundle(request, bundle_hash):
+    '''
+    The whole schedule as a compact bundle (see bundle.py), at a URL with
+    its content hash, so it can be cached forever. Sent gzipped when the
+    client takes it, even without GZipMiddleware.
+    '''
+    current = get_bundle(bundle_convention(request))
+    if bundle_hash != current['hash']:
+        # Superseded, send them along to the new one
+        response = redirect('schedule_bundle', current['hash'])
+        patch_cache_control(response, no_cache=True)
+        return response
+
+    if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response = HttpResponse(current['gzip'], content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(current['body'], content_type='application/json')
+    response['Vary'] = 'Accept-Encoding'
+    response['ETag'] = '"{}"'.format(current['hash'])
+    # A staff only schedule mustn't end up in shared caches
+    if getattr(settings, 'SCHEDULE_IS_PUBLIC', True):
+        patch_cache_control(response, public=True, immutable=True, max_age=60*60*24*365)
+    else:
+        patch_cache_control(response, private=True, immutable=True, max_age=60*60*24*365)
+    return response
+
 @cache_control(max_age=60*60*24)
 def generate_css(request, convention=None):
     '''Gather track list for this convention and build CSS'''
@@ -454,13 +1053,21 @@ def generate_css(request, convention=None):
                   'schedule/schedule.css',
                   {'tracks': tracks}, content_type='text/css')
 
-@login_required
-def set_preference(request, panel_id, pref=None):
-    '''Adjust the settings object for a user on a given panel'''
+async def set_preference(request, panel_id, pref=None):
+    '''
+    Adjust the settings object for a user on a given panel. Async, since
+    starring panels through a schedule page comes in quick bursts.
+    '''
+    user = await sync_to_async(get_user)(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
 
-    if not request.is_ajax() and pref is None:
+    if not is_ajax(request) and pref is None:
         raise Http404()
-    panel = get_object_or_404(Panel, id=panel_id)
+    try:
+        panel = await Panel.objects.aget(id=panel_id)
+    except Panel.DoesNotExist:
+        raise Http404('No Panel matches the given query.')
 
     defaults = {}
     # TODO: Maybe worth doing a proper form here
@@ -482,11 +1089,104 @@ def set_preference(request, panel_id, pref=None):
     if pref == 'unhide':
         defaults['hide_from_user'] = False
 
-    obj, created = Attendee.objects.update_or_create(
-        user=request.user, panel=panel,
-        defaults=defaults,
-    )
+    await sync_to_async(save_preference)(user, panel, defaults)
+    await aclear_preferences(user, panel.convention_id)
+    await apin_to_primary(user)
+    metrics.inc('schedule_preference_writes_total', pref=pref or 'feedback')
 
-    if request.is_ajax():
+    if is_ajax(request):
         return HttpResponse(status=204)
     return redirect('schedule_default')
+
+
+def user_preferences(request):
+    '''
+    The user's starred, hidden and attended panel ids for the current
+    convention, and their preference version, for schedule.js to apply
+    to pages served the same to everyone. Also hands over what those
+    pages leave out: the CSRF token and the user's ICS link token.
+    '''
+    convention = current_convention()
+    if convention is None:
+        raise Http404()
+    user = request.user
+    prefs = get_preferences(user, convention)
+    data = {
+        'authenticated': user.is_authenticated,
+        'version': get_preferences_version(user, convention.pk),
+        'starred': sorted(prefs.starred),
+        'hidden': sorted(prefs.hidden),
+        'attended': sorted(prefs.attended),
+    }
+    if user.is_authenticated:
+        data['token'] = create_token(user)
+        data['csrf'] = get_token(request)
+    response = HttpResponse(json_dumps(data), content_type='text/json')
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@staff_member_required
+def metrics_export(request):
+    '''Current schedule metrics, in the Prometheus text exposition format'''
+    return HttpResponse(metrics.exposition(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class Echo:
+    '''Pseudo-buffer for csv.writer, handing each row straight back'''
+    def write(self, value):
+        return value
+
+
+def report_convention(request):
+    '''The convention a staff report asked for, or the current one'''
+    Convention = get_convention_model()
+    if 'convention' in request.GET:
+        try:
+            return get_object_or_404(Convention, pk=request.GET['convention'])
+        except ValueError:
+            raise Http404()
+    convention = Convention.objects.current()
+    if convention is None:
+        raise Http404()
+    return convention
+
+
+@staff_member_required
+def feedback_report(request):
+    '''Star, attendance and feedback counts for every panel'''
+    convention = report_convention(request)
+    panels = feedback_summary(convention)
+    totals = {field: sum(panel[field] for panel in panels)
+              for field in ('stars', 'hides', 'attended_yes', 'attended_no', 'feedback')}
+    return render(request, 'schedule/feedback_report.html', {
+        'convention': convention,
+        'current_convention': get_convention_model().objects.current(),
+        'panels': panels,
+        'totals': totals,
+        'title': 'Panel feedback',
+    })
+
+
+@staff_member_required
+def feedback_export(request):
+    '''
+    All the feedback for a convention, or one panel with ?panel=, as a
+    CSV file streamed out as it's read from the database.
+    '''
+    panel_id = None
+    if 'panel' in request.GET:
+        try:
+            panel = get_object_or_404(Panel, id=request.GET['panel'])
+        except ValueError:
+            raise Http404()
+        convention, panel_id = panel.convention, panel.id
+    else:
+        convention = report_convention(request)
+
+    writer = csv.writer(Echo())
+    response = StreamingHttpResponse((writer.writerow(row) for row in feedback_rows(convention, panel_id)),
+                                     content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="{con} feedback.csv"'.format(con=convention.name)
+    return response
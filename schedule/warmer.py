@@ -0,0 +1,126 @@
+import heapq
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from urllib.parse import urlencode
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.http import QueryDict
+from django.utils import timezone
+
+from .bundle import get_bundle
+from .cache import current_convention, get_schedule_version
+from .nownext import get_end_times, get_timelines
+from .partitions import get_partitions, get_track_ids
+from .views import ScheduleFull, ScheduleGrid, ScheduleICS, ScheduleJSON, ScheduleList
+
+# Wait this long past a boundary before warming, in seconds, so whatever
+# ended is safely in the past for the pages too
+BOUNDARY_DELAY = 1
+
+
+def next_midnights(now):
+    '''
+    The next local midnight after now (epoch seconds), and the next
+    midnight by timezone.now().date() (UTC, with USE_TZ), which is when
+    the pages' earlier days drop off and their shared variant changes
+    '''
+    tz = timezone.get_current_timezone()
+    local = datetime.fromtimestamp(now, tz=tz)
+    clock = datetime.fromtimestamp(now, tz=dt_timezone.utc) if settings.USE_TZ else local
+    return {datetime.combine(moment.date() + timedelta(days=1), datetime.min.time(),
+                             tzinfo=moment.tzinfo).timestamp()
+            for moment in (local, clock)}
+
+
+def upcoming_boundaries(convention, now):
+    '''
+    Every panel and room opening start and end time (epoch seconds)
+    after now, plus the next midnight, as a heap
+    '''
+    times = next_midnights(now)
+    for timeline in get_timelines(convention):
+        for item in timeline.items:
+            times.update((item['start'], item['end']))
+    # A sorted list is already a heap
+    return sorted(moment for moment in times if moment > now)
+
+
+class CacheWarmer(object):
+    '''
+    Keeps the shared schedule caches built for the current convention,
+    so requests after a panel ends, or after an edit, don't pay for the
+    rebuild. Call step() in a loop and sleep for as long as it says; it
+    warms everything when the schedule version changes, and at each
+    start and end time in the boundaries heap.
+    '''
+    views = (ScheduleList, ScheduleFull, ScheduleGrid)
+    feeds = (ScheduleICS, ScheduleJSON)
+    filters = ('', 'all')
+
+    def __init__(self, poll=None, log=None):
+        # How often to check for edits, in seconds
+        self.poll = poll or getattr(settings, 'SCHEDULE_WARMER_POLL', 30)
+        self.log = log or (lambda message: None)
+        self.convention_id = None
+        self.version = None
+        self.boundaries = []
+
+    def step(self, now=None):
+        '''Warm the caches if they need it, returns how long to sleep'''
+        if now is None:
+            now = time.time()
+        convention = current_convention()
+        if convention is None:
+            return self.poll
+
+        version = get_schedule_version(convention.pk)
+        if (convention.pk, version) != (self.convention_id, self.version):
+            self.convention_id, self.version = convention.pk, version
+            self.boundaries = upcoming_boundaries(convention, now)
+            self.warm(convention, 'schedule version {}'.format(version))
+        elif self.boundaries and self.boundaries[0] + BOUNDARY_DELAY <= now:
+            while self.boundaries and self.boundaries[0] + BOUNDARY_DELAY <= now:
+                heapq.heappop(self.boundaries)
+            # Keep the next midnight coming, for the days after this one
+            for midnight in next_midnights(now) - set(self.boundaries):
+                heapq.heappush(self.boundaries, midnight)
+            self.warm(convention, 'boundary')
+
+        if self.boundaries:
+            return max(0, min(self.poll, self.boundaries[0] + BOUNDARY_DELAY - now))
+        return self.poll
+
+    def view(self, view_class, convention, addl_filter, track=None):
+        view = view_class.for_convention(convention, addl_filter)
+        if track is not None:
+            view.request.GET = QueryDict(urlencode({'track': track}))
+        return view
+
+    def warm(self, convention, reason):
+        '''
+        Build each shared variant: the pages and feeds for each filter,
+        for all tracks and each single track, plus the bundle, the now
+        and next timelines and the track partitions behind the
+        upcoming_panels tag. Returns how many pages and feeds there were.
+        '''
+        started = time.perf_counter()
+        get_end_times(convention)
+        get_bundle(convention)
+        get_partitions(convention)
+        tracks = [None] + sorted(get_track_ids(convention))
+
+        count = 0
+        for addl_filter in self.filters:
+            for track in tracks:
+                for view_class in self.views:
+                    view = self.view(view_class, convention, addl_filter, track)
+                    view.cached_for_variant('packed', view.build_struct)
+                    count += 1
+                for feed_class in self.feeds:
+                    async_to_sync(self.view(feed_class, convention, addl_filter, track).abody)()
+                    count += 1
+
+        self.log('Warmed {} pages and feeds for {} ({}) in {:.2f}s'.format(
+            count, convention, reason, time.perf_counter() - started))
+        return count